@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Business, Users, Event, Review, Inventory, Messages, BusinessImages
+from .models import Business, Users, Event, Review, Inventory, Messages, BusinessImages, ZipcodeCentroid, BusinessRating, Conversation, OpeningHours
 
 @admin.register(Business)
 class BusinessAdmin(admin.ModelAdmin):
@@ -47,3 +47,26 @@ class MessagesAdmin(admin.ModelAdmin):
 class BusinessImagesAdmin(admin.ModelAdmin):
     list_display = ['business', 'image_1', 'image_2', 'image_3', 'image_4']
     search_fields = ['business__b_name']
+
+
+@admin.register(ZipcodeCentroid)
+class ZipcodeCentroidAdmin(admin.ModelAdmin):
+    list_display = ['zipcode', 'latitude', 'longitude']
+    search_fields = ['zipcode']
+
+@admin.register(BusinessRating)
+class BusinessRatingAdmin(admin.ModelAdmin):
+    list_display = ['business', 'review_count', 'average', 'last_review_at']
+    search_fields = ['business__b_name']
+    ordering = ['-average']
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ['business', 'user', 'message_count', 'unread_count', 'last_date']
+    search_fields = ['business__b_name', 'user__username']
+    ordering = ['-last_date']
+
+@admin.register(OpeningHours)
+class OpeningHoursAdmin(admin.ModelAdmin):
+    list_display = ['business', 'start', 'end']
+    search_fields = ['business__b_name']
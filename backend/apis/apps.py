@@ -1,6 +1,32 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(sender, using, **kwargs):
+    from . import search
+
+    search.create_index(using)
+
+
+def reconcile_ratings(sender, using, **kwargs):
+    # Businesses reviewed before BusinessRating existed have no row yet
+    from . import caching
+    from .models import Business, BusinessRating
+
+    ids = list(
+        Business.objects.using(using).filter(rating__isnull=True, review__isnull=False)
+        .order_by('id').values_list('id', flat=True).distinct()
+    )
+    for start in range(0, len(ids), 1000):
+        BusinessRating.rebuild(ids[start:start + 1000], using=using)
+    if ids:
+        caching.invalidate('businesses', 'businesses:bulk', using=using)
 
 
 class ApisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apis'
+
+    def ready(self):
+        post_migrate.connect(create_search_index, sender=self)
+        post_migrate.connect(reconcile_ratings, sender=self)
@@ -0,0 +1,123 @@
+"""
+Async login and signup for the ASGI deployment (backend.asgi).
+
+They accept the same input and return the same bodies as LoginView and
+UserSignUpView, share HourlyRateThrottle's limits with them, and hash
+passwords in the bounded pool from passwords.py. A burst of logins then
+waits on those threads while the event loop keeps serving other requests.
+When the pool's queue is full they answer 503 with Retry-After.
+
+Login also upgrades the stored hash when PASSWORD_HASHERS or the hasher's
+work factor changed since the password was set.
+"""
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import passwords
+from .models import Users
+from .serializers import UserSignUpSerializer
+from .views import HourlyRateThrottle
+
+OVERLOADED_RETRY_AFTER = 1
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    data = request.POST.copy()
+    data.update(request.FILES)
+    return data
+
+
+def throttled(request):
+    """A 429 response when the client is over HourlyRateThrottle's limit, else None."""
+    throttle = HourlyRateThrottle()
+    if throttle.acquire(throttle.client_key(request)):
+        return None
+    response = JsonResponse({'detail': throttle.message}, status=429)
+    response['Retry-After'] = str(math.ceil(throttle.wait()))
+    return response
+
+
+def overloaded():
+    response = JsonResponse({'detail': 'The server is busy, please retry shortly.'}, status=503)
+    response['Retry-After'] = str(OVERLOADED_RETRY_AFTER)
+    return response
+
+
+def malformed():
+    return JsonResponse({'detail': 'Malformed request body.'}, status=400)
+
+
+# Token endpoints, like the DRF views, which are CSRF exempt too
+@csrf_exempt
+async def login(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    # The store may block on SQLite's file lock; keep it off the event loop
+    rejected = await sync_to_async(throttled)(request)
+    if rejected is not None:
+        return rejected
+    data = request_data(request)
+    if data is None:
+        return malformed()
+    username = data.get('username')
+    password = data.get('password')
+    if not isinstance(username, str) or not isinstance(password, str):
+        return JsonResponse({'error': 'Invalid credentials'}, status=401)
+
+    user = await Users.objects.filter(**{Users.USERNAME_FIELD: username}).afirst()
+    try:
+        # Unknown users are hashed against too, so timing does not reveal them
+        valid, new_hash = await passwords.run(passwords.verify, password, user.password if user else None)
+    except passwords.Overloaded:
+        return overloaded()
+    if not valid or not user.is_active:
+        return JsonResponse({'error': 'Invalid credentials'}, status=401)
+
+    if new_hash is not None:
+        user.password = new_hash
+        await user.asave(update_fields=['password'])
+
+    refresh = RefreshToken.for_user(user)
+    return JsonResponse({
+        'userId': user.id,
+        'username': user.username,
+        'refresh': str(refresh),
+        'is_business_owner': user.is_business_owner,
+        'access': str(refresh.access_token),
+    }, status=200)
+
+
+@csrf_exempt
+async def signup(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    # The store may block on SQLite's file lock; keep it off the event loop
+    rejected = await sync_to_async(throttled)(request)
+    if rejected is not None:
+        return rejected
+    data = request_data(request)
+    if data is None:
+        return malformed()
+
+    serializer = UserSignUpSerializer(data=data)
+    # Validation checks the username against the database
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=400)
+    try:
+        password_hash = await passwords.run(make_password, serializer.validated_data['password'])
+    except passwords.Overloaded:
+        return overloaded()
+    await sync_to_async(serializer.save)(password_hash=password_hash)
+    return JsonResponse({'message': 'User created successfully!'}, status=201)
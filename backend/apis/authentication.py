@@ -0,0 +1,127 @@
+"""
+JWT authentication without a Users query per request.
+
+simplejwt's JWTAuthentication loads the user by primary key on every
+authenticated request, although the token has already been verified.
+CachedJWTAuthentication keeps recently seen users in a small per-process
+LRU cache with a TTL. Each hit builds a fresh Users instance from the
+cached row, so request.user (and checks such as IsBusinessOwnerPermission
+reading is_business_owner) costs no query and no request can modify
+another's copy.
+
+Saving or deleting a Users row evicts it from the cache of the process that
+wrote it (see models.py); other processes pick the change up when the entry
+expires, so keep the TTL short.
+
+Enable it with:
+
+    REST_FRAMEWORK = {
+        'DEFAULT_AUTHENTICATION_CLASSES': ['apis.authentication.CachedJWTAuthentication'],
+    }
+
+Settings:
+    APIS_AUTH_USER_CACHE_SIZE  users kept per process (default: 1024)
+    APIS_AUTH_USER_CACHE_TTL   seconds an entry is trusted (default: 60)
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from . import metrics
+
+
+class UserCache:
+    """
+    Per-process LRU of Users rows. Keys are stored as strings because token
+    claims carry the id as one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'APIS_AUTH_USER_CACHE_SIZE', 1024)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'APIS_AUTH_USER_CACHE_TTL', 60)
+
+    def get(self, model, key):
+        key = str(key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, db, field_names, values = entry
+            if expires <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return model.from_db(db, field_names, values)
+
+    def set(self, key, user):
+        key = str(key)
+        field_names = [field.attname for field in user._meta.concrete_fields]
+        entry = (
+            time.monotonic() + self.ttl,
+            user._state.db,
+            field_names,
+            tuple(getattr(user, name) for name in field_names),
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(str(key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+def evict_user(user, using=None):
+    key = getattr(user, api_settings.USER_ID_FIELD)
+    user_cache.evict(key)
+    # A request that read the old row before the commit could cache it again
+    transaction.on_commit(lambda: user_cache.evict(key), using=using)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+        user = user_cache.get(self.user_model, user_id)
+        metrics.inc('apis_cache_requests_total', cache='auth_user', result='miss' if user is None else 'hit')
+        if user is None:
+            # Looks the user up and applies simplejwt's checks
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+            return user
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
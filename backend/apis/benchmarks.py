@@ -0,0 +1,319 @@
+"""
+Endpoint benchmarks.
+
+`manage.py seed_data` fills the database with synthetic rows in bulk, and
+`manage.py benchmark` then times every URL in apis/urls.py against it:
+
+    python manage.py seed_data --businesses 10000 --reviews 1000000
+    python manage.py benchmark --output benchmarks/baseline.json
+    # after a change
+    python manage.py benchmark --compare benchmarks/baseline.json
+
+Each case goes through Django's test client in-process. A few warm-up
+requests come first, then `repeat` timed ones give the p50/p99 latency.
+One more request runs with the queries captured and tracemalloc on, for the
+query count and peak memory; both slow a request down, so they stay out of
+the timed runs. Cases that write run in a transaction that is rolled back,
+so the data stays the same from one run to the next. Every request comes
+from its own client address, so HourlyRateThrottle counts it without
+refusing it.
+
+The baseline is JSON keyed by case; `compare` lists the cases whose p99 or
+query count grew beyond the tolerance.
+"""
+import asyncio
+import contextlib
+import datetime
+import itertools
+import math
+import time
+import tracemalloc
+from io import BytesIO
+
+from asgiref.sync import async_to_sync
+from django import get_version
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import urls
+from .models import (
+    Business, BusinessImages, BusinessRating, Conversation, Event, Inventory, Messages, Review, UploadSession, Users,
+)
+
+FORMAT_VERSION = 1
+# Every user seed_data creates has this password; the login cases use it
+SEED_PASSWORD = 'seed-password'
+# Password hashing dominates these; a few samples are enough (an upper bound)
+HASHING_REPEAT = 5
+
+_addresses = itertools.count(1)
+
+
+def next_address():
+    n = next(_addresses) % (1 << 24)
+    return '10.%d.%d.%d' % (n >> 16, (n >> 8) & 255, n & 255)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+def jpeg(name='photo.jpg'):
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), (200, 30, 30)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class Samples:
+    """Existing rows the cases point at: the most reviewed business and its related rows."""
+
+    def __init__(self):
+        rating = BusinessRating.objects.select_related('business__owner').order_by('-review_count').first()
+        self.business = rating.business if rating else Business.objects.select_related('owner').first()
+        if self.business is None:
+            return
+        self.owner = self.business.owner
+        related = {'business': self.business}
+        self.review = Review.objects.filter(**related).first() or Review.objects.first()
+        self.event = Event.objects.filter(**related).first() or Event.objects.first()
+        self.inventory = Inventory.objects.filter(**related).first() or Inventory.objects.first()
+        self.message = Messages.objects.filter(**related).order_by('-id').first() or Messages.objects.first()
+        self.images = BusinessImages.objects.first()
+        # Batch page requests: the sample business and a few others
+        self.page_ids = [self.business.pk] + list(
+            Business.objects.exclude(pk=self.business.pk).order_by('id').values_list('id', flat=True)[:9]
+        )
+        self.conversation = (
+            Conversation.objects.filter(message_count__gt=0, **related).first()
+            or Conversation.objects.filter(message_count__gt=0).first()
+        )
+        self.user = self.conversation.user if self.conversation else Users.objects.exclude(pk=self.owner.pk).first()
+
+    def __bool__(self):
+        return self.business is not None
+
+
+class Case:
+    def __init__(self, name, label='', method='get', kwargs=None, query=None, data=None, content_type=None,
+                 user=None, writes=False, stream=False, repeat=None, prepare=None):
+        self.name = name
+        self.key = '%s[%s]' % (name, label) if label else name
+        self.method = method
+        self.kwargs = kwargs or {}
+        self.query = query or {}
+        # A dict, or a callable taking the request number for data that must differ each time
+        self.data = data
+        self.content_type = content_type
+        self.user = user
+        self.writes = writes
+        self.stream = stream
+        self.repeat = repeat
+        # Called inside the case's transaction; returns extra URL kwargs
+        self.prepare = prepare
+        self.headers = {}
+
+    def path(self):
+        path = reverse(self.name, kwargs=self.kwargs)
+        return path + '?' + urlencode(self.query) if self.query else path
+
+    def setup(self):
+        if self.prepare is not None:
+            self.kwargs.update(self.prepare())
+        if self.user is not None:
+            self.headers['HTTP_AUTHORIZATION'] = 'Bearer %s' % AccessToken.for_user(self.user)
+
+    def request(self, client, n):
+        extra = dict(self.headers, REMOTE_ADDR=next_address())
+        if self.stream:
+            return async_to_sync(self.first_event)(extra)
+        kwargs = {'content_type': self.content_type} if self.content_type else {}
+        data = self.data(n) if callable(self.data) else self.data
+        response = getattr(client, self.method)(self.path(), data, **kwargs, **extra)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response.status_code
+
+    async def first_event(self, extra):
+        # AsyncClient puts extra keys into the ASGI scope, so headers go through headers=
+        headers = {name[5:].replace('_', '-'): value for name, value in extra.items() if name.startswith('HTTP_')}
+        response = await AsyncClient().get(self.path(), headers=headers)
+        stream = aiter(response.streaming_content)
+        await anext(stream)
+        # Cancelling a pending read is how a disconnect ends the stream
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with contextlib.suppress(asyncio.CancelledError, StopAsyncIteration):
+            await pending
+        return response.status_code
+
+
+def build_cases(samples):
+    """The cases to run, and {url name: reason} for the URLs that have none."""
+    business, owner, user = samples.business, samples.owner, samples.user
+    cases = [
+        Case('business-list-create'),
+        Case('business-list-create', 'search', query={'q': 'coffee'}),
+        Case('business-list-create', 'compact', query={'compact': 'true'}),
+        Case('business-list-create', 'rating', query={'ordering': '-rating'}),
+        Case('business-detail', kwargs={'pk': business.pk}),
+        Case('business-page', kwargs={'pk': business.pk}),
+        Case('business-pages', query={'ids': ','.join(map(str, samples.page_ids))}),
+        Case('business-owner-list', user=owner),
+        Case('business-export', kwargs={'pk': business.pk, 'kind': 'reviews', 'fmt': 'ndjson'}, user=owner),
+        Case('users-list-create'),
+        Case('event-list-create', query={'business': business.pk}),
+        Case('review-list-create'),
+        Case('review-list-create', 'business', query={'business': business.pk}),
+        Case('inventory-list-create', query={'business': business.pk}),
+        Case(
+            'inventory-import', method='post', query={'business': business.pk}, user=owner, writes=True,
+            content_type='text/csv',
+            data='product_name,description,quantity,price\n' + ''.join(
+                'Benchmark product %d,Imported,%d,%d.99\n' % (n, n, n) for n in range(100)
+            ),
+        ),
+        Case('messages-list-create', query={'business': business.pk}),
+        Case('messages-stream', query={'business': business.pk}, user=owner, stream=True),
+        Case('business-images-list-create'),
+        Case('upload-create', method='post', user=owner, writes=True, data={'filename': 'photo.jpg', 'size': 4096}),
+        Case(
+            'upload-detail', user=owner, writes=True,
+            prepare=lambda: {'pk': UploadSession.objects.create(owner=owner, filename='photo.jpg', size=4096).pk},
+        ),
+        Case(
+            'user_signup', method='post', writes=True, repeat=HASHING_REPEAT,
+            data=lambda n: {'username': 'benchmark%d' % n, 'password': 'benchmark', 'location': 'Here', 'profile_picture': jpeg()},
+        ),
+        Case(
+            'user_login', method='post', repeat=HASHING_REPEAT,
+            data={'username': owner.username, 'password': SEED_PASSWORD},
+        ),
+        Case(
+            'user_signup_async', method='post', writes=True, repeat=HASHING_REPEAT,
+            data=lambda n: {'username': 'benchmark%d' % n, 'password': 'benchmark', 'location': 'Here', 'profile_picture': jpeg()},
+        ),
+        Case(
+            'user_login_async', method='post', repeat=HASHING_REPEAT, content_type='application/json',
+            data={'username': owner.username, 'password': SEED_PASSWORD},
+        ),
+    ]
+    skipped = {}
+    for name, sample, case in [
+        ('users-detail', user, lambda: Case('users-detail', kwargs={'pk': user.pk})),
+        ('event-detail', samples.event, lambda: Case('event-detail', kwargs={'pk': samples.event.pk})),
+        ('review-detail', samples.review, lambda: Case('review-detail', kwargs={'pk': samples.review.pk})),
+        ('inventory-detail', samples.inventory, lambda: Case('inventory-detail', kwargs={'pk': samples.inventory.pk})),
+        ('messages-detail', samples.message, lambda: Case('messages-detail', kwargs={'pk': samples.message.pk})),
+        ('business-images-detail', samples.images, lambda: Case('business-images-detail', kwargs={'pk': samples.images.pk})),
+        ('conversation-list', samples.conversation, lambda: Case(
+            'conversation-list', query={'user': user.pk}, user=user,
+        )),
+        ('conversation-read', samples.conversation, lambda: Case(
+            'conversation-read', method='post', kwargs={'pk': samples.conversation.pk}, user=user, writes=True,
+        )),
+    ]:
+        if sample is None:
+            skipped[name] = 'no rows to request'
+        else:
+            cases.append(case())
+    if business.latitude is not None:
+        cases.append(Case('business-list-create', 'near', query={'near': business.zipcode, 'radius_km': 25}))
+    return cases, skipped
+
+
+def url_names():
+    return [pattern.name for pattern in urls.urlpatterns]
+
+
+def measure(case, repeat, warmup):
+    client = Client()
+    with contextlib.ExitStack() as stack:
+        if case.writes:
+            stack.enter_context(transaction.atomic())
+        case.setup()
+        repeat = min(repeat, case.repeat or repeat)
+        for n in range(warmup):
+            case.request(client, n)
+
+        timings = []
+        statuses = set()
+        for n in range(warmup, warmup + repeat):
+            start = time.perf_counter()
+            statuses.add(case.request(client, n))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                case.request(client, warmup + repeat)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        if case.writes:
+            transaction.set_rollback(True)
+
+    return {
+        'method': case.method.upper(),
+        'path': case.path(),
+        'status': sorted(statuses),
+        'repeat': repeat,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': len(queries.captured_queries),
+        'peak_memory_kib': round(peak / 1024, 1),
+    }
+
+
+def run(cases, repeat=30, warmup=3, progress=None):
+    results = {}
+    for case in cases:
+        results[case.key] = measure(case, repeat, warmup)
+        if progress is not None:
+            progress(case.key, results[case.key])
+    return results
+
+
+def baseline(results, skipped):
+    return {
+        'version': FORMAT_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'django': get_version(),
+        'database': connection.vendor,
+        'rows': {
+            model._meta.model_name: model.objects.count()
+            for model in (Users, Business, Review, Messages, Inventory, Event)
+        },
+        'skipped': skipped,
+        'results': results,
+    }
+
+
+def compare(old, new, tolerance=0.25, min_delta_ms=1.0):
+    """
+    [(case, metric, old value, new value)] for every case in both runs whose
+    p99 grew by more than `tolerance` (and `min_delta_ms`, so sub-millisecond
+    noise is ignored) or that makes more queries than before.
+    """
+    regressions = []
+    for key, result in new['results'].items():
+        before = old.get('results', {}).get(key)
+        if before is None:
+            continue
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance) and result['p99_ms'] - before['p99_ms'] >= min_delta_ms:
+            regressions.append((key, 'p99_ms', before['p99_ms'], result['p99_ms']))
+        if result['queries'] > before['queries']:
+            regressions.append((key, 'queries', before['queries'], result['queries']))
+    return regressions
+
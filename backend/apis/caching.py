@@ -0,0 +1,127 @@
+"""
+Server-side response cache for read-heavy GET endpoints.
+
+Rendered responses are stored under a key built from the host, path,
+normalized query parameters, negotiated media type and the current version
+of every "scope" the response depends on (e.g. `business:12`, `events`).
+Writes never delete entries: model signals (see models.py) stamp the
+affected scopes with a new version after the transaction commits, so every
+key built afterwards is new and stale entries simply age out. Versions and
+entries both live in the configured cache, so invalidation is seen by every
+worker as long as that cache is shared (Redis, Memcached, database or file
+based) rather than the default per-process LocMemCache.
+
+Settings:
+    APIS_RESPONSE_CACHE          cache alias to use (default: 'default')
+    APIS_RESPONSE_CACHE_TIMEOUT  seconds to keep a response (default: 300)
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import metrics
+
+KEY_PREFIX = 'apis:response'
+
+
+def get_cache():
+    return caches[getattr(settings, 'APIS_RESPONSE_CACHE', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'APIS_RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def scope_key(scope):
+    return '%s:scope:%s' % (KEY_PREFIX, scope)
+
+
+def scope_versions(scopes):
+    """Current version (a nanosecond timestamp) of each scope, in order."""
+    cache = get_cache()
+    keys = [scope_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = time.time_ns()
+        for key in missing:
+            # add() keeps whatever another worker stored first
+            cache.add(key, now, None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+def invalidate(*scopes, using=DEFAULT_DB_ALIAS):
+    """Give `scopes` a new version once the current transaction commits."""
+    keys = [scope_key(scope) for scope in scopes]
+
+    def bump():
+        now = time.time_ns()
+        get_cache().set_many({key: now for key in keys}, None)
+
+    transaction.on_commit(bump, using=using)
+
+
+def response_key(request, versions):
+    params = sorted(request.query_params.lists())
+    raw = repr((
+        request.get_host(), request.path, params,
+        getattr(request, 'accepted_media_type', None), versions,
+    ))
+    return '%s:%s' % (KEY_PREFIX, hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+
+class CachedResponseMixin:
+    """
+    Serve GET responses from the response cache, with ETag/Last-Modified
+    so conditional requests get a 304 without touching the ORM or the
+    serializer. Views list the scopes they read in `cache_scopes` (or
+    `get_cache_scopes()`); only 200 responses are stored.
+    """
+    cache_scopes = ()
+
+    def get_cache_scopes(self):
+        return self.cache_scopes
+
+    def should_cache_response(self, request):
+        return True
+
+    def get(self, request, *args, **kwargs):
+        if not self.should_cache_response(request):
+            return super().get(request, *args, **kwargs)
+
+        cache = get_cache()
+        versions = scope_versions(self.get_cache_scopes())
+        key = response_key(request, versions)
+        entry = cache.get(key)
+        metrics.inc('apis_cache_requests_total', cache='response', result='miss' if entry is None else 'hit')
+
+        if entry is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response = self.finalize_response(request, response, *args, **kwargs)
+            response.render()
+            entry = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': quote_etag(hashlib.md5(response.content).hexdigest()),
+            }
+            cache.set(key, entry, get_timeout())
+
+        # Versions are nanosecond timestamps of the last change to each scope
+        last_modified = max(versions, default=0) // 1_000_000_000 or None
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response['ETag'] = entry['etag']
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'no-cache'
+        return get_conditional_response(
+            request, etag=entry['etag'], last_modified=last_modified, response=response,
+        )
@@ -0,0 +1,125 @@
+"""
+Streaming exports of reviews, inventory and messages.
+
+Rows are read with `values().iterator(chunk_size=...)`, so the database
+cursor is consumed a chunk at a time instead of materializing the whole
+table, and the business and user names the list serializers show are
+looked up once per chunk rather than once per row. The output generators
+yield one encoded line at a time, ready for a StreamingHttpResponse or a
+file, so time-to-first-byte and peak memory do not grow with the table.
+"""
+import csv
+import datetime
+import json
+from decimal import Decimal
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Business, Inventory, Messages, Review, Users
+
+CHUNK_SIZE = 2000
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Export:
+    def __init__(self, model, columns, fields):
+        self.model = model
+        # Database columns read for each row
+        self.columns = columns
+        # Output fields, in order; business_name/user_name are resolved per chunk
+        self.fields = fields
+
+    def queryset(self, business=None):
+        queryset = self.model.objects.order_by('pk')
+        if business is not None:
+            queryset = queryset.filter(business=business)
+        return queryset.values(*self.columns)
+
+    def rows(self, business=None, chunk_size=CHUNK_SIZE):
+        iterator = self.queryset(business).iterator(chunk_size=chunk_size)
+        business_names = {}
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                return
+            if 'business_name' in self.fields:
+                wanted = {row['business'] for row in chunk} - business_names.keys()
+                if wanted:
+                    business_names.update(Business.objects.filter(pk__in=wanted).values_list('pk', 'b_name'))
+            user_names = {}
+            if 'user_name' in self.fields:
+                user_names = dict(
+                    Users.objects.filter(pk__in={row['user'] for row in chunk}).values_list('pk', 'username')
+                )
+            for row in chunk:
+                if 'business_name' in self.fields:
+                    row['business_name'] = business_names.get(row['business'])
+                if 'user_name' in self.fields:
+                    row['user_name'] = user_names.get(row['user'])
+                yield {field: row[field] for field in self.fields}
+            # Only the names of one business are kept when exporting per business;
+            # bound the map for whole-table exports.
+            if len(business_names) > chunk_size:
+                business_names.clear()
+
+
+EXPORTS = {
+    'reviews': Export(
+        Review,
+        ['id', 'business', 'user', 'title', 'content', 'rating', 'likes', 'created_at'],
+        ['id', 'business', 'business_name', 'user', 'user_name', 'title', 'content', 'rating', 'likes', 'created_at'],
+    ),
+    'inventory': Export(
+        Inventory,
+        ['id', 'business', 'product_name', 'description', 'quantity', 'price', 'date_added', 'image'],
+        ['id', 'business', 'business_name', 'product_name', 'description', 'quantity', 'price', 'date_added', 'image'],
+    ),
+    'messages': Export(
+        Messages,
+        ['id', 'business', 'user', 'content', 'date', 'is_read'],
+        ['id', 'business', 'business_name', 'user', 'user_name', 'content', 'date', 'is_read'],
+    ),
+}
+
+
+def encode_ndjson(export, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+class _Line:
+    """csv.writer target that hands back each line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_csv(export, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(export.fields)
+    for row in rows:
+        yield writer.writerow([csv_value(row[field]) for field in export.fields])
+
+
+ENCODERS = {
+    'ndjson': encode_ndjson,
+    'csv': encode_csv,
+}
+
+
+def stream(kind, fmt, business=None, chunk_size=CHUNK_SIZE):
+    export = EXPORTS[kind]
+    return ENCODERS[fmt](export, export.rows(business, chunk_size=chunk_size))
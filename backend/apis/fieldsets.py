@@ -0,0 +1,160 @@
+"""
+Sparse fieldsets and compact lists.
+
+`?fields=id,b_name` keeps only the named fields of a response and
+`?exclude=description,work_time` drops the named ones. SparseFieldsMixin
+applies them before a ModelSerializer builds its fields, so unrequested
+fields are never constructed, and their image-variant lookups and other
+per-field work are skipped too.
+
+`?compact=true` on a list view with CompactListMixin goes further. When
+every wanted field is a plain column (possibly across a foreign key or
+one-to-one, such as `rating.average`) or a queryset annotation, rows come
+straight from `values()` with only those columns. Each value is converted
+by the serializer field's own to_representation, so the output matches the
+normal path without building a model instance per row. Without ?fields=,
+the view's `compact_fields` are used. When a wanted field needs the full
+object (a method field, image variants), the normal serializer path runs
+with the same fields.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import permissions, serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from . import profiling
+
+
+def split_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    """Honour ?fields= and ?exclude= on the top-level serializer of a read."""
+
+    def get_field_names(self, declared_fields, info):
+        names = super().get_field_names(declared_fields, info)
+        wanted, unwanted = self.get_sparse_fields()
+        if wanted is None and not unwanted:
+            return names
+        unknown = (set(wanted or ()) | set(unwanted)) - set(names)
+        if unknown:
+            raise ValidationError({'fields': 'Unknown field(s): %s.' % ', '.join(sorted(unknown))})
+        if wanted is not None:
+            names = [name for name in names if name in wanted]
+        return [name for name in names if name not in unwanted]
+
+    def get_sparse_fields(self):
+        """(names to keep or None for all, names to drop)."""
+        # Nested serializers always render in full
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return None, []
+        request = self.context.get('request')
+        # Writes validate every field
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return None, []
+        wanted = split_names(request.query_params.get('fields')) or self.context.get('default_fields')
+        return wanted, split_names(request.query_params.get('exclude'))
+
+
+def resolve_column(model, source_attrs):
+    """The values() path for a dotted serializer source, or None if it is not a column."""
+    path = []
+    field = None
+    for position, attr in enumerate(source_attrs):
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None, None
+        if field.many_to_many or field.one_to_many:
+            return None, None
+        path.append(field.name)
+        if position < len(source_attrs) - 1:
+            if field.related_model is None:
+                return None, None
+            model = field.related_model
+    if field.is_relation:
+        # A foreign key renders as its id
+        return '__'.join(path[:-1] + [field.attname]), field
+    return '__'.join(path), field
+
+
+def compact_columns(serializer, queryset):
+    """
+    {output name: (values() path, model field or None)} for the serializer's
+    fields, or None when one of them needs the full object.
+    """
+    annotations = set(queryset.query.annotations)
+    columns = {}
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            return None
+        if getattr(field, 'requires_instance', False):
+            return None
+        if len(field.source_attrs) == 1 and field.source in annotations:
+            columns[name] = (field.source, None)
+            continue
+        path, model_field = resolve_column(queryset.model, field.source_attrs)
+        if path is None:
+            return None
+        columns[name] = (path, model_field)
+    return columns
+
+
+class CompactListMixin:
+    compact_query_param = 'compact'
+    # Fields of a compact row when the client does not pass ?fields=
+    compact_fields = None
+
+    def is_compact(self):
+        return self.request.query_params.get(self.compact_query_param) == 'true'
+
+    def get_compact_fields(self):
+        return self.compact_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request.method in permissions.SAFE_METHODS and self.is_compact():
+            context['default_fields'] = self.get_compact_fields()
+        return context
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_compact():
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer(many=True)
+        columns = compact_columns(serializer.child, queryset)
+        if columns is None:
+            return super().list(request, *args, **kwargs)
+
+        paths = list(dict.fromkeys(path for path, _ in columns.values()))
+        # Keyset pagination reads its ordering columns from each row
+        ordering = getattr(self, 'get_cursor_ordering', lambda: getattr(self, 'cursor_ordering', ()))()
+        hidden = [name.lstrip('-') for name in ordering if name.lstrip('-') not in paths]
+        rows = queryset.values(*paths, *hidden)
+
+        page = self.paginate_queryset(rows)
+        with profiling.span('serialize'):
+            data = [self.compact_row(row, columns, serializer.child.fields) for row in (rows if page is None else page)]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    @staticmethod
+    def compact_row(row, columns, fields):
+        result = {}
+        for name, (path, model_field) in columns.items():
+            value = row[path]
+            if value is None:
+                result[name] = None
+                continue
+            if isinstance(model_field, models.FileField):
+                value = model_field.attr_class(None, model_field, value)
+            result[name] = fields[name].to_representation(value)
+        return result
@@ -0,0 +1,63 @@
+"""
+Proximity helpers for zipcode-based "near me" queries.
+
+Candidates are narrowed with a latitude/longitude bounding box (served by
+the `business_lat_lon_idx` index) before the exact haversine distance is
+computed, so only rows inside the box pay for the trigonometry.
+"""
+import math
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.045
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return (min_lat, max_lat, min_lon, max_lon) enclosing the circle."""
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6:
+        lon_delta = 180.0
+    else:
+        lon_delta = min(radius_km / (KM_PER_DEGREE_LAT * cos_lat), 180.0)
+    return (
+        max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0),
+        longitude - lon_delta, longitude + lon_delta,
+    )
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def distance_expression(latitude, longitude, lat_field='latitude', lon_field='longitude'):
+    """Haversine distance in km from (latitude, longitude) to the row's coordinates."""
+    lat0 = Value(math.radians(latitude), output_field=FloatField())
+    lon0 = Value(math.radians(longitude), output_field=FloatField())
+    lat = Radians(F(lat_field))
+    lon = Radians(F(lon_field))
+    a = Power(Sin((lat - lat0) / 2), 2) + Cos(lat0) * Cos(lat) * Power(Sin((lon - lon0) / 2), 2)
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(Sqrt(a))
+
+
+def filter_near(queryset, latitude, longitude, radius_km):
+    """
+    Keep rows within `radius_km` of the point, annotated with `distance_km`
+    and ordered nearest first.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    queryset = queryset.filter(latitude__range=(min_lat, max_lat))
+    # Boxes that cross the antimeridian wrap around; skip the longitude
+    # pre-filter there rather than splitting it in two.
+    if min_lon >= -180.0 and max_lon <= 180.0:
+        queryset = queryset.filter(longitude__range=(min_lon, max_lon))
+    return (
+        queryset
+        .annotate(distance_km=distance_expression(latitude, longitude))
+        .filter(distance_km__lte=radius_km)
+        .order_by('distance_km', 'id')
+    )
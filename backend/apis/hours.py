@@ -0,0 +1,119 @@
+"""
+Opening hours as indexed weekly intervals.
+
+Business.work_time is free-form JSON keyed by day name:
+
+    {"Monday": {"open": "09:00", "close": "17:00"},
+     "Sunday": {"open": "Closed", "close": "Closed"}, ...}
+
+On every save it is flattened into OpeningHours rows of [start, end)
+minutes since Monday 00:00, so "open at <moment>" is a single indexed range
+condition in SQL instead of parsing every business's JSON:
+
+- a close time at or before the open time runs past midnight into the next
+  day ("22:00"-"02:00");
+- equal open and close times mean open around the clock;
+- Sunday ranges that run into Monday are split at the end of the week;
+- "Closed", missing days and unparseable times add no interval.
+
+Times are wall-clock times in APIS_BUSINESS_TIME_ZONE (default:
+TIME_ZONE). `manage.py rebuild_opening_hours` backfills existing rows.
+"""
+import datetime
+import re
+import zoneinfo
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+TIME_RE = re.compile(r'^(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)?$', re.IGNORECASE)
+
+
+def time_zone():
+    return zoneinfo.ZoneInfo(getattr(settings, 'APIS_BUSINESS_TIME_ZONE', settings.TIME_ZONE))
+
+
+def parse_day(name):
+    name = str(name).strip().lower()
+    for index, day in enumerate(DAYS):
+        # "Monday", "monday", "Mon"
+        if len(name) >= 3 and day.startswith(name):
+            return index
+    return None
+
+
+def parse_time(value):
+    """Minutes after midnight for '9:30', '17:00', '24:00' or '5 pm'; None otherwise."""
+    match = TIME_RE.match(str(value or '').strip())
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem[0].lower() == 'p' else 0)
+    if minute > 59 or hour > 24 or (hour == 24 and minute):
+        return None
+    return hour * 60 + minute
+
+
+def intervals(work_time):
+    """[(start, end), ...] minutes since Monday 00:00, with end <= WEEK_MINUTES."""
+    if not isinstance(work_time, dict):
+        return []
+    result = []
+    for name, hours in work_time.items():
+        day = parse_day(name)
+        if day is None or not isinstance(hours, dict):
+            continue
+        opens, closes = parse_time(hours.get('open')), parse_time(hours.get('close'))
+        if opens is None or closes is None:
+            continue
+        if closes <= opens:
+            # Past midnight, or around the clock when the times are equal
+            closes += DAY_MINUTES
+        start, end = day * DAY_MINUTES + opens, day * DAY_MINUTES + closes
+        if end > WEEK_MINUTES:
+            result.append((start, WEEK_MINUTES))
+            start, end = 0, end - WEEK_MINUTES
+        result.append((start, end))
+    return sorted(result)
+
+
+def minute_of_week(moment):
+    """The week minute of an aware datetime (naive ones are taken as business time)."""
+    zone = time_zone()
+    if timezone.is_naive(moment):
+        moment = moment.replace(tzinfo=zone)
+    local = moment.astimezone(zone)
+    return local.weekday() * DAY_MINUTES + local.hour * 60 + local.minute
+
+
+def parse_moment(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def sync_business(business, using=None):
+    from .models import OpeningHours
+
+    rows = [OpeningHours(business=business, start=start, end=end) for start, end in intervals(business.work_time)]
+    with transaction.atomic(using=using):
+        OpeningHours.objects.using(using).filter(business=business).delete()
+        OpeningHours.objects.using(using).bulk_create(rows)
+
+
+def filter_open(queryset, moment):
+    from .models import OpeningHours
+
+    minute = minute_of_week(moment)
+    return queryset.filter(Exists(
+        OpeningHours.objects.filter(business=OuterRef('pk'), start__lte=minute, end__gt=minute)
+    ))
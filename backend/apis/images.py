@@ -0,0 +1,188 @@
+"""
+Resized image variants for uploaded pictures.
+
+After an image is saved, a small background pool renders `thumb`, `card`
+and `full` versions in WebP and JPEG, with EXIF orientation applied and all
+metadata stripped, and records them in ImageDerivative. Serializers expose
+them through ImageVariantsField; `manage.py generate_image_variants`
+backfills existing media.
+
+Settings:
+    APIS_IMAGE_VARIANTS_ASYNC  render in the background pool (default: True);
+                               when False, render right after commit
+    APIS_IMAGE_WORKERS         background threads (default: 2)
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels; images are never upscaled
+VARIANT_SIZES = {
+    'thumb': 200,
+    'card': 640,
+    'full': 1600,
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANT_ROOT = 'variants'
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+
+def image_fields():
+    """Map each model to the names of its image fields."""
+    from .models import Business, BusinessImages, Event, Inventory, Users
+
+    return {
+        Business: ['images'],
+        BusinessImages: ['image_1', 'image_2', 'image_3', 'image_4'],
+        Inventory: ['image'],
+        Event: ['image'],
+        Users: ['profile_picture'],
+    }
+
+
+def variant_path(source, variant, extension):
+    stem, _ = os.path.splitext(source)
+    return '%s/%s/%s.%s' % (VARIANT_ROOT, stem, variant, extension)
+
+
+def render_variants(source, storage=default_storage):
+    """Render and store every variant of `source`; returns the manifest."""
+    with storage.open(source, 'rb') as handle:
+        image = Image.open(handle)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+    manifest = {}
+    for variant, size in VARIANT_SIZES.items():
+        resized = image.convert('RGBA' if has_alpha else 'RGB')
+        resized.thumbnail((size, size), Image.LANCZOS)
+        entry = {'width': resized.width, 'height': resized.height}
+        for extension, (fmt, options) in FORMATS.items():
+            # JPEG has no alpha channel; flatten onto white
+            frame = resized
+            if fmt == 'JPEG' and has_alpha:
+                frame = Image.new('RGB', resized.size, (255, 255, 255))
+                frame.paste(resized, mask=resized.getchannel('A'))
+            buffer = BytesIO()
+            # Saving without exif=/icc_profile= drops the original metadata
+            frame.save(buffer, fmt, **options)
+            path = variant_path(source, variant, extension)
+            if storage.exists(path):
+                storage.delete(path)
+            entry[extension] = storage.save(path, ContentFile(buffer.getvalue()))
+        manifest[variant] = entry
+    return manifest
+
+
+def generate(source):
+    from .models import ImageDerivative
+
+    manifest = render_variants(source)
+    ImageDerivative.objects.update_or_create(source=source, defaults={'variants': manifest})
+    return manifest
+
+
+def _run(source):
+    try:
+        generate(source)
+    except Exception:
+        logger.exception('Could not generate image variants for %s', source)
+    finally:
+        _pending.discard(source)
+
+
+def _run_in_worker(source):
+    try:
+        _run(source)
+    finally:
+        # Worker threads own their database connections
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'APIS_IMAGE_WORKERS', 2),
+                thread_name_prefix='image-variants',
+            )
+        return _executor
+
+
+def schedule(sources, using=None):
+    """Queue variant generation for `sources` once the transaction commits."""
+    sources = [source for source in dict.fromkeys(sources) if source]
+    if not sources:
+        return
+
+    def submit():
+        for source in sources:
+            # Skip images another save already queued
+            if source in _pending:
+                continue
+            _pending.add(source)
+            if getattr(settings, 'APIS_IMAGE_VARIANTS_ASYNC', True):
+                _get_executor().submit(_run_in_worker, source)
+            else:
+                _run(source)
+
+    transaction.on_commit(submit, using=using)
+
+
+def _stored_name(instance, field):
+    # Read the attribute dict rather than the descriptor, which would wrap
+    # the value in a FieldFile (or load it, for a deferred field)
+    value = instance.__dict__.get(field)
+    return getattr(value, 'name', value) or None
+
+
+def remember_names(instance):
+    """Note the image names an instance was loaded with (post_init)."""
+    instance._image_names = {field: _stored_name(instance, field) for field in image_fields().get(type(instance), [])}
+
+
+def schedule_for_instance(instance, using=None, created=True, update_fields=None):
+    """
+    Schedule variants for the images of a saved instance. Images an existing
+    row already had when it was loaded are skipped without a query, so saves
+    that do not touch them cost nothing here.
+    """
+    from .models import ImageDerivative
+
+    known = instance.__dict__.setdefault('_image_names', {})
+    names = []
+    for field in image_fields().get(type(instance), []):
+        if field not in instance.__dict__ or (update_fields is not None and field not in update_fields):
+            continue
+        name = _stored_name(instance, field)
+        if name and (created or known.get(field) != name):
+            names.append(name)
+        known[field] = name
+    if not names:
+        return
+    done = set(ImageDerivative.objects.using(using).filter(source__in=names).values_list('source', flat=True))
+    schedule([name for name in names if name not in done], using=using)
+
+
+def lookup(names):
+    from .models import ImageDerivative
+
+    return dict(ImageDerivative.objects.filter(source__in=names).values_list('source', 'variants'))
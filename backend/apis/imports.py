@@ -0,0 +1,164 @@
+"""
+Streaming bulk import of inventory rows.
+
+The request body (CSV with a header row, or NDJSON with one object per
+line) is read line by line straight from the request stream, validated
+with InventorySerializer's field rules and upserted by
+(business, product_name) in fixed-size batches, each in its own
+transaction. Only one batch is held in memory at a time, so memory stays
+flat however large the file is.
+"""
+import csv
+import json
+
+from django.db import transaction
+from rest_framework import serializers
+
+from . import caching
+from .models import Inventory
+
+CSV_TYPES = ('text/csv', 'application/csv')
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/jsonlines')
+UPDATE_FIELDS = ['description', 'quantity', 'price']
+
+
+class InventoryImportRowSerializer(serializers.ModelSerializer):
+    """
+    The Inventory field rules InventorySerializer applies, for one imported
+    row. Images are not imported; existing ones are left alone.
+    """
+
+    class Meta:
+        model = Inventory
+        fields = ['product_name', 'description', 'quantity', 'price']
+
+
+def invalid_encoding():
+    return ValueError('The line is not valid UTF-8 text.')
+
+
+def iter_lines(stream, invalid):
+    """
+    Decoded lines of `stream`. A line that is not valid UTF-8 is decoded
+    with replacement characters and its number added to `invalid`, so its
+    row is reported as an error instead of failing the whole import.
+    """
+    for line_number, raw in enumerate(iter(stream.readline, b''), start=1):
+        encoding = 'utf-8-sig' if raw.startswith(b'\xef\xbb\xbf') else 'utf-8'
+        try:
+            yield raw.decode(encoding)
+        except UnicodeDecodeError:
+            invalid.add(line_number)
+            yield raw.decode(encoding, errors='replace')
+
+
+def iter_csv(stream):
+    invalid = set()
+    reader = csv.DictReader(iter_lines(stream, invalid))
+    previous = 0
+    for row in reader:
+        # reader.line_num counts physical lines, which is what users see;
+        # a quoted value can span several of them
+        lines, previous = range(previous + 1, reader.line_num + 1), reader.line_num
+        if invalid.intersection(lines):
+            yield reader.line_num, invalid_encoding()
+            continue
+        yield reader.line_num, {key.strip(): value for key, value in row.items() if key}
+
+
+def iter_ndjson(stream):
+    invalid = set()
+    for line_number, line in enumerate(iter_lines(stream, invalid), start=1):
+        if line_number in invalid:
+            yield line_number, invalid_encoding()
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, exc
+            continue
+        yield line_number, row if isinstance(row, dict) else ValueError('Each line must be a JSON object.')
+
+
+class InventoryImporter:
+    batch_size = 500
+    max_reported_errors = 1000
+
+    def __init__(self, business, batch_size=None):
+        self.business = business
+        if batch_size:
+            self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        batch = {}
+        for line, row in rows:
+            values = self.validate(line, row)
+            if values is None:
+                continue
+            # A product repeated within a batch: the last row wins
+            batch.pop(values['product_name'], None)
+            batch[values['product_name']] = values
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = {}
+        if batch:
+            self.flush(batch)
+        return self.report()
+
+    def validate(self, line, row):
+        if isinstance(row, Exception):
+            self.fail(line, {'non_field_errors': [str(row)]})
+            return None
+        serializer = InventoryImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            self.fail(line, serializer.errors)
+            return None
+        return serializer.validated_data
+
+    def fail(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_reported_errors:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def flush(self, batch):
+        with transaction.atomic():
+            existing = {}
+            for item in (
+                Inventory.objects.filter(business=self.business, product_name__in=list(batch))
+                .only('id', 'product_name', *UPDATE_FIELDS)
+            ):
+                existing.setdefault(item.product_name, []).append(item)
+
+            to_update, to_create = [], []
+            for name, values in batch.items():
+                if name in existing:
+                    for item in existing[name]:
+                        for field in UPDATE_FIELDS:
+                            setattr(item, field, values.get(field, getattr(item, field)))
+                        to_update.append(item)
+                else:
+                    to_create.append(Inventory(business=self.business, **values))
+
+            if to_update:
+                Inventory.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=self.batch_size)
+            if to_create:
+                Inventory.objects.bulk_create(to_create, batch_size=self.batch_size)
+            # Bulk writes send no signals
+            caching.invalidate(f'inventory:{self.business.pk}')
+        self.updated += sum(len(existing[name]) for name in batch if name in existing)
+        self.created += len(to_create)
+
+    def report(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
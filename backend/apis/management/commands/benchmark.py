@@ -0,0 +1,91 @@
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from apis import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Time every URL in apis/urls.py against the current database (see seed_data) and report '
+        'p50/p99 latency, query count and peak memory. Optionally write the results as a baseline '
+        'or compare them with an earlier one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30, help='Timed requests per case.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per case first.')
+        parser.add_argument('--only', help='Run only the cases whose name contains this text.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='Report regressions against this baseline JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p99 growth (0.25 = 25%%).')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions.')
+        parser.add_argument('--cached', action='store_true', help='Serve GETs from the response cache.')
+
+    def handle(self, *args, **options):
+        samples = benchmarks.Samples()
+        if not samples:
+            raise CommandError('There are no businesses to request; run seed_data first.')
+        cases, skipped = benchmarks.build_cases(samples)
+        covered = {case.name for case in cases} | set(skipped)
+        for name in benchmarks.url_names():
+            if name not in covered:
+                skipped[name] = 'no benchmark case'
+        if options['only']:
+            cases = [case for case in cases if options['only'] in case.key]
+        for name, reason in skipped.items():
+            self.stderr.write(f'Skipping {name}: {reason}')
+
+        old = None
+        if options['compare']:
+            try:
+                old = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Cannot read {options["compare"]}: {exc}')
+
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        overrides = {
+            # Signups upload a picture; keep it out of the real media directory
+            'MEDIA_ROOT': media_root,
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        }
+        if not options['cached']:
+            overrides['CACHES'] = {
+                **settings.CACHES,
+                'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+            }
+            overrides['APIS_RESPONSE_CACHE'] = 'benchmark'
+        self.stdout.write(f'{"case":<45} {"status":<10} {"p50 ms":>9} {"p99 ms":>9} {"queries":>8} {"peak KiB":>10}')
+        try:
+            with override_settings(**overrides):
+                results = benchmarks.run(cases, options['repeat'], options['warmup'], progress=self.report)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        current = benchmarks.baseline(results, skipped)
+        if options['output']:
+            path = Path(options['output'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(current, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Wrote {path}.'))
+
+        if old is not None:
+            regressions = benchmarks.compare(old, current, options['tolerance'])
+            for key, metric, before, after in regressions:
+                self.stdout.write(self.style.WARNING(f'{key}: {metric} {before} -> {after}'))
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS('No regressions.'))
+            elif options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["compare"]}.')
+
+    def report(self, key, result):
+        status = ','.join(str(code) for code in result['status'])
+        self.stdout.write(
+            f'{key:<45} {status:<10} {result["p50_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+            f'{result["queries"]:>8} {result["peak_memory_kib"]:>10.1f}'
+        )
@@ -0,0 +1,51 @@
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from apis import images
+from apis.models import ImageDerivative
+from apis.storage import CAS_ROOT, ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed media files that no model references any more.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age-hours', type=float, default=24,
+                            help='Keep files younger than this; an upload may not be saved yet.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not ContentAddressedStorage.')
+
+        referenced = set()
+        for model, fields in images.image_fields().items():
+            for field in fields:
+                referenced.update(
+                    model.objects.exclude(**{field: ''}).order_by()
+                    .values_list(field, flat=True).distinct().iterator()
+                )
+        for variants in ImageDerivative.objects.values_list('variants', flat=True).iterator():
+            for entry in variants.values():
+                referenced.update(entry[ext] for ext in images.FORMATS if ext in entry)
+
+        cutoff = time.time() - options['min_age_hours'] * 3600
+        removed = 0
+        root = default_storage.path(CAS_ROOT)
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                name = os.path.relpath(full_path, default_storage.location).replace(os.sep, '/')
+                if name in referenced or os.path.getmtime(full_path) > cutoff:
+                    continue
+                removed += 1
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    default_storage.purge(name)
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {removed} unreferenced files.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apis import exports
+from apis.models import Business
+
+
+class Command(BaseCommand):
+    help = 'Stream reviews, inventory or messages to a file as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', dest='fmt', choices=sorted(exports.FORMATS), default='ndjson')
+        parser.add_argument('--business', type=int, help='Only export rows of this business.')
+        parser.add_argument('--output', default='-', help='File to write, or - for stdout.')
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        business = None
+        if options['business'] is not None:
+            business = Business.objects.filter(pk=options['business']).first()
+            if business is None:
+                raise CommandError(f"Business {options['business']} does not exist.")
+
+        lines = exports.stream(options['kind'], options['fmt'], business, chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        # newline='' so CSV keeps its own \r\n line endings
+        with open(options['output'], 'w', encoding='utf-8', newline='') as out:
+            out.writelines(lines)
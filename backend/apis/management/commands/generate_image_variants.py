@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+
+from apis import images
+from apis.models import ImageDerivative
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG variants for existing uploaded images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that already exist.')
+
+    def handle(self, *args, **options):
+        done = set()
+        if not options['force']:
+            done = set(ImageDerivative.objects.values_list('source', flat=True))
+
+        generated = failed = 0
+        for model, fields in images.image_fields().items():
+            for field in fields:
+                names = (
+                    model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                    .order_by().values_list(field, flat=True).distinct()
+                )
+                for name in names.iterator():
+                    if name in done:
+                        continue
+                    done.add(name)
+                    if not default_storage.exists(name):
+                        self.stderr.write(f'Missing file: {name}')
+                        failed += 1
+                        continue
+                    try:
+                        images.generate(name)
+                    except Exception as exc:
+                        self.stderr.write(f'Could not process {name}: {exc}')
+                        failed += 1
+                    else:
+                        generated += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {generated} images ({failed} failed).'))
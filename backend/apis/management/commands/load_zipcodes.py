@@ -0,0 +1,92 @@
+import csv
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from apis import caching
+from apis.models import Business, ZipcodeCentroid
+
+DEFAULT_PATH = Path(__file__).resolve().parents[2] / 'data' / 'zipcode_centroids.csv'
+
+# Column names accepted for each value: our own CSV layout and the Census
+# Bureau ZCTA gazetteer file (tab separated).
+COLUMNS = {
+    'zipcode': ('zipcode', 'zip', 'GEOID'),
+    'latitude': ('latitude', 'lat', 'INTPTLAT'),
+    'longitude': ('longitude', 'lon', 'lng', 'INTPTLONG'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Load zipcode centroids from a CSV file and refresh Business coordinates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_PATH), help='CSV or gazetteer file to load.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--replace', action='store_true', help='Delete existing centroids first.')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'{path} does not exist.')
+
+        with transaction.atomic():
+            if options['replace']:
+                ZipcodeCentroid.objects.all().delete()
+            loaded = self.load(path, options['batch_size'])
+            updated = self.refresh_businesses()
+
+        # Bulk updates skip model signals, so drop every cached business response
+        caching.invalidate('businesses', 'businesses:bulk')
+        self.stdout.write(self.style.SUCCESS(f'Loaded {loaded} zipcodes, updated {updated} businesses.'))
+
+    def load(self, path, batch_size):
+        loaded = 0
+        batch = []
+        with path.open(newline='', encoding='utf-8-sig') as handle:
+            dialect = csv.Sniffer().sniff(handle.read(4096), delimiters=',\t')
+            handle.seek(0)
+            reader = csv.DictReader(handle, dialect=dialect)
+            reader.fieldnames = [name.strip() for name in reader.fieldnames or []]
+            keys = {field: self.find_column(reader.fieldnames, names) for field, names in COLUMNS.items()}
+
+            for line, row in enumerate(reader, start=2):
+                try:
+                    batch.append(ZipcodeCentroid(
+                        zipcode=ZipcodeCentroid.normalize(row[keys['zipcode']]),
+                        latitude=float(row[keys['latitude']]),
+                        longitude=float(row[keys['longitude']]),
+                    ))
+                except (TypeError, ValueError):
+                    raise CommandError(f'{path}:{line}: invalid row {row!r}')
+                if len(batch) >= batch_size:
+                    loaded += self.flush(batch)
+            loaded += self.flush(batch)
+        return loaded
+
+    def find_column(self, fieldnames, names):
+        for name in names:
+            if name in fieldnames:
+                return name
+        raise CommandError(f'Missing column, expected one of: {", ".join(names)}')
+
+    def flush(self, batch):
+        count = len(batch)
+        if batch:
+            ZipcodeCentroid.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=['zipcode'],
+                update_fields=['latitude', 'longitude'],
+            )
+            batch.clear()
+        return count
+
+    def refresh_businesses(self):
+        centroid = ZipcodeCentroid.objects.filter(zipcode=OuterRef('zipcode'))
+        return Business.objects.update(
+            latitude=Subquery(centroid.values('latitude')[:1]),
+            longitude=Subquery(centroid.values('longitude')[:1]),
+        )
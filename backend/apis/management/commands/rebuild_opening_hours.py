@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apis import caching, hours
+from apis.models import Business, OpeningHours
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the OpeningHours intervals from Business.work_time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Businesses per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        businesses = Business.objects.order_by('id').values_list('id', 'work_time')
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(businesses.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            rows = [
+                OpeningHours(business_id=business_id, start=start, end=end)
+                for business_id, work_time in batch
+                for start, end in hours.intervals(work_time)
+            ]
+            with transaction.atomic():
+                OpeningHours.objects.filter(business_id__in=[business_id for business_id, _ in batch]).delete()
+                OpeningHours.objects.bulk_create(rows, batch_size=batch_size)
+            total += len(batch)
+            last_id = batch[-1][0]
+        # Bulk writes skip model signals, so drop every cached business response
+        caching.invalidate('businesses', 'businesses:bulk')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt opening hours for {total} businesses.'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apis import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the business full-text search index from the Business table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to rebuild.')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.is_available(using):
+            self.stderr.write('Full-text search needs SQLite 3.34+ with FTS5; nothing to do.')
+            return
+        with transaction.atomic(using=using):
+            count = search.rebuild_index(using)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} businesses.'))
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from apis.models import Business, Conversation, Messages
+
+
+class Command(BaseCommand):
+    help = 'Recompute Conversation summaries from the Messages table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Businesses per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        business_ids = Business.objects.order_by('id').values_list('id', flat=True)
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(business_ids.filter(id__gt=last_id)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                total += self.reconcile(ids)
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {total} conversations.'))
+
+    def reconcile(self, ids):
+        totals = (
+            Messages.objects.filter(business_id__in=ids)
+            .order_by()
+            .values('business_id', 'user_id')
+            .annotate(message_count=Count('id'), unread_count=Count('id', filter=Q(is_read=False)))
+        )
+        latest = {}
+        # The first message seen for a pair, newest first, is its last message
+        for pk, business_id, user_id, content, date in (
+            Messages.objects.filter(business_id__in=ids)
+            .order_by('business_id', '-date', '-id')
+            .values_list('id', 'business_id', 'user_id', 'content', 'date')
+            .iterator(chunk_size=2000)
+        ):
+            latest.setdefault((business_id, user_id), (pk, content, date))
+
+        rows = []
+        for row in totals:
+            pk, content, date = latest[(row['business_id'], row['user_id'])]
+            rows.append(Conversation(
+                business_id=row['business_id'],
+                user_id=row['user_id'],
+                message_count=row['message_count'],
+                unread_count=row['unread_count'],
+                last_message_id=pk,
+                last_preview=Conversation.preview(content),
+                last_date=date,
+            ))
+        # Pairs with no messages left keep an empty row; the rest are overwritten below
+        Conversation.objects.filter(business_id__in=ids).update(
+            message_count=0, unread_count=0, last_message=None, last_preview='', last_date=None,
+        )
+        fields = ['message_count', 'unread_count', 'last_message', 'last_preview', 'last_date']
+        Conversation.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['business', 'user'], update_fields=fields,
+        )
+        return len(rows)
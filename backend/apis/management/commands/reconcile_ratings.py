@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apis import caching
+from apis.models import Business, BusinessRating
+
+
+class Command(BaseCommand):
+    help = 'Recompute BusinessRating aggregates from the Review table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Businesses per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        business_ids = Business.objects.order_by('id').values_list('id', flat=True)
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(business_ids.filter(id__gt=last_id)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                total += BusinessRating.rebuild(ids)
+            last_id = ids[-1]
+        # Bulk updates skip model signals, so drop every cached business response
+        caching.invalidate('businesses', 'businesses:bulk')
+        self.stdout.write(self.style.SUCCESS(f'Reconciled ratings for {total} businesses.'))
@@ -0,0 +1,59 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apis.models import Business, BusinessImages
+
+TEMPORARY_DIR = 'temporary'
+
+
+class Command(BaseCommand):
+    help = (
+        'Move images left in media/temporary/ by the old two-step upload flow '
+        'to their business/<id>/... location and fix the stored names.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        moved = 0
+        targets = [
+            (Business, ['images']),
+            (BusinessImages, ['image_1', 'image_2', 'image_3', 'image_4']),
+        ]
+        for model, fields in targets:
+            for instance in model.objects.iterator():
+                for field in fields:
+                    moved += self.relocate(instance, field)
+        verb = 'Would move' if self.dry_run else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {moved} files.'))
+
+    def relocate(self, instance, field):
+        name = getattr(instance, field).name
+        if not name:
+            return 0
+        filename = os.path.basename(name)
+        temporary = os.path.join(TEMPORARY_DIR, filename)
+
+        if name.startswith(TEMPORARY_DIR + '/'):
+            # Never renamed: the row and the file both still point at temporary/
+            target = instance._meta.get_field(field).generate_filename(instance, filename)
+        elif not default_storage.exists(name) and default_storage.exists(temporary):
+            # Renamed in the database only; the file never moved
+            target = name
+        else:
+            return 0
+
+        self.stdout.write(f'{temporary} -> {target}')
+        if self.dry_run:
+            return 1
+        with transaction.atomic():
+            with default_storage.open(temporary, 'rb') as source:
+                saved = default_storage.save(target, source)
+            type(instance).objects.filter(pk=instance.pk).update(**{field: saved})
+        default_storage.delete(temporary)
+        return 1
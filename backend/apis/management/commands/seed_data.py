@@ -0,0 +1,190 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apis import caching
+from apis.benchmarks import SEED_PASSWORD, jpeg
+from apis.models import (
+    Business, BusinessImages, Event, Inventory, Messages, Review, Users, ZipcodeCentroid, default_work_time,
+)
+
+ADJECTIVES = ['Golden', 'Corner', 'Sunrise', 'Urban', 'Little', 'Old Town', 'Harbor', 'Maple', 'Blue', 'Happy']
+NOUNS = {
+    'RESTAURANT': ['Kitchen', 'Bistro', 'Diner', 'Grill', 'Noodle Bar', 'Taqueria'],
+    'BOOKSTORE': ['Books', 'Pages', 'Reading Room', 'Bookshop'],
+    'SALON': ['Salon', 'Barbers', 'Hair Studio', 'Spa'],
+    'SUPERMARKET': ['Market', 'Grocers', 'Foods', 'Pantry'],
+}
+STREETS = ['Main Street', 'Elm Road', 'Oak Avenue', 'Bakery Lane', 'Park Place', 'River Drive', 'Hill Street']
+WORDS = (
+    'fresh coffee bread friendly staff great prices quick service cozy quiet busy weekend brunch '
+    'selection quality clean parking delicious recommend return helpful owner local favorite'
+).split()
+PRODUCTS = ['Coffee', 'Croissant', 'Novel', 'Haircut', 'Apples', 'Olive Oil', 'Notebook', 'Shampoo', 'Tea', 'Cake']
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with synthetic users, businesses, reviews, messages, inventory, events '
+        'and business images for benchmarking. Rows are bulk inserted, then the derived tables (ratings, conversations, '
+        'opening hours, search index) are rebuilt.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--businesses', type=int, default=10000)
+        parser.add_argument('--reviews', type=int, default=1000000)
+        parser.add_argument('--messages', type=int, default=200000)
+        parser.add_argument('--inventory', type=int, default=100000)
+        parser.add_argument('--events', type=int, default=50000)
+        parser.add_argument('--images', type=int, default=100, help='BusinessImages rows, sharing one placeholder file.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT transaction.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        # Numbering continues after existing rows, so the command can be run again
+        self.offset = (Users.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+
+        user_ids = self.seed_users(options['users'])
+        business_ids = self.seed_businesses(options['businesses'], user_ids)
+        if business_ids:
+            self.seed_reviews(options['reviews'], business_ids, user_ids)
+            self.seed_messages(options['messages'], business_ids, user_ids)
+            self.seed_inventory(options['inventory'], business_ids)
+            self.seed_events(options['events'], business_ids)
+            self.seed_images(options['images'], business_ids)
+
+        # Bulk inserts skip the signals that maintain these
+        for command in ['reconcile_ratings', 'reconcile_conversations', 'rebuild_opening_hours', 'rebuild_search_index']:
+            call_command(command, stdout=self.stdout, stderr=self.stderr)
+        caching.invalidate('businesses', 'businesses:bulk', 'events')
+        self.stdout.write(self.style.SUCCESS('Seeding complete.'))
+
+    def insert(self, model, count, build):
+        """bulk_create `count` rows of `model`, `build(n)` making the n-th one."""
+        for start in range(0, count, self.batch_size):
+            rows = [build(n) for n in range(start, min(start + self.batch_size, count))]
+            with transaction.atomic():
+                model.objects.bulk_create(rows)
+        self.stdout.write(f'Inserted {count} {model.__name__} rows.')
+
+    def sentence(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+    def ago(self, days):
+        return self.now - datetime.timedelta(days=self.random.uniform(0, days))
+
+    def seed_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        prefix = 'seed%d_' % self.offset
+        self.insert(Users, count, lambda n: Users(
+            username='%s%d' % (prefix, n),
+            email='%s%d@example.com' % (prefix, n),
+            password=password,
+            location='Seedville',
+            zipcode='%05d' % self.random.randrange(100000),
+            is_business_owner=n % 5 == 0,
+        ))
+        return list(Users.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+    def seed_businesses(self, count, user_ids):
+        owners = [pk for n, pk in enumerate(user_ids) if n % 5 == 0] or user_ids
+        if not owners:
+            return []
+        centroids = list(ZipcodeCentroid.objects.values_list('zipcode', 'latitude', 'longitude')[:5000])
+        work_time = default_work_time()
+        last_id = Business.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        def build(n):
+            category = self.random.choice(list(NOUNS))
+            # Business.save() is skipped, so coordinates are copied here
+            zipcode, latitude, longitude = (
+                self.random.choice(centroids) if centroids else ('%05d' % self.random.randrange(100000), None, None)
+            )
+            return Business(
+                b_name='%s %s' % (self.random.choice(ADJECTIVES), self.random.choice(NOUNS[category])),
+                owner_id=self.random.choice(owners),
+                address='%d %s' % (self.random.randrange(1, 999), self.random.choice(STREETS)),
+                zipcode=zipcode,
+                latitude=latitude,
+                longitude=longitude,
+                # Unique, and clear of the 10-digit numbers real data uses
+                phone='9%011d' % (last_id + 1 + n),
+                description=self.sentence(12),
+                category=category,
+                work_time=work_time,
+            )
+
+        self.insert(Business, count, build)
+        return list(Business.objects.filter(id__gt=last_id).values_list('id', flat=True))
+
+    def seed_reviews(self, count, business_ids, user_ids):
+        # A few popular businesses get most of the reviews, as in real data
+        weights = [1 / (rank + 1) for rank in range(len(business_ids))]
+        businesses = self.random.choices(business_ids, weights=weights, k=min(count, 100000)) or business_ids
+        self.insert(Review, count, lambda n: Review(
+            business_id=businesses[n % len(businesses)],
+            user_id=self.random.choice(user_ids),
+            title=self.sentence(3)[:50],
+            content=self.sentence(30),
+            rating=self.random.choices(range(1, 6), weights=[1, 1, 2, 4, 5])[0],
+            likes=self.random.randrange(20),
+        ))
+
+    def seed_messages(self, count, business_ids, user_ids):
+        pairs = [(self.random.choice(business_ids), self.random.choice(user_ids)) for _ in range(max(count // 10, 1))]
+
+        def build(n):
+            business_id, user_id = self.random.choice(pairs)
+            return Messages(
+                business_id=business_id,
+                user_id=user_id,
+                content=self.sentence(15),
+                is_read=self.random.random() < 0.7,
+            )
+
+        self.insert(Messages, count, build)
+
+    def seed_inventory(self, count, business_ids):
+        self.insert(Inventory, count, lambda n: Inventory(
+            business_id=business_ids[n % len(business_ids)],
+            product_name='%s %d' % (self.random.choice(PRODUCTS), n),
+            description=self.sentence(10),
+            quantity=self.random.randrange(500),
+            price=Decimal(self.random.randrange(100, 20000)) / 100,
+        ))
+
+    def seed_events(self, count, business_ids):
+        def build(n):
+            start = self.ago(60) + datetime.timedelta(days=45)
+            return Event(
+                business_id=self.random.choice(business_ids),
+                name=self.sentence(3)[:100],
+                description=self.sentence(20),
+                start_time=start,
+                end_time=start + datetime.timedelta(hours=self.random.randrange(1, 6)),
+                status=self.random.choices(['published', 'draft', 'cancelled'], weights=[8, 1, 1])[0],
+                location='%d %s' % (self.random.randrange(1, 999), self.random.choice(STREETS)),
+            )
+
+        self.insert(Event, count, build)
+
+    def seed_images(self, count, business_ids):
+        if not count:
+            return
+        # One small generated JPEG in media storage; every row points at it
+        placeholder = default_storage.save('business/default/seed-placeholder.jpg', jpeg('seed-placeholder.jpg'))
+        self.insert(BusinessImages, count, lambda n: BusinessImages(
+            business_id=business_ids[n % len(business_ids)],
+            image_1=placeholder,
+        ))
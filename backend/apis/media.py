@@ -0,0 +1,155 @@
+"""
+Serving uploaded media.
+
+Replaces django.conf.urls.static.static(), which streams every byte through
+a Python worker with no Range support or caching headers. serve_media
+answers conditional requests with 304, supports single byte ranges (206),
+marks content-addressed files (see storage.py) as immutable, and can hand
+the transfer to the front-end server instead of reading the file itself.
+
+Only files under APIS_MEDIA_PREFIXES are served, so whatever else sits in
+MEDIA_ROOT (partial uploads, files stored before content addressing) stays
+private. With DEBUG on, every file is served, as static() did.
+
+Settings:
+    APIS_MEDIA_SENDFILE      None (serve from Python), 'x-accel-redirect'
+                             (nginx) or 'x-sendfile' (Apache/lighttpd)
+    APIS_MEDIA_ACCEL_PREFIX  internal nginx location mapped to MEDIA_ROOT
+                             (default: '/protected-media/')
+    APIS_MEDIA_MAX_AGE       max-age for files that are not content
+                             addressed (default: 3600)
+    APIS_MEDIA_PREFIXES      directories under MEDIA_ROOT that are served
+                             (default: content-addressed files and image
+                             variants)
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from .images import VARIANT_ROOT
+from .storage import CAS_ROOT, digest_from_name
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+READ_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) for a single satisfiable byte range, None when the
+    header is absent or not one we handle (the full file is sent then), or
+    raise ValueError when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def iter_range(path, start, end):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = handle.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def is_served(name):
+    if settings.DEBUG:
+        return True
+    prefixes = getattr(settings, 'APIS_MEDIA_PREFIXES', (CAS_ROOT, VARIANT_ROOT))
+    return any(name.startswith(prefix.rstrip('/') + '/') for prefix in prefixes)
+
+
+def cache_headers(response, name, etag, mtime):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if digest_from_name(name):
+        response['Cache-Control'] = 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    else:
+        response['Cache-Control'] = 'public, max-age=%d' % getattr(settings, 'APIS_MEDIA_MAX_AGE', 3600)
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except Exception:
+        raise Http404('Not found')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Not found')
+    # Checked on the resolved path, so `cas/../` cannot step out
+    name = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+    if not os.path.isfile(full_path) or not is_served(name):
+        raise Http404('Not found')
+
+    digest = digest_from_name(name)
+    etag = quote_etag(digest or '%x-%x' % (int(stat.st_mtime), stat.st_size))
+    mtime = int(stat.st_mtime)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=mtime)
+    if not_modified is not None:
+        return cache_headers(not_modified, name, etag, mtime)
+
+    sendfile = getattr(settings, 'APIS_MEDIA_SENDFILE', None)
+    if sendfile:
+        # The front-end server reads the file and handles Range itself
+        response = HttpResponse(content_type=content_type)
+        if sendfile == 'x-accel-redirect':
+            prefix = getattr(settings, 'APIS_MEDIA_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+        else:
+            response['X-Sendfile'] = full_path
+        return cache_headers(response, name, etag, mtime)
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % stat.st_size
+            return cache_headers(response, name, etag, mtime)
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(iter_range(full_path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, stat.st_size)
+        response['Content-Length'] = str(end - start + 1)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return cache_headers(response, name, etag, mtime)
@@ -0,0 +1,298 @@
+"""
+Prometheus metrics.
+
+MetricsMiddleware counts every request by route (the URL name, e.g.
+`business-list-create`; `unresolved` for 404s), method and status class, and
+keeps histograms of latency, response size and SQL queries per request.
+HourlyRateThrottle (any SharedRateThrottle) counts its rejections and the
+response cache and the JWT user cache count hits and misses. GET /metrics
+serves all of it in the Prometheus text format.
+
+Recording never takes a lock: each thread adds to its own dict, and the
+dicts are only summed when metrics are read. With several worker processes
+(gunicorn, uvicorn workers) set APIS_METRICS_DIR to a directory they all
+share. Each process then writes its totals there every
+APIS_METRICS_FLUSH_INTERVAL seconds from a background thread (and when it
+exits), and /metrics adds up every file, so whichever worker answers the
+scrape reports the whole server. Files of exited workers are kept so
+counters never go down; empty the directory when the server is deployed,
+like prometheus_client's multiprocess mode asks.
+
+Settings:
+    APIS_METRICS_DIR             shared directory for multi-process totals
+                                 (default: None, this process only)
+    APIS_METRICS_FLUSH_INTERVAL  seconds between writes to it (default: 5)
+    APIS_METRICS_TOKEN           when set, /metrics requires
+                                 `Authorization: Bearer <token>`
+"""
+import atexit
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from . import profiling
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'apis_requests_total': ('counter', 'Requests handled.', None),
+    'apis_request_duration_seconds': ('histogram', 'Time to produce a response.', LATENCY_BUCKETS),
+    'apis_response_size_bytes': ('histogram', 'Size of non-streaming response bodies.', SIZE_BUCKETS),
+    'apis_db_queries': ('histogram', 'SQL queries per request.', QUERY_BUCKETS),
+    'apis_throttle_rejections_total': ('counter', 'Requests refused by a throttle.', None),
+    'apis_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss).', None),
+}
+
+
+class Registry:
+    """
+    Per-thread dicts of {(name, labels, part): value}. `part` is '' for a
+    counter and a bucket index, 'sum' or 'count' for a histogram.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        # Totals of threads that have exited
+        self._retired = {}
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # Once per thread, not per request
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            start_flusher()
+            return shard
+
+    def inc(self, name, labels, amount=1):
+        shard = self._shard()
+        key = (name, labels, '')
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        shard = self._shard()
+        for part, amount in (
+            (bisect.bisect_left(METRICS[name][2], value), 1), ('sum', value), ('count', 1),
+        ):
+            key = (name, labels, part)
+            shard[key] = shard.get(key, 0) + amount
+
+    def snapshot(self):
+        totals = {}
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # No one writes to it any more
+                    merge(self._retired, shard)
+            self._shards = alive
+            merge(totals, self._retired)
+        for _, shard in alive:
+            # dict.copy() runs without releasing the GIL, so it never sees a half-done update
+            merge(totals, shard.copy())
+        return totals
+
+    def clear(self):
+        with self._lock:
+            for _, shard in self._shards:
+                shard.clear()
+            self._retired.clear()
+
+
+def merge(into, values):
+    for key, value in values.items():
+        into[key] = into.get(key, 0) + value
+
+
+registry = Registry()
+
+
+def labels(**values):
+    return tuple(sorted(values.items()))
+
+
+def inc(name, amount=1, **label_values):
+    registry.inc(name, labels(**label_values), amount)
+
+
+def observe(name, value, **label_values):
+    registry.observe(name, labels(**label_values), value)
+
+
+# Multi-process totals
+
+# Unique per process start, so a new worker reusing a pid adds to the totals
+PROCESS_FILE = 'metrics-%d-%s.json' % (os.getpid(), uuid.uuid4().hex[:8])
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def metrics_dir():
+    return getattr(settings, 'APIS_METRICS_DIR', None)
+
+
+def encode(values):
+    return [[name, [list(pair) for pair in label_pairs], part, value] for (name, label_pairs, part), value in values.items()]
+
+
+def decode(rows):
+    return {(name, tuple(tuple(pair) for pair in label_pairs), part): value for name, label_pairs, part, value in rows}
+
+
+def flush():
+    directory = metrics_dir()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, PROCESS_FILE)
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(encode(registry.snapshot()), f)
+    # Readers see the old file or the new one, never a partial write
+    os.replace(temporary, path)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(getattr(settings, 'APIS_METRICS_FLUSH_INTERVAL', 5))
+        flush()
+
+
+def start_flusher():
+    global _flusher
+    if _flusher is not None or not metrics_dir():
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever, name='metrics-flusher', daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+
+
+def collect():
+    """Totals of this process plus the last flush of every other one sharing APIS_METRICS_DIR."""
+    totals = registry.snapshot()
+    directory = metrics_dir()
+    if directory:
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            if os.path.basename(path) == PROCESS_FILE:
+                continue
+            try:
+                with open(path) as f:
+                    merge(totals, decode(json.load(f)))
+            except (OSError, ValueError):
+                continue
+    return totals
+
+
+# Exposition
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def format_labels(label_pairs, extra=()):
+    pairs = list(label_pairs) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{%s}' % ','.join(escaped)
+
+
+def render(totals):
+    by_metric = {}
+    for (name, label_pairs, part), value in totals.items():
+        by_metric.setdefault(name, {}).setdefault(label_pairs, {})[part] = value
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for label_pairs, parts in sorted(by_metric.get(name, {}).items()):
+            if kind == 'counter':
+                lines.append('%s%s %s' % (name, format_labels(label_pairs), format_value(parts.get('', 0))))
+                continue
+            cumulative = 0
+            for index, bound in enumerate(buckets):
+                cumulative += parts.get(index, 0)
+                lines.append('%s_bucket%s %s' % (
+                    name, format_labels(label_pairs, [('le', format_value(float(bound)))]), cumulative,
+                ))
+            lines.append('%s_bucket%s %s' % (
+                name, format_labels(label_pairs, [('le', '+Inf')]), format_value(parts.get('count', 0)),
+            ))
+            lines.append('%s_sum%s %s' % (name, format_labels(label_pairs), format_value(parts.get('sum', 0))))
+            lines.append('%s_count%s %s' % (name, format_labels(label_pairs), format_value(parts.get('count', 0))))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    token = getattr(settings, 'APIS_METRICS_TOKEN', None)
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), 'Bearer %s' % token):
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        profiling.install_query_recorders()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with profiling.request_timings() as timings:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, timings)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with profiling.request_timings() as timings:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, timings)
+        return response
+
+    @staticmethod
+    def record(request, response, elapsed, timings):
+        route = getattr(request.resolver_match, 'url_name', None) or 'unresolved'
+        method = request.method if request.method in METHODS else 'other'
+        inc('apis_requests_total', route=route, method=method, status='%dxx' % (response.status_code // 100))
+        observe('apis_request_duration_seconds', elapsed, route=route, method=method)
+        observe('apis_db_queries', timings.queries, route=route)
+        if not response.streaming:
+            observe('apis_response_size_bytes', len(response.content), route=route)
@@ -0,0 +1,160 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Like django.middleware.gzip.GZipMiddleware, but:
+
+- brotli ("br") is preferred when the client accepts it and the brotli
+  package is installed, gzip otherwise;
+- q-values are honoured, so `gzip;q=0` turns gzip off;
+- bodies below a size threshold are sent as they are, because compressing
+  a few hundred bytes costs more CPU than it saves on the wire;
+- Server-Sent Events (text/event-stream) are never compressed, since a
+  compressor would hold events back until its buffer fills;
+- only text-like bodies (text/*, JSON, XML, JavaScript, SVG) are
+  compressed. Files (FileResponse) and partial (206) responses are sent as
+  they are: media is mostly already compressed, and a Content-Range or
+  strong ETag describes the bytes on disk.
+
+Settings:
+    APIS_COMPRESSION_MIN_SIZE    smallest body in bytes worth compressing
+                                 (default: 1024)
+    APIS_COMPRESSION_GZIP_LEVEL  zlib level (default: 6)
+    APIS_COMPRESSION_BR_QUALITY  brotli quality (default: 5)
+"""
+import gzip
+import zlib
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/javascript', 'application/xml', 'application/x-ndjson', 'image/svg+xml',
+)
+
+
+def is_compressible(content_type):
+    media_type = content_type.split(';')[0].strip().lower()
+    if media_type == 'text/event-stream':
+        return False
+    return (
+        media_type.startswith('text/') or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith('+json') or media_type.endswith('+xml')
+    )
+
+
+def accepted_encodings(header):
+    """{coding: q} from an Accept-Encoding header."""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def choose_encoding(header):
+    """'br', 'gzip' or None for the given Accept-Encoding header."""
+    accepted = accepted_encodings(header)
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0.0
+    for coding in available:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        # Ties go to the earlier, denser coding
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class GzipStream:
+    def __init__(self):
+        # wbits=31 writes the gzip header and trailer
+        self._compressor = zlib.compressobj(getattr(settings, 'APIS_COMPRESSION_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+
+    def process(self, chunk):
+        # A sync flush per chunk, so each one reaches the client as it comes
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=getattr(settings, 'APIS_COMPRESSION_BR_QUALITY', 5))
+
+    def process(self, chunk):
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def compress(encoding, content):
+    if encoding == 'br':
+        return brotli.compress(content, quality=getattr(settings, 'APIS_COMPRESSION_BR_QUALITY', 5))
+    return gzip.compress(content, compresslevel=getattr(settings, 'APIS_COMPRESSION_GZIP_LEVEL', 6), mtime=0)
+
+
+def compress_stream(encoding, chunks):
+    stream = BrotliStream() if encoding == 'br' else GzipStream()
+    for chunk in chunks:
+        data = stream.process(chunk)
+        if data:
+            yield data
+    yield stream.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or response.has_header('Content-Range'):
+            return response
+        if response.status_code == 206 or isinstance(response, FileResponse):
+            return response
+        if not is_compressible(response.get('Content-Type', '')):
+            return response
+        # Async streams are left alone; only the SSE view produces them
+        if response.streaming and response.is_async:
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'APIS_COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(encoding, response.streaming_content)
+            # The compressed size is unknown until the stream ends
+            del response.headers['Content-Length']
+        else:
+            compressed = compress(encoding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The representation changed, so a strong ETag must become weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
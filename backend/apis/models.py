@@ -1,53 +1,38 @@
 import os
-from django.db import models
+import uuid
+from django.db import models, router, transaction
+from django.db.models import Case, Count, F, FloatField, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, NullIf, Substr
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
+from . import authentication, caching, hours, realtime, search
+from . import images as image_variants
 
-# Temporary upload path for unsaved instances
+# Old upload path, kept because early migrations reference it
 def temporary_image_upload_path(instance, filename):
     return os.path.join('temporary', filename)
 
 def business_image_upload_path(instance, filename):
     if isinstance(instance, BusinessImages):
-        return os.path.join('business', str(instance.business.id), 'optional', filename)
+        return os.path.join('business', str(instance.business_id), 'optional', filename)
     elif isinstance(instance, Business):
         return os.path.join('business', str(instance.id), 'main', filename)
     return os.path.join('business', 'default', filename)
 
 class BusinessImages(models.Model):
     business = models.ForeignKey("Business", on_delete=models.CASCADE, related_name='business_image_set')
-    image_1 = models.ImageField(upload_to=temporary_image_upload_path, null=True, blank=True)
-    image_2 = models.ImageField(upload_to=temporary_image_upload_path, null=True, blank=True)
-    image_3 = models.ImageField(upload_to=temporary_image_upload_path, null=True, blank=True)
-    image_4 = models.ImageField(upload_to=temporary_image_upload_path, null=True, blank=True)
+    # business is set before saving, so files are written straight to their final path
+    image_1 = models.ImageField(upload_to=business_image_upload_path, null=True, blank=True)
+    image_2 = models.ImageField(upload_to=business_image_upload_path, null=True, blank=True)
+    image_3 = models.ImageField(upload_to=business_image_upload_path, null=True, blank=True)
+    image_4 = models.ImageField(upload_to=business_image_upload_path, null=True, blank=True)
 
     def __str__(self):
         return f"Images for {self.business.b_name}"
 
-@receiver(post_save, sender=BusinessImages)
-def update_image_path(sender, instance, **kwargs):
-    # Check if the path update is necessary to avoid recursive saving
-    updated = False
-    if instance.image_1 and 'temporary' in instance.image_1.name:
-        instance.image_1.name = business_image_upload_path(instance, os.path.basename(instance.image_1.name))
-        updated = True
-    if instance.image_2 and 'temporary' in instance.image_2.name:
-        instance.image_2.name = business_image_upload_path(instance, os.path.basename(instance.image_2.name))
-        updated = True
-    if instance.image_3 and 'temporary' in instance.image_3.name:
-        instance.image_3.name = business_image_upload_path(instance, os.path.basename(instance.image_3.name))
-        updated = True
-    if instance.image_4 and 'temporary' in instance.image_4.name:
-        instance.image_4.name = business_image_upload_path(instance, os.path.basename(instance.image_4.name))
-        updated = True
-
-    # Save only if any path was updated to prevent infinite loop
-    if updated:
-        instance.save(update_fields=['image_1', 'image_2', 'image_3', 'image_4'])
-
 def inventory_image_distributor(instances, filename):
      return os.path.join('business', f'{instances.business.b_name}', f'{instances.business.id}', 'products', filename)
 
@@ -71,6 +56,15 @@ class Event(models.Model):
     status = models.CharField(max_length=20, choices=[('draft', 'Draft'), ('published', 'Published'), ('cancelled', 'Cancelled')])
     image = models.ImageField(upload_to='eventImages', null=True, blank=True)
     location = models.CharField(max_length=255, blank=True, null=True)
+
+    class Meta:
+        # EventListCreateView filters on business and/or status and pages on (start_time, id)
+        indexes = [
+            models.Index(fields=['business', 'status', 'start_time', 'id'], name='event_business_status_idx'),
+            models.Index(fields=['business', 'start_time', 'id'], name='event_business_start_idx'),
+            models.Index(fields=['status', 'start_time', 'id'], name='event_status_start_idx'),
+            models.Index(fields=['start_time', 'id'], name='event_start_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.business.b_name}"
@@ -95,6 +89,26 @@ class Users(AbstractUser):
     def __str__(self):
         return self.username
 
+class ZipcodeCentroid(models.Model):
+    zipcode = models.CharField(max_length=20, primary_key=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    def __str__(self):
+        return f"{self.zipcode} ({self.latitude}, {self.longitude})"
+
+    @staticmethod
+    def normalize(zipcode):
+        return (zipcode or '').strip().upper()
+
+    @classmethod
+    def coordinates_for(cls, zipcode):
+        zipcode = cls.normalize(zipcode)
+        if not zipcode:
+            return None, None
+        row = cls.objects.filter(zipcode=zipcode).values_list('latitude', 'longitude').first()
+        return row or (None, None)
+
 class Business(models.Model):
     CATEGORY_CHOICES = [
         ('RESTAURANT', 'Restaurant'),
@@ -113,12 +127,97 @@ class Business(models.Model):
     description = models.TextField()
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     date_registered = models.DateTimeField(auto_now_add=True)
-    images = models.ImageField(upload_to=temporary_image_upload_path, blank=True, null=True)
+    images = models.ImageField(upload_to=business_image_upload_path, blank=True, null=True)
     work_time = models.JSONField(blank=False, default=default_work_time, null=True)
+    # Denormalized from ZipcodeCentroid so proximity queries never join
+    latitude = models.FloatField(blank=True, null=True, editable=False)
+    longitude = models.FloatField(blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='business_lat_lon_idx'),
+            models.Index(fields=['category'], name='business_category_idx'),
+            models.Index(fields=['zipcode'], name='business_zipcode_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.latitude, self.longitude = ZipcodeCentroid.coordinates_for(self.zipcode)
+        elif 'zipcode' in update_fields:
+            self.latitude, self.longitude = ZipcodeCentroid.coordinates_for(self.zipcode)
+            kwargs['update_fields'] = set(update_fields) | {'latitude', 'longitude'}
+
+        # The main image lives under business/<id>/, which a new row does not
+        # have yet: insert first, then write the file once to its final path.
+        if self.pk is not None or not self.images or self.images._committed:
+            return super().save(*args, **kwargs)
+        upload, filename = self.images.file, os.path.basename(self.images.name)
+        self.images = None
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            self.images.save(filename, upload, save=False)
+            type(self).objects.using(using).filter(pk=self.pk).update(images=self.images.name)
+            image_variants.schedule_for_instance(self, using=using)
     
     def __str__(self):
         return f"{self.b_name} - {self.owner} ({self.category})"
 
+@receiver(post_save, sender=Business)
+def index_business_for_search(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        search.index_business(instance, using=using)
+
+@receiver(post_delete, sender=Business)
+def remove_business_from_search(sender, instance, using=None, **kwargs):
+    search.remove_business(instance.pk, using=using)
+
+class OpeningHours(models.Model):
+    """
+    One weekly interval a business is open, derived from Business.work_time
+    (see hours.py) as [start, end) minutes since Monday 00:00.
+    """
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='opening_hours')
+    start = models.PositiveIntegerField()
+    end = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'start', 'end'], name='opening_hours_business_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.business_id}: {self.start}-{self.end}"
+
+@receiver(post_save, sender=Business)
+def sync_opening_hours(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    if not raw and (update_fields is None or 'work_time' in update_fields):
+        hours.sync_business(instance, using=using)
+
+# Response cache invalidation: each receiver bumps the scopes whose cached
+# responses include the saved or deleted row (see caching.py).
+@receiver(post_save, sender=Users)
+@receiver(post_delete, sender=Users)
+def evict_cached_user(sender, instance, using=None, **kwargs):
+    authentication.evict_user(instance, using=using)
+
+@receiver(post_save, sender=Business)
+@receiver(post_delete, sender=Business)
+def invalidate_business_cache(sender, instance, using=None, **kwargs):
+    # Event responses embed the business name
+    caching.invalidate(f'business:{instance.pk}', 'businesses', 'events', using=using)
+
+@receiver(post_save, sender=BusinessImages)
+@receiver(post_delete, sender=BusinessImages)
+def invalidate_business_images_cache(sender, instance, using=None, **kwargs):
+    caching.invalidate(f'business:{instance.business_id}', using=using)
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def invalidate_event_cache(sender, instance, using=None, **kwargs):
+    caching.invalidate('events', using=using)
+
 class Inventory(models.Model):
     business = models.ForeignKey(Business, on_delete=models.CASCADE)
     product_name = models.CharField(max_length=50)
@@ -127,10 +226,22 @@ class Inventory(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     date_added = models.DateTimeField(auto_now_add=True)
     image = models.ImageField(upload_to=inventory_image_distributor)
+
+    class Meta:
+        indexes = [
+            # Bulk import upserts match on (business, product_name)
+            models.Index(fields=['business', 'product_name'], name='inventory_business_product_idx'),
+        ]
     
     def __str__(self):
         return self.product_name
 
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Inventory)
+def invalidate_inventory_cache(sender, instance, using=None, **kwargs):
+    # Only business pages show inventory
+    caching.invalidate(f'inventory:{instance.business_id}', using=using)
+
 class Messages(models.Model):
     business = models.ForeignKey(Business, on_delete=models.CASCADE)
     user = models.ForeignKey(Users, on_delete=models.CASCADE)
@@ -138,6 +249,145 @@ class Messages(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        # MessagesListCreateView filters on business, is_read and user and pages on (date, id)
+        indexes = [
+            models.Index(fields=['business', 'is_read', 'date', 'id'], name='messages_business_read_idx'),
+            models.Index(fields=['business', 'date', 'id'], name='messages_business_date_idx'),
+            models.Index(fields=['user', 'date', 'id'], name='messages_user_date_idx'),
+            models.Index(fields=['date', 'id'], name='messages_date_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_state()
+        return instance
+
+    def _remember_state(self):
+        # What the Conversation summary currently counts for this message
+        self._counted = (self.business_id, self.user_id, self.is_read)
+        self._preview = Conversation.preview(self.content)
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            counted = None if self._state.adding else getattr(self, '_counted', None)
+            preview = getattr(self, '_preview', None)
+            super().save(*args, **kwargs)
+            if counted is None or counted[:2] != (self.business_id, self.user_id):
+                if counted is not None:
+                    Conversation.remove(*counted, using=using)
+                Conversation.add(self, using=using)
+            else:
+                if counted[2] != self.is_read:
+                    Conversation.change_unread(self.business_id, self.user_id, -1 if self.is_read else 1, using=using)
+                if preview != Conversation.preview(self.content):
+                    Conversation.objects.using(using).filter(last_message_id=self.pk).update(
+                        last_preview=Conversation.preview(self.content),
+                    )
+            self._remember_state()
+
+class Conversation(models.Model):
+    """
+    Inbox summary of the messages between one business and one user, kept
+    in step with Messages writes so unread badges and the inbox never read
+    the Messages table. Rebuild with `manage.py reconcile_conversations`
+    after bulk Messages changes.
+    """
+    PREVIEW_LENGTH = 140
+
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='conversations')
+    user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='conversations')
+    message_count = models.PositiveIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+    last_message = models.ForeignKey(Messages, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['business', 'user'], name='conversation_business_user_unique'),
+        ]
+        # ConversationListView lists one side's conversations, newest first
+        indexes = [
+            models.Index(fields=['business', '-last_date', '-id'], name='conversation_business_idx'),
+            models.Index(fields=['user', '-last_date', '-id'], name='conversation_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.business_id}/{self.user_id}: {self.unread_count} unread"
+
+    @classmethod
+    def preview(cls, content):
+        content = ' '.join((content or '').split())
+        if len(content) <= cls.PREVIEW_LENGTH:
+            return content
+        return content[:cls.PREVIEW_LENGTH - 1] + '\u2026'
+
+    @classmethod
+    def add(cls, message, using='default'):
+        # Only a message at least as new as the current last one replaces it
+        newer = Q(last_date__isnull=True) | Q(last_date__lte=message.date)
+        updates = {
+            'message_count': F('message_count') + 1,
+            'unread_count': F('unread_count') + (0 if message.is_read else 1),
+            'last_message': Case(
+                When(newer, then=Value(message.pk)), default=F('last_message'), output_field=models.BigIntegerField(),
+            ),
+            'last_preview': Case(When(newer, then=Value(cls.preview(message.content))), default=F('last_preview')),
+            'last_date': Case(When(newer, then=Value(message.date)), default=F('last_date')),
+        }
+        pair = {'business_id': message.business_id, 'user_id': message.user_id}
+        rows = cls.objects.using(using).filter(**pair).update(**updates)
+        if not rows:
+            cls.objects.using(using).get_or_create(**pair)
+            cls.objects.using(using).filter(**pair).update(**updates)
+
+    @classmethod
+    def remove(cls, business_id, user_id, is_read, using='default'):
+        latest = Messages.objects.filter(
+            business_id=OuterRef('business_id'), user_id=OuterRef('user_id'),
+        ).order_by('-date', '-id')[:1]
+        cls.objects.using(using).filter(business_id=business_id, user_id=user_id).update(
+            message_count=F('message_count') - 1,
+            unread_count=F('unread_count') - (0 if is_read else 1),
+            last_message=Subquery(latest.values('pk')),
+            last_preview=Coalesce(Substr(Subquery(latest.values('content')), 1, cls.PREVIEW_LENGTH), Value('')),
+            last_date=Subquery(latest.values('date')),
+        )
+
+    @classmethod
+    def change_unread(cls, business_id, user_id, delta, using='default'):
+        cls.objects.using(using).filter(business_id=business_id, user_id=user_id).update(
+            unread_count=F('unread_count') + delta,
+        )
+
+    @classmethod
+    def mark_read(cls, business_id, user_id, up_to=None, using='default'):
+        """
+        Mark the conversation's unread messages (up to message id `up_to`)
+        read with a single UPDATE, and return how many changed.
+        """
+        with transaction.atomic(using=using):
+            unread = Messages.objects.using(using).filter(business_id=business_id, user_id=user_id, is_read=False)
+            if up_to is not None:
+                unread = unread.filter(pk__lte=up_to)
+            changed = unread.update(is_read=True)
+            if changed:
+                cls.change_unread(business_id, user_id, -changed, using=using)
+        return changed
+
+@receiver(post_delete, sender=Messages)
+def remove_message_from_conversation(sender, instance, using=None, **kwargs):
+    counted = getattr(instance, '_counted', (instance.business_id, instance.user_id, instance.is_read))
+    Conversation.remove(*counted, using=using)
+
+@receiver(post_save, sender=Messages)
+def publish_new_message(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if created and not raw:
+        realtime.publish_message(instance, using=using)
+
 class Review(models.Model):
     business = models.ForeignKey(Business, on_delete=models.CASCADE)
     user = models.ForeignKey(Users, on_delete=models.CASCADE)
@@ -146,6 +396,219 @@ class Review(models.Model):
     rating = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])    
     likes = models.IntegerField(default=0, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # ReviewListCreateView orders by (business, -rating, id), optionally
+        # filtered by rating or user; BusinessRating reads the latest review.
+        indexes = [
+            models.Index(fields=['business', '-rating', 'id'], name='review_business_rating_idx'),
+            models.Index(fields=['user', 'business', '-rating', 'id'], name='review_user_business_idx'),
+            models.Index(fields=['rating', 'business', 'id'], name='review_rating_business_idx'),
+            models.Index(fields=['business', '-created_at'], name='review_business_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_rating()
+        return instance
+
+    def _remember_rating(self):
+        # What the aggregate currently counts for this review
+        self._counted = (self.business_id, self.rating)
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            counted = None if self._state.adding else getattr(self, '_counted', None)
+            super().save(*args, **kwargs)
+            if counted != (self.business_id, self.rating):
+                rebuilt = counted is not None and BusinessRating.remove(*counted, using=using)
+                # A row rebuilt from Review already counts this review
+                if not (rebuilt and counted[0] == self.business_id):
+                    BusinessRating.add(self.business_id, self.rating, self.created_at, using=using)
+            self._remember_rating()
     
     def __str__(self):
         return self.user.username
+
+class BusinessRating(models.Model):
+    """
+    Running review totals for one business, kept in step with Review writes
+    so ratings can be listed and sorted without reading the Review table.
+    Rebuild with `manage.py reconcile_ratings` after bulk Review changes;
+    a row that is missing or cannot take a change is rebuilt on the spot.
+    """
+    business = models.OneToOneField(Business, on_delete=models.CASCADE, primary_key=True, related_name='rating')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    average = models.FloatField(null=True, blank=True, db_index=True)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+    last_review_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.business_id}: {self.average} ({self.review_count})"
+
+    @property
+    def histogram(self):
+        return {str(star): getattr(self, f'rating_{star}_count') for star in range(1, 6)}
+
+    @classmethod
+    def add(cls, business_id, rating, created_at, using='default'):
+        updates = cls._changes(rating, 1)
+        updates['last_review_at'] = Case(
+            When(last_review_at__gt=created_at, then=F('last_review_at')),
+            default=Value(created_at),
+        )
+        rows = cls.objects.using(using).filter(business_id=business_id).update(**updates)
+        if not rows:
+            # Called after the review is saved, so the rebuilt row counts it
+            cls.rebuild([business_id], using=using)
+
+    @classmethod
+    def remove(cls, business_id, rating, using='default'):
+        """
+        Take one review out of the totals. A row that counts too few such
+        reviews (it has drifted) is rebuilt from Review instead, and True
+        returned; a missing row is left for add() to build.
+        """
+        updates = cls._changes(rating, -1)
+        updates['last_review_at'] = Subquery(
+            Review.objects.filter(business_id=OuterRef('business_id'))
+            .order_by('-created_at').values('created_at')[:1]
+        )
+        rows = cls.objects.using(using).filter(
+            business_id=business_id, review_count__gte=1, rating_sum__gte=rating,
+            **{f'rating_{rating}_count__gte': 1},
+        ).update(**updates)
+        if rows or not cls.objects.using(using).filter(business_id=business_id).exists():
+            return False
+        cls.rebuild([business_id], using=using)
+        return True
+
+    @classmethod
+    def rebuild(cls, business_ids, using='default'):
+        """Recompute the rows of `business_ids` from the Review table."""
+        stars = range(1, 6)
+        totals = {
+            row['business_id']: row
+            for row in Review.objects.using(using).filter(business_id__in=business_ids)
+            .order_by()
+            .values('business_id')
+            .annotate(
+                review_count=Count('id'),
+                rating_sum=Sum('rating'),
+                last_review_at=Max('created_at'),
+                **{f'rating_{star}_count': Count('id', filter=Q(rating=star)) for star in stars},
+            )
+        }
+        rows = []
+        for business_id in business_ids:
+            row = totals.get(business_id, {})
+            count = row.get('review_count', 0)
+            rating_sum = row.get('rating_sum') or 0
+            rows.append(cls(
+                business_id=business_id,
+                review_count=count,
+                rating_sum=rating_sum,
+                average=rating_sum / count if count else None,
+                last_review_at=row.get('last_review_at'),
+                **{f'rating_{star}_count': row.get(f'rating_{star}_count', 0) for star in stars},
+            ))
+        fields = [f.name for f in cls._meta.concrete_fields if not f.primary_key]
+        cls.objects.using(using).bulk_create(
+            rows, update_conflicts=True, unique_fields=['business'], update_fields=fields,
+        )
+        return len(rows)
+
+    @staticmethod
+    def _changes(rating, delta):
+        # Every F() below reads the pre-update row, so the average is
+        # computed from the new totals in the same UPDATE statement.
+        return {
+            'review_count': F('review_count') + delta,
+            'rating_sum': F('rating_sum') + delta * rating,
+            f'rating_{rating}_count': F(f'rating_{rating}_count') + delta,
+            'average': Cast(F('rating_sum') + delta * rating, FloatField()) / NullIf(F('review_count') + delta, 0),
+        }
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_rating(sender, instance, using=None, **kwargs):
+    counted = getattr(instance, '_counted', (instance.business_id, instance.rating))
+    BusinessRating.remove(*counted, using=using)
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_cache(sender, instance, using=None, **kwargs):
+    # Business responses carry the rating aggregates; a moved review changes
+    # the business it was counted against too.
+    counted = getattr(instance, '_counted', None)
+    business_ids = {instance.business_id, counted[0] if counted else instance.business_id}
+    caching.invalidate('businesses', *(f'business:{pk}' for pk in business_ids), using=using)
+
+class ImageDerivative(models.Model):
+    """Resized copies of one stored image, keyed by the original's file name."""
+    source = models.CharField(max_length=255, primary_key=True)
+    # {"thumb": {"width": .., "height": .., "webp": <name>, "jpeg": <name>}, ...}
+    variants = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.source
+
+@receiver(post_save, sender=ImageDerivative)
+def invalidate_image_owner_cache(sender, instance, using=None, **kwargs):
+    # Cached responses show the variants as null until they exist
+    source = instance.source
+    scopes = set()
+    for pk in Business.objects.using(using).filter(images=source).values_list('pk', flat=True):
+        scopes |= {f'business:{pk}', 'businesses'}
+    in_gallery = Q(image_1=source) | Q(image_2=source) | Q(image_3=source) | Q(image_4=source)
+    for pk in BusinessImages.objects.using(using).filter(in_gallery).values_list('business_id', flat=True):
+        scopes.add(f'business:{pk}')
+    for pk in Inventory.objects.using(using).filter(image=source).values_list('business_id', flat=True):
+        scopes.add(f'inventory:{pk}')
+    if Event.objects.using(using).filter(image=source).exists():
+        scopes.add('events')
+    if scopes:
+        caching.invalidate(*scopes, using=using)
+
+@receiver(post_save, sender=Business)
+@receiver(post_save, sender=BusinessImages)
+@receiver(post_save, sender=Inventory)
+@receiver(post_save, sender=Event)
+@receiver(post_save, sender=Users)
+def generate_image_variants(sender, instance, created=False, raw=False, using=None, update_fields=None, **kwargs):
+    if not raw:
+        image_variants.schedule_for_instance(instance, using=using, created=created, update_fields=update_fields)
+
+@receiver(post_init, sender=Business)
+@receiver(post_init, sender=BusinessImages)
+@receiver(post_init, sender=Inventory)
+@receiver(post_init, sender=Event)
+@receiver(post_init, sender=Users)
+def remember_image_names(sender, instance, **kwargs):
+    image_variants.remember_names(instance)
+
+class UploadSession(models.Model):
+    """A resumable upload assembled chunk by chunk on disk (see uploads.py)."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(Users, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    # Set once the last chunk is on disk; `received` is claimed before the
+    # chunk is written, so it reaches `size` while the bytes are in flight
+    completed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def is_complete(self):
+        return self.completed
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
@@ -0,0 +1,125 @@
+"""
+Business pages: a business with everything its page shows, in one response.
+
+A page holds the business (with its rating), its images, its upcoming
+published events, its best reviews and the first page of its inventory.
+The rows of every business asked for are loaded together, so one page or
+twenty cost the same queries:
+
+- the businesses, joined to their ratings;
+- one per related list, each cut to the first N rows of every business
+  with a window function (a sliced Prefetch);
+- one for the image variants of every row on every page.
+
+Inventory pages are in the order InventoryListCreateView uses, so the
+`next` link continues from the last product shown.
+"""
+from django.db.models import Prefetch
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from rest_framework.exceptions import ValidationError
+
+from . import images
+from .models import Business, BusinessImages, Event, Inventory, Review
+from .pagination import KeysetPagination
+from .serializers import ImageVariantsField
+
+# ?<name>=: (default, maximum) rows per business
+LIMITS = {
+    'events': (5, 20),
+    'reviews': (5, 20),
+    'inventory': (KeysetPagination.page_size, KeysetPagination.max_page_size),
+}
+MAX_IDS = 20
+# InventoryListCreateView.cursor_ordering
+INVENTORY_ORDERING = ('business_id', 'id')
+
+
+def parse_ids(value):
+    """The distinct business ids in `?ids=1,2,3`, in the order given."""
+    ids = []
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit():
+            raise ValidationError({'ids': 'A comma-separated list of business ids is required.'})
+        if int(part) not in ids:
+            ids.append(int(part))
+    if not ids:
+        raise ValidationError({'ids': 'A comma-separated list of business ids is required.'})
+    if len(ids) > MAX_IDS:
+        raise ValidationError({'ids': f'At most {MAX_IDS} businesses per request.'})
+    return ids
+
+
+def parse_limits(params):
+    limits = {}
+    for name, (default, maximum) in LIMITS.items():
+        value = params.get(name, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: 'A whole number is required.'})
+        if not 0 <= value <= maximum:
+            raise ValidationError({name: f'Must be between 0 and {maximum}.'})
+        limits[name] = value
+    return limits
+
+
+def queryset(limits):
+    return Business.objects.select_related('rating').prefetch_related(
+        Prefetch('business_image_set', queryset=BusinessImages.objects.order_by('id'), to_attr='page_images'),
+        Prefetch(
+            'business_events',
+            queryset=Event.objects.filter(status='published', start_time__gte=timezone.now())
+            .order_by('start_time', 'id')[:limits['events']],
+            to_attr='page_events',
+        ),
+        Prefetch(
+            'review_set',
+            queryset=Review.objects.select_related('user').order_by('-rating', 'id')[:limits['reviews']],
+            to_attr='page_reviews',
+        ),
+        # One extra row tells whether there is a next page
+        Prefetch(
+            'inventory_set',
+            queryset=Inventory.objects.order_by(*INVENTORY_ORDERING[1:])[:limits['inventory'] + 1],
+            to_attr='page_inventory',
+        ),
+    )
+
+
+def load(ids, limits, request):
+    """The businesses with `ids` that exist, in the order given, ready for BusinessPageSerializer."""
+    found = {business.pk: business for business in queryset(limits).filter(pk__in=ids)}
+    businesses = [found[pk] for pk in ids if pk in found]
+    size = limits['inventory']
+    for business in businesses:
+        rows = business.page_inventory
+        business.page_inventory = {
+            'results': rows[:size],
+            'next': inventory_link(request, business, size, rows[size - 1]) if size and len(rows) > size else None,
+        }
+    return businesses
+
+
+def inventory_link(request, business, size, last):
+    paginator = KeysetPagination()
+    paginator.ordering = INVENTORY_ORDERING
+    paginator.base_url = request.build_absolute_uri(
+        '%s?%s' % (reverse('inventory-list-create'), urlencode({'business': business.pk, 'page_size': size}))
+    )
+    return paginator.encode_cursor([business.pk, last.pk], reverse=False)
+
+
+def image_manifests(businesses):
+    """{name: manifest} for every image on the pages, in one query."""
+    rows = []
+    for business in businesses:
+        rows.append(business)
+        rows += business.page_images + business.page_events + business.page_inventory['results']
+    names = ImageVariantsField.sibling_image_names(rows)
+    found = images.lookup(names) if names else {}
+    return {name: found.get(name) for name in names}
@@ -0,0 +1,73 @@
+"""
+Password hashing off the event loop.
+
+PBKDF2 takes tens of milliseconds by design. The async login and signup
+views (async_views.py) send it to a small dedicated thread pool, so an
+auth spike occupies those threads instead of the event loop or the
+workers that serve everything else. The pool is bounded twice: by its
+number of threads and by how many hashes may wait for them. Past that,
+`run` raises Overloaded straight away and the view answers 503 with
+Retry-After instead of letting the queue (and every client's latency)
+grow.
+
+Only pure hashing runs in the pool; the views do the database work.
+
+Settings:
+    APIS_PASSWORD_WORKERS  hashing threads (default: 4)
+    APIS_PASSWORD_QUEUE    hashes running or waiting before new ones are
+                           refused (default: 64)
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, make_password, verify_password
+
+_executor = None
+_lock = threading.Lock()
+_pending = 0
+
+
+class Overloaded(Exception):
+    pass
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'APIS_PASSWORD_WORKERS', 4),
+                thread_name_prefix='password-hashing',
+            )
+        return _executor
+
+
+async def run(func, *args):
+    """Run `func(*args)` in the hashing pool, or raise Overloaded when it is full."""
+    global _pending
+    executor = _get_executor()
+    with _lock:
+        if _pending >= getattr(settings, 'APIS_PASSWORD_QUEUE', 64):
+            raise Overloaded()
+        _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args))
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+def verify(password, encoded):
+    """
+    Check `password` against the stored hash `encoded` (None for an unknown
+    user, which costs the same as a wrong password). Returns (valid,
+    new_hash); new_hash is set when the password is right but was stored
+    with another hasher or outdated parameters, so the caller can save it.
+    """
+    valid, must_update = verify_password(password, UNUSABLE_PASSWORD_PREFIX if encoded is None else encoded)
+    if valid and must_update:
+        return True, make_password(password)
+    return valid, None
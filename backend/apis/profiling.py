@@ -0,0 +1,338 @@
+"""
+Per-request timings and sampled profiles.
+
+ProfilingMiddleware records, for every request it sees:
+
+- the number of SQL queries and the time spent in them, on every database
+  alias (an execute wrapper added to each connection as it opens);
+- serializer time: the top-level serializer's to_representation, which also
+  counts any query it triggers (see ProfiledSerializerMixin);
+- render time: from the end of the view to the end of response.render();
+- the total time through the rest of the middleware and the view.
+
+They are logged on the `apis.profiling` logger as one JSON object per
+request and, with DEBUG or APIS_PROFILING_HEADER on, returned in a
+Server-Timing header, which browser dev tools show next to the request:
+
+    Server-Timing: db;dur=3.1;desc="4 queries", serialize;dur=5.2, render;dur=0.8, total;dur=11.4
+
+The header tells any client how many queries a request ran and where its
+time went, so it stays off for public deployments.
+
+Profiles are opt-in:
+
+- APIS_PROFILE_SAMPLE_RATE runs that fraction of requests under cProfile;
+- APIS_PROFILE_SLOW_MS samples the stack of every request from a
+  background thread every APIS_PROFILE_INTERVAL seconds and keeps the
+  samples of requests slower than the threshold. Sampling costs a few
+  microseconds per interval per request in flight, whatever the request
+  does.
+
+Profiles are logged (the top functions, or the most frequent stacks) and,
+with APIS_PROFILE_DIR, written there as .prof files (pstats, snakeviz) or
+.folded files (flamegraph.pl, speedscope). Under ASGI the event loop thread
+runs other requests in between, and their frames show up in the profile
+too. With both rates off, a request pays for the timers, a context variable
+lookup per query and one log line.
+
+Settings:
+    APIS_PROFILING_HEADER     add the Server-Timing header (default: DEBUG)
+    APIS_PROFILING_LOG        log the timings of every request (default: True)
+    APIS_PROFILE_SAMPLE_RATE  fraction of requests to cProfile (default: 0)
+    APIS_PROFILE_SLOW_MS      keep stack samples of requests at least this
+                              slow (default: None, no sampling)
+    APIS_PROFILE_INTERVAL     seconds between stack samples (default: 0.005)
+    APIS_PROFILE_DIR          directory to write profiles to (default: None,
+                              only logged)
+"""
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# The RequestTimings of the request being handled, or None
+current = contextvars.ContextVar('apis_request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        # {name: seconds}, e.g. serialize and render
+        self.spans = {}
+        self.render_started = None
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+@contextlib.contextmanager
+def span(name):
+    """Add the time spent in the block to the current request's `name` span."""
+    timings = current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.queries += 1
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_query_recorders():
+    connection_created.connect(install_query_recorder, dispatch_uid='apis.profiling')
+    # Connections this thread already opened (persistent ones, tests)
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(connection)
+
+
+@contextlib.contextmanager
+def request_timings():
+    """The current request's RequestTimings; started here unless an outer middleware already did."""
+    timings = current.get()
+    if timings is not None:
+        yield timings
+        return
+    timings = RequestTimings()
+    token = current.set(timings)
+    try:
+        yield timings
+    finally:
+        current.reset(token)
+
+
+class ProfiledSerializerMixin:
+    """Count the top-level serializer's to_representation as the request's serialize time."""
+
+    def to_representation(self, instance):
+        timings = current.get()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if timings is None or parent is not None:
+            return super().to_representation(instance)
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings.add('serialize', time.perf_counter() - start)
+
+
+def collapse(frame):
+    """A stack in the folded format: outermost call first, separated by ';'."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """One background thread sampling the stacks of the requests being tracked."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._tracked = {}
+
+    def track(self):
+        """Start sampling the calling thread; returns the token for `untrack`."""
+        token = object()
+        with self._lock:
+            self._tracked[token] = (threading.get_ident(), Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return token
+
+    def untrack(self, token):
+        """Stop sampling; returns {folded stack: samples}."""
+        with self._lock:
+            _, samples = self._tracked.pop(token)
+        return samples
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._tracked
+                if idle:
+                    self._wake.clear()
+            if idle:
+                self._wake.wait()
+                continue
+            time.sleep(getattr(settings, 'APIS_PROFILE_INTERVAL', 0.005))
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._tracked.values():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+
+
+sampler = StackSampler()
+
+
+def profile_name(request, extension):
+    route = getattr(request.resolver_match, 'url_name', None) or 'unresolved'
+    return '%s-%s-%s-%s.%s' % (time.strftime('%Y%m%dT%H%M%S'), request.method, route, uuid.uuid4().hex[:8], extension)
+
+
+def write_profile(request, extension, write):
+    directory = getattr(settings, 'APIS_PROFILE_DIR', None)
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, profile_name(request, extension))
+    write(path)
+    return path
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install_query_recorders()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with request_timings() as timings, self.profile(request, timings):
+            response = self.get_response(request)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        with request_timings() as timings, self.profile(request, timings):
+            response = await self.get_response(request)
+        return self.finish(request, response, timings)
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view; this runs just before that
+        timings = current.get()
+        if timings is not None:
+            timings.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self.rendered(timings))
+        return response
+
+    @staticmethod
+    def rendered(timings):
+        if timings.render_started is not None:
+            timings.add('render', time.perf_counter() - timings.render_started)
+            timings.render_started = None
+
+    @contextlib.contextmanager
+    def profile(self, request, timings):
+        """Run the request under cProfile or the stack sampler when sampling picks it."""
+        sample_rate = getattr(settings, 'APIS_PROFILE_SAMPLE_RATE', 0)
+        slow_ms = getattr(settings, 'APIS_PROFILE_SLOW_MS', None)
+        if sample_rate and random.random() < sample_rate:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+            self.report_profile(request, timings, profiler)
+        elif slow_ms is not None:
+            sample = sampler.track()
+            try:
+                yield
+            finally:
+                samples = sampler.untrack(sample)
+            if timings.elapsed() * 1000 >= slow_ms:
+                self.report_samples(request, timings, samples)
+        else:
+            yield
+
+    def report_profile(self, request, timings, profiler):
+        stats = io.StringIO()
+        pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(25)
+        path = write_profile(request, 'prof', profiler.dump_stats)
+        logger.info(
+            'Profiled %s %s in %.1f ms%s\n%s', request.method, request.path, timings.elapsed() * 1000,
+            ' (%s)' % path if path else '', stats.getvalue(),
+        )
+
+    def report_samples(self, request, timings, samples):
+        def write(path):
+            with open(path, 'w') as f:
+                f.writelines('%s %d\n' % (stack, count) for stack, count in samples.items())
+
+        path = write_profile(request, 'folded', write) if samples else None
+        top = '\n'.join('%6d  %s' % (count, stack) for stack, count in samples.most_common(20))
+        logger.warning(
+            'Slow request %s %s took %.1f ms, %d stack samples%s\n%s', request.method, request.path,
+            timings.elapsed() * 1000, sum(samples.values()), ' (%s)' % path if path else '', top,
+        )
+
+    def finish(self, request, response, timings):
+        elapsed = timings.elapsed()
+        if getattr(settings, 'APIS_PROFILING_HEADER', settings.DEBUG):
+            response['Server-Timing'] = server_timing(timings, elapsed)
+        if getattr(settings, 'APIS_PROFILING_LOG', True) and logger.isEnabledFor(logging.INFO):
+            record = {
+                'method': request.method,
+                'path': request.path,
+                'route': getattr(request.resolver_match, 'url_name', None),
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2),
+                'db_queries': timings.queries,
+                'db_ms': round(timings.db * 1000, 2),
+                **{'%s_ms' % name: round(seconds * 1000, 2) for name, seconds in timings.spans.items()},
+            }
+            logger.info(json.dumps(record), extra={'timings': record})
+        return response
+
+
+def server_timing(timings, elapsed):
+    metrics = ['db;dur=%.1f;desc="%d queries"' % (timings.db * 1000, timings.queries)]
+    metrics += ['%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in timings.spans.items()]
+    metrics.append('total;dur=%.1f' % (elapsed * 1000))
+    return ', '.join(metrics)
@@ -0,0 +1,306 @@
+"""
+Real-time delivery of new Messages over Server-Sent Events.
+
+`GET /api/messages/stream/?business=<id>&user=<id>` (either or both) holds
+the connection open and pushes each matching message as it is created,
+instead of clients polling the full message list. A client that reconnects
+with a Last-Event-ID header first receives what it missed from the
+database.
+
+Streams are private: the caller authenticates with its access token, in an
+`Authorization: Bearer` header or, since the browser's EventSource cannot
+send headers, a `?token=` parameter. It may only follow its own messages
+(user=<its id>) or those of a business it owns; staff may follow any.
+
+Every connection is an async generator waiting on its own small queue, so
+an idle stream costs a coroutine and no thread; serve the project through
+backend.asgi (uvicorn, daphne, ...) for that. Under WSGI each stream would
+hold a worker.
+
+New messages are published after their transaction commits. The default
+LocalBroker fans them out to the connections of the current process;
+RedisBroker relays them through Redis so every process receives messages
+created in any other.
+
+Settings:
+    APIS_REALTIME_BROKER      broker class (default:
+                              'apis.realtime.LocalBroker')
+    APIS_REALTIME_REDIS_URL   Redis for RedisBroker
+                              (default: 'redis://localhost:6379/0')
+    APIS_REALTIME_HEARTBEAT   seconds between keep-alive comments
+                              (default: 15)
+    APIS_REALTIME_QUEUE_SIZE  undelivered events kept per connection; a
+                              client that falls further behind is
+                              disconnected and catches up on reconnect
+                              (default: 100)
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+REDIS_CHANNEL = 'apis:realtime'
+RETRY_MS = 3000
+BACKLOG_LIMIT = 500
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def channels_for(business_id, user_id):
+    return ['business:%s' % business_id, 'user:%s' % user_id]
+
+
+class Subscription:
+    """The events one connection still has to send."""
+
+    def __init__(self, channels, maxsize):
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        # Runs on self.loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def notify(self, event):
+        # Runs on any thread
+        try:
+            self.loop.call_soon_threadsafe(self.put, event)
+        except RuntimeError:
+            # The connection's event loop has already closed
+            pass
+
+    @property
+    def finished(self):
+        return self.overflowed and self.queue.empty()
+
+    async def get(self, timeout):
+        """The next event, or None after `timeout` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalBroker:
+    """Fans events out to the subscriptions of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, getattr(settings, 'APIS_REALTIME_QUEUE_SIZE', 100))
+        with self._lock:
+            for channel in channels:
+                self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+    def publish(self, channels, event):
+        self.deliver(channels, event)
+
+    def deliver(self, channels, event):
+        with self._lock:
+            targets = set()
+            for channel in channels:
+                targets.update(self._subscriptions.get(channel, ()))
+        for subscription in targets:
+            subscription.notify(event)
+
+
+class RedisBroker(LocalBroker):
+    """
+    Publishes through Redis. One listener thread per process receives every
+    event and hands it to the local subscriptions, so the number of Redis
+    connections does not grow with the number of clients.
+    """
+
+    def __init__(self):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('apis.realtime.RedisBroker requires the redis package.')
+        self._redis = redis.Redis.from_url(getattr(settings, 'APIS_REALTIME_REDIS_URL', 'redis://localhost:6379/0'))
+        self._listener = None
+
+    def publish(self, channels, event):
+        self._redis.publish(REDIS_CHANNEL, json.dumps({'channels': channels, 'event': event}))
+
+    def subscribe(self, channels):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='realtime-redis', daemon=True)
+                self._listener.start()
+        return super().subscribe(channels)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REDIS_CHANNEL)
+                for message in pubsub.listen():
+                    payload = json.loads(message['data'])
+                    self.deliver(payload['channels'], payload['event'])
+            except Exception:
+                logger.exception('Lost the realtime Redis subscription; reconnecting')
+                time.sleep(1)
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'APIS_REALTIME_BROKER', 'apis.realtime.LocalBroker'))()
+        return _broker
+
+
+def message_event(message):
+    from .serializers import MessagesSerializer
+
+    return {
+        'id': message.pk,
+        'business': message.business_id,
+        'user': message.user_id,
+        'data': json.dumps(MessagesSerializer(message).data, cls=DjangoJSONEncoder, separators=(',', ':')),
+    }
+
+
+def publish_message(message, using=None):
+    """Push a newly created message to its streams once the transaction commits."""
+    channels = channels_for(message.business_id, message.user_id)
+    event = message_event(message)
+    transaction.on_commit(lambda: get_broker().publish(channels, event), using=using)
+
+
+def format_event(event):
+    return 'id: %d\nevent: message\ndata: %s\n\n' % (event['id'], event['data'])
+
+
+def backlog(filters, after, limit=BACKLOG_LIMIT):
+    from .models import Messages
+
+    queryset = Messages.objects.select_related('business', 'user').filter(pk__gt=after, **filters)
+    return [message_event(message) for message in queryset.order_by('pk')[:limit]]
+
+
+async def event_stream(filters, last_event_id=None):
+    channel = 'business:%s' % filters['business'] if 'business' in filters else 'user:%s' % filters['user']
+    broker = get_broker()
+    # Subscribe before reading the backlog so nothing created in between is lost
+    subscription = broker.subscribe([channel])
+    heartbeat = getattr(settings, 'APIS_REALTIME_HEARTBEAT', 15)
+    sent = last_event_id or 0
+    try:
+        yield 'retry: %d\n\n' % RETRY_MS
+        if last_event_id is not None:
+            for event in await sync_to_async(backlog)(filters, last_event_id):
+                sent = event['id']
+                yield format_event(event)
+        while not subscription.finished:
+            event = await subscription.get(heartbeat)
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            if event['id'] <= sent or any(event[key] != value for key, value in filters.items()):
+                continue
+            sent = event['id']
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def stream_user(request):
+    """The Users the request's access token belongs to, or None."""
+    from .authentication import CachedJWTAuthentication
+
+    authentication = CachedJWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header is not None else request.GET.get('token')
+    if not raw_token:
+        return None
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def may_follow(user, filters):
+    from .models import Business
+
+    if user.is_staff or filters.get('user') == user.pk:
+        return True
+    # The business side of a conversation sees all of it
+    return 'business' in filters and Business.objects.filter(pk=filters['business'], owner=user).exists()
+
+
+def authorize(request, filters):
+    """An error response, or None when the caller may follow the stream."""
+    user = stream_user(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'}, status=401)
+    if not may_follow(user, filters):
+        return JsonResponse({'detail': 'You can only follow your own messages or those of your business.'}, status=403)
+    return None
+
+
+def parse_id(value):
+    if value is None or value == '':
+        return None
+    if not value.isdigit():
+        raise ValueError(value)
+    return int(value)
+
+
+async def message_stream(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        filters = {
+            key: value for key, value in (
+                ('business', parse_id(request.GET.get('business'))),
+                ('user', parse_id(request.GET.get('user'))),
+            ) if value is not None
+        }
+        last_event_id = parse_id(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    except ValueError:
+        return JsonResponse({'detail': 'business, user and Last-Event-ID must be integer ids.'}, status=400)
+    if not filters:
+        return JsonResponse({'detail': 'Pass business, user or both.'}, status=400)
+    denied = await sync_to_async(authorize)(request, filters)
+    if denied is not None:
+        return denied
+
+    response = StreamingHttpResponse(event_stream(filters, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,62 @@
+"""
+JSON rendering and parsing with orjson.
+
+orjson serializes dicts, lists, strings, numbers, UUIDs and date/time
+values in C. Aware datetimes come out as ISO 8601 with a trailing Z for UTC,
+which matches what DRF's DateTimeField produces. The few types orjson does
+not know (Decimal, lazy translation strings, querysets, timedelta) go through
+DRF's own JSONEncoder, so the output is the same as JSONRenderer's, only
+faster on large lists.
+
+Enable them with:
+
+    REST_FRAMEWORK = {
+        'DEFAULT_RENDERER_CLASSES': ['apis.renderers.ORJSONRenderer', ...],
+        'DEFAULT_PARSER_CLASSES': ['apis.renderers.ORJSONParser', ...],
+    }
+"""
+import orjson
+from django.utils.http import parse_header_parameters
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.utils.encoders import JSONEncoder
+
+_fallback = JSONEncoder()
+
+
+def default(obj):
+    return _fallback.default(obj)
+
+
+class ORJSONRenderer(renderers.BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        # `Accept: application/json; indent=4`, as JSONRenderer allows
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=option)
+
+    def get_indent(self, accepted_media_type, renderer_context):
+        if accepted_media_type:
+            _, params = parse_header_parameters(accepted_media_type)
+            if params.get('indent'):
+                return True
+        return bool(renderer_context.get('indent'))
+
+
+class ORJSONParser(BaseParser):
+    media_type = 'application/json'
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % exc)
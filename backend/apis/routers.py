@@ -0,0 +1,42 @@
+"""
+Read/write database routing.
+
+With SQLite in WAL mode readers never block the writer or each other, so
+reads can go through a separate read-only connection (see
+backend/settings_production.py) while writes keep the default one. Enable
+it with:
+
+    DATABASE_ROUTERS = ['apis.routers.ReadWriteRouter']
+    APIS_READ_DATABASE = 'replica'
+
+Reads stay on the write connection while it is inside a transaction, so a
+view always sees its own uncommitted writes, and objects fetched through a
+relation are read from the database their parent came from.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def read_alias():
+    return getattr(settings, 'APIS_READ_DATABASE', None) or DEFAULT_DB_ALIAS
+
+
+class ReadWriteRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are connections to the same database file
+        aliases = {DEFAULT_DB_ALIAS, read_alias()}
+        return obj1._state.db in aliases and obj2._state.db in aliases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
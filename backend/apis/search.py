@@ -0,0 +1,126 @@
+"""
+Full-text search over businesses.
+
+Business name, address and description are mirrored into an SQLite FTS5
+table using the trigram tokenizer, so substring searches hit an index
+instead of running `LIKE '%x%'` over every row. The index is created after
+`migrate`, kept in sync by the Business signals in models.py and can be
+rebuilt with `manage.py rebuild_search_index`.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'apis_business_fts'
+FTS_COLUMNS = ('b_name', 'address', 'description')
+# bm25() column weights, in FTS_COLUMNS order: a name hit counts the most.
+FTS_WEIGHTS = (10.0, 3.0, 1.0)
+# The trigram tokenizer cannot match anything shorter than three characters.
+MIN_TERM_LENGTH = 3
+
+
+def is_available(using=DEFAULT_DB_ALIAS):
+    # trigram tokenizer shipped with SQLite 3.34
+    connection = connections[using]
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 34, 0)
+
+
+def create_index(using=DEFAULT_DB_ALIAS):
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, tokenize='trigram')"
+            % (FTS_TABLE, ', '.join(FTS_COLUMNS))
+        )
+
+
+def index_business(business, using=DEFAULT_DB_ALIAS):
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [business.pk])
+        cursor.execute(
+            'INSERT INTO %s (rowid, %s) VALUES (%%s, %%s, %%s, %%s)' % (FTS_TABLE, ', '.join(FTS_COLUMNS)),
+            [business.pk] + [getattr(business, column) or '' for column in FTS_COLUMNS],
+        )
+
+
+def remove_business(pk, using=DEFAULT_DB_ALIAS):
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [pk])
+
+
+def rebuild_index(using=DEFAULT_DB_ALIAS):
+    from .models import Business
+
+    if not is_available(using):
+        return 0
+    create_index(using)
+    table = Business._meta.db_table
+    columns = ', '.join(FTS_COLUMNS)
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.execute(
+            'INSERT INTO %s (rowid, %s) SELECT id, %s FROM %s'
+            % (FTS_TABLE, columns, ', '.join("COALESCE(%s, '')" % c for c in FTS_COLUMNS), table)
+        )
+        cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (FTS_TABLE, FTS_TABLE))
+        cursor.execute('SELECT COUNT(*) FROM %s' % FTS_TABLE)
+        return cursor.fetchone()[0]
+
+
+def build_match(text, column=None, phrase=False):
+    """
+    Turn user input into an FTS5 query. By default every word becomes a
+    quoted substring phrase and all of them must match, in any order; words
+    too short for the trigram index are left out (see short_term_filter()).
+    With `phrase`, the whole text must appear as it was typed, as with
+    icontains. Returns None when there is nothing long enough to look up.
+    """
+    if phrase:
+        terms = [text] if len(text) >= MIN_TERM_LENGTH else []
+    else:
+        terms = [term for term in text.split() if len(term) >= MIN_TERM_LENGTH]
+    if not terms:
+        return None
+    query = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+    if column:
+        return '%s : (%s)' % (column, query)
+    return query
+
+
+def short_term_filter(text):
+    """
+    A Q object requiring each word of `text` that build_match() leaves out
+    to appear in one of the indexed columns, so "ny pizza" still needs "ny".
+    """
+    condition = Q()
+    for term in text.split():
+        if len(term) < MIN_TERM_LENGTH:
+            condition &= reduce(or_, (Q(**{'%s__icontains' % column: term}) for column in FTS_COLUMNS))
+    return condition
+
+
+def filter_queryset(queryset, match, rank=False):
+    """
+    Restrict a Business queryset to rows matching the FTS5 `match` query,
+    optionally ordering them by bm25 relevance (best first). The relevance
+    is a `search_rank` annotation, so keyset pagination can seek on it.
+    """
+    table = queryset.model._meta.db_table
+    queryset = queryset.extra(
+        tables=[FTS_TABLE],
+        where=['%s.rowid = %s.id' % (FTS_TABLE, table), '%s MATCH %%s' % FTS_TABLE],
+        params=[match],
+    )
+    if rank:
+        weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+        bm25 = RawSQL('bm25(%s, %s)' % (FTS_TABLE, weights), (), output_field=FloatField())
+        queryset = queryset.annotate(search_rank=bm25).order_by('search_rank', 'id')
+    return queryset
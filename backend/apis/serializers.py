@@ -1,13 +1,141 @@
+import os
+
+from django.core.exceptions import ObjectDoesNotExist, ValidationError as DjangoValidationError
+from django.core.files.storage import default_storage
+from django.db import models
 from rest_framework import serializers
-from .models import Business, Users, Event, Review, Inventory, Messages, BusinessImages
+from . import images, uploads
+from .fieldsets import SparseFieldsMixin
+from .profiling import ProfiledSerializerMixin
+from .models import Business, Users, Event, Review, Inventory, Messages, BusinessImages, UploadSession, Conversation
+
+
+class ResumableImageField(serializers.ImageField):
+    """
+    An ImageField that also accepts the id of a completed UploadSession
+    instead of a multipart file; the assembled file is moved into place on
+    save rather than copied.
+    """
+    default_error_messages = {
+        'invalid_upload': 'No completed upload with this id.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = self.get_upload(data)
+        return super().to_internal_value(data)
+
+    def get_upload(self, upload_id):
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            self.fail('invalid_upload')
+        try:
+            session = UploadSession.objects.get(pk=upload_id, owner=user)
+        except (UploadSession.DoesNotExist, DjangoValidationError):
+            self.fail('invalid_upload')
+        if not session.is_complete or not os.path.exists(uploads.partial_path(session)):
+            self.fail('invalid_upload')
+        return uploads.AssembledUpload(session)
+
+
+class ResumableUploadsMixin:
+    # Model image fields accept finished upload session ids as well as files
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: ResumableImageField,
+    }
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    Read-only URLs of the resized variants of an image field, or None until
+    they have been generated. Variants for every object being serialized
+    are looked up together on first use, so lists cost one extra query.
+    Responses made of several lists can look them all up at once and pass
+    the result as context['image_manifests'] ({name: manifest}).
+    """
+
+    # Looks at the whole object list, so compact lists cannot use it
+    requires_instance = True
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value or not value.name:
+            return None
+        manifest = self.get_manifest(value.name)
+        if not manifest:
+            return None
+        request = self.context.get('request')
+        result = {}
+        for variant, entry in manifest.items():
+            result[variant] = dict(entry)
+            for extension in images.FORMATS:
+                url = default_storage.url(entry[extension])
+                result[variant][extension] = request.build_absolute_uri(url) if request else url
+        return result
+
+    def get_manifest(self, name):
+        root = self.root
+        manifests = self.context.get('image_manifests')
+        if manifests is None:
+            manifests = root.__dict__.setdefault('_image_manifests', {})
+        if name not in manifests:
+            names = {name} | self.sibling_image_names(root.instance)
+            found = images.lookup(names - manifests.keys())
+            for missing in names:
+                manifests.setdefault(missing, found.get(missing))
+        return manifests[name]
+
+    @staticmethod
+    def sibling_image_names(instances):
+        # Every image name on the objects the root serializer is rendering
+        if instances is None:
+            return set()
+        if not isinstance(instances, (list, tuple)) and not hasattr(instances, 'model'):
+            instances = [instances]
+        fields = images.image_fields()
+        names = set()
+        for instance in instances:
+            for field in fields.get(type(instance), []):
+                name = getattr(instance, field).name
+                if name:
+                    names.add(name)
+        return names
+
+
+class BusinessSerializer(ProfiledSerializerMixin, SparseFieldsMixin, ResumableUploadsMixin, serializers.ModelSerializer):
+    # Only present on proximity (?near=) queries
+    distance_km = serializers.FloatField(read_only=True)
+    # Maintained by BusinessRating; businesses without reviews have no row yet
+    rating_count = serializers.SerializerMethodField()
+    rating_average = serializers.FloatField(source='rating.average', read_only=True)
+    rating_histogram = serializers.SerializerMethodField()
+    last_review_at = serializers.DateTimeField(source='rating.last_review_at', read_only=True)
+    images_variants = ImageVariantsField(source='images')
 
-class BusinessSerializer(serializers.ModelSerializer):
     class Meta:
         model = Business
         fields = '__all__'
 
-class UsersSerializer(serializers.ModelSerializer):
+    def get_rating_count(self, obj):
+        try:
+            return obj.rating.review_count
+        except ObjectDoesNotExist:
+            return 0
+
+    def get_rating_histogram(self, obj):
+        try:
+            return obj.rating.histogram
+        except ObjectDoesNotExist:
+            return {str(star): 0 for star in range(1, 6)}
+
+class UsersSerializer(ProfiledSerializerMixin, SparseFieldsMixin, ResumableUploadsMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
+    profile_picture_variants = ImageVariantsField(source='profile_picture')
 
     class Meta:
         model = Users
@@ -29,14 +157,15 @@ class UsersSerializer(serializers.ModelSerializer):
             instance.save()
         return instance
 
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(ProfiledSerializerMixin, SparseFieldsMixin, ResumableUploadsMixin, serializers.ModelSerializer):
     business_name = serializers.CharField(source='business.b_name', read_only=True)
+    image_variants = ImageVariantsField(source='image')
 
     class Meta:
         model = Event
-        fields = ['id', 'name', 'description', 'start_time', 'end_time', 'status', 'image', 'location', 'business_name', 'business']
+        fields = ['id', 'name', 'description', 'start_time', 'end_time', 'status', 'image', 'image_variants', 'location', 'business_name', 'business']
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(ProfiledSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
     business_name = serializers.CharField(source='business.b_name', read_only=True)
 
@@ -44,14 +173,15 @@ class ReviewSerializer(serializers.ModelSerializer):
         model = Review
         fields = ['id', 'title', 'content', 'rating', 'likes', 'created_at', 'user', 'user_name', 'business', 'business_name']
 
-class InventorySerializer(serializers.ModelSerializer):
+class InventorySerializer(ProfiledSerializerMixin, SparseFieldsMixin, ResumableUploadsMixin, serializers.ModelSerializer):
     business_name = serializers.CharField(source='business.b_name', read_only=True)
+    image_variants = ImageVariantsField(source='image')
 
     class Meta:
         model = Inventory
-        fields = ['id', 'product_name', 'description', 'quantity', 'price', 'date_added', 'image', 'business_name', 'business']
+        fields = ['id', 'product_name', 'description', 'quantity', 'price', 'date_added', 'image', 'image_variants', 'business_name', 'business']
 
-class MessagesSerializer(serializers.ModelSerializer):
+class MessagesSerializer(ProfiledSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
     business_name = serializers.CharField(source='business.b_name', read_only=True)
 
@@ -59,12 +189,53 @@ class MessagesSerializer(serializers.ModelSerializer):
         model = Messages
         fields = ['id', 'content', 'date', 'is_read', 'user', 'user_name', 'business', 'business_name']
 
-class BusinessImagesSerializer(serializers.ModelSerializer):
+class ConversationSerializer(ProfiledSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    user_name = serializers.CharField(source='user.username', read_only=True)
     business_name = serializers.CharField(source='business.b_name', read_only=True)
 
+    class Meta:
+        model = Conversation
+        fields = [
+            'id', 'business', 'business_name', 'user', 'user_name', 'message_count', 'unread_count',
+            'last_message', 'last_preview', 'last_date',
+        ]
+        read_only_fields = fields
+
+class MarkConversationReadSerializer(serializers.Serializer):
+    # Clients pass the newest message they have shown, so a message that
+    # arrives meanwhile stays unread.
+    up_to = serializers.IntegerField(required=False, min_value=1)
+
+class BusinessImagesSerializer(ProfiledSerializerMixin, SparseFieldsMixin, ResumableUploadsMixin, serializers.ModelSerializer):
+    business_name = serializers.CharField(source='business.b_name', read_only=True)
+    image_1_variants = ImageVariantsField(source='image_1')
+    image_2_variants = ImageVariantsField(source='image_2')
+    image_3_variants = ImageVariantsField(source='image_3')
+    image_4_variants = ImageVariantsField(source='image_4')
+
     class Meta:
         model = BusinessImages
-        fields = ['id', 'image_1', 'image_2', 'image_3', 'image_4', 'business', 'business_name']
+        fields = [
+            'id', 'image_1', 'image_2', 'image_3', 'image_4',
+            'image_1_variants', 'image_2_variants', 'image_3_variants', 'image_4_variants',
+            'business', 'business_name',
+        ]
+
+class InventoryPageSerializer(serializers.Serializer):
+    next = serializers.CharField(allow_null=True, read_only=True)
+    results = InventorySerializer(many=True, read_only=True)
+
+class BusinessPageSerializer(ProfiledSerializerMixin, serializers.Serializer):
+    """
+    Read-only: a business and the related rows its page shows, as loaded
+    by pages.load(). The nested lists render in full; ?fields= does not
+    apply to them.
+    """
+    business = BusinessSerializer(source='*', read_only=True)
+    images = BusinessImagesSerializer(source='page_images', many=True, read_only=True)
+    events = EventSerializer(source='page_events', many=True, read_only=True)
+    reviews = ReviewSerializer(source='page_reviews', many=True, read_only=True)
+    inventory = InventoryPageSerializer(source='page_inventory', read_only=True)
 
 
 class UserSignUpSerializer(serializers.ModelSerializer):
@@ -76,9 +247,7 @@ class UserSignUpSerializer(serializers.ModelSerializer):
         }
 
     def create(self, validated_data):
-        user = Users.objects.create_user(
-            username=validated_data['username'],
-            password=validated_data['password'],
+        fields = dict(
             email=validated_data.get('email', ''),
             location=validated_data.get('location', ''),
             zipcode=validated_data.get('zipcode', ''),  
@@ -86,4 +255,33 @@ class UserSignUpSerializer(serializers.ModelSerializer):
             bio=validated_data.get('bio', ''),
             profile_picture=validated_data.get('profile_picture', None)
         )
-        return user
\ No newline at end of file
+        password_hash = validated_data.get('password_hash')
+        if password_hash is None:
+            return Users.objects.create_user(
+                username=validated_data['username'],
+                password=validated_data['password'],
+                **fields
+            )
+
+        # Already hashed off the event loop by the async signup view
+        fields['email'] = Users.objects.normalize_email(fields['email'])
+        user = Users(username=Users.normalize_username(validated_data['username']), password=password_hash, **fields)
+        user.save()
+        return user
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'received', 'completed', 'chunk_size', 'created_at']
+        read_only_fields = ['id', 'received', 'completed', 'created_at']
+
+    def get_chunk_size(self, obj):
+        return uploads.max_chunk_size()
+
+    def validate_size(self, value):
+        if value <= 0 or value > uploads.max_size():
+            raise serializers.ValidationError(f'Uploads must be between 1 and {uploads.max_size()} bytes.')
+        return value
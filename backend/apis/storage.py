@@ -0,0 +1,113 @@
+"""
+Content-addressed media storage.
+
+Every file is stored once under the SHA-256 of its bytes, as
+`cas/<aa>/<bb>/<sha256><ext>`, whatever name the model's upload_to asked
+for. Identical uploads (the same photo on several BusinessImages rows or
+products) therefore share one file, and because a name can never point at
+different bytes, media.serve_media can let clients cache it forever.
+
+Enable it with:
+
+    STORAGES = {
+        'default': {'BACKEND': 'apis.storage.ContentAddressedStorage'},
+        ...
+    }
+
+Files may be shared between rows, so delete() leaves them in place;
+`manage.py collect_media_garbage` removes the ones nothing references.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+CAS_ROOT = 'cas'
+
+
+def is_content_addressed(name):
+    return name.startswith(CAS_ROOT + '/')
+
+
+def digest_from_name(name):
+    """The SHA-256 a content-addressed name was built from, or None."""
+    if not is_content_addressed(name):
+        return None
+    digest, _ = os.path.splitext(os.path.basename(name))
+    return digest
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    hash_chunk_size = 64 * 1024
+
+    def content_name(self, digest, name):
+        _, extension = os.path.splitext(name)
+        return '/'.join([CAS_ROOT, digest[:2], digest[2:4], digest + extension.lower()])
+
+    def get_available_name(self, name, max_length=None):
+        # The final name depends on the content, which _save decides
+        return name
+
+    def _save(self, name, content):
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (large or resumable uploads): hash it in place
+            # and move it, so the bytes are never copied.
+            source = content.temporary_file_path()
+            digest = self.hash_file(source)
+            final = self.content_name(digest, name)
+            if self.exists(final):
+                os.remove(source)
+            else:
+                self.ensure_directory(final)
+                file_move_safe(source, self.path(final))
+                self.set_permissions(final)
+            return final
+
+        # Stream into a temporary file next to the destination while hashing.
+        hasher = hashlib.sha256()
+        tmp_dir = os.path.join(self.location, CAS_ROOT, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(self.hash_chunk_size):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+            final = self.content_name(hasher.hexdigest(), name)
+            if self.exists(final):
+                return final
+            self.ensure_directory(final)
+            os.replace(tmp_path, self.path(final))
+            tmp_path = None
+            self.set_permissions(final)
+            return final
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, name):
+        # Other rows may share this file; see collect_media_garbage
+        pass
+
+    def purge(self, name):
+        super().delete(name)
+
+    def ensure_directory(self, name):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+
+    def set_permissions(self, name):
+        if self.file_permissions_mode is not None:
+            os.chmod(self.path(name), self.file_permissions_mode)
+
+    def hash_file(self, path):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(self.hash_chunk_size), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
@@ -1,3 +1,1832 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from base64 import b64encode
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    apps, benchmarks, exports, geo, hours, images, imports, metrics, middleware, passwords, profiling, realtime,
+    throttling, uploads,
+)
+from .authentication import CachedJWTAuthentication, user_cache
+from .renderers import ORJSONParser, ORJSONRenderer
+from .routers import ReadWriteRouter
+from .serializers import ReviewSerializer
+from .pagination import KeysetPagination
+from .views import BusinessListCreateView
+from .models import (
+    Business, Users, Event, Review, Inventory, Messages, BusinessImages, ZipcodeCentroid, BusinessRating,
+    ImageDerivative, UploadSession, Conversation, OpeningHours, default_work_time,
+)
+
+
+# TestCase never commits, so response cache invalidation (which runs on
+# commit) would not fire; tests that are not about caching turn it off.
+without_response_cache = override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'responses': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    },
+    APIS_RESPONSE_CACHE='responses',
+)
+
+
+def middleware_first(path):
+    """settings.MIDDLEWARE with `path` moved (or added) to the front, never twice."""
+    return [path, *(name for name in settings.MIDDLEWARE if name != path)]
+
+
+# Tests of upload paths and variant names expect the plain file layout, which
+# settings_production replaces with content-addressed names.
+with_filesystem_storage = override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+
+
+class QueryBudgetMixin:
+    """
+    Assertions that fail when an endpoint's query count depends on how many
+    rows it returns (the classic N+1 from `source='business.b_name'`).
+    """
+
+    def count_queries(self, url, client=None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        return len(ctx.captured_queries), ctx
+
+    def assertQueryCountConstant(self, url, add_rows, small=1, large=10, client=None):
+        """
+        Call `add_rows(n)` to create `n` more rows matching `url`, then check
+        that fetching `small` rows and fetching `large` rows cost the same.
+        """
+        add_rows(small)
+        small_count, _ = self.count_queries(url, client)
+        add_rows(large - small)
+        large_count, ctx = self.count_queries(url, client)
+        self.assertEqual(
+            small_count, large_count,
+            '%s: %d queries for %d rows but %d for %d rows:\n%s' % (
+                url, small_count, small, large_count, large,
+                '\n'.join(q['sql'] for q in ctx.captured_queries),
+            ),
+        )
+        return large_count
+
+    def assertMaxQueries(self, url, budget, client=None):
+        count, ctx = self.count_queries(url, client)
+        self.assertLessEqual(
+            count, budget,
+            '%s: %d queries, budget is %d:\n%s' % (
+                url, count, budget, '\n'.join(q['sql'] for q in ctx.captured_queries),
+            ),
+        )
+
+
+class APITestData:
+    """Small factory helpers shared by the API test cases."""
+    counter = 0
+
+    @classmethod
+    def next_id(cls):
+        cls.counter += 1
+        return cls.counter
+
+    @classmethod
+    def make_user(cls, **kwargs):
+        n = cls.next_id()
+        kwargs.setdefault('username', 'user%d' % n)
+        kwargs.setdefault('location', 'Testville')
+        return Users.objects.create_user(**kwargs)
+
+    @classmethod
+    def make_business(cls, owner=None, **kwargs):
+        n = cls.next_id()
+        kwargs.setdefault('b_name', 'Business %d' % n)
+        kwargs.setdefault('address', '%d Main Street' % n)
+        kwargs.setdefault('phone', '555%07d' % n)
+        kwargs.setdefault('description', 'A test business')
+        kwargs.setdefault('category', 'RESTAURANT')
+        return Business.objects.create(owner=owner or cls.make_user(is_business_owner=True), **kwargs)
+
+
+@without_response_cache
+class NestedNameQueryTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_review_list(self):
+        def add(n):
+            for _ in range(n):
+                Review.objects.create(
+                    business=APITestData.make_business(), user=APITestData.make_user(),
+                    title='Nice', content='Good food', rating=4,
+                )
+        self.assertQueryCountConstant('/api/reviews/', add)
+
+    def test_messages_list(self):
+        def add(n):
+            for _ in range(n):
+                Messages.objects.create(
+                    business=APITestData.make_business(), user=APITestData.make_user(), content='Hello',
+                )
+        self.assertQueryCountConstant('/api/messages/', add)
+
+    def test_event_list(self):
+        def add(n):
+            for _ in range(n):
+                Event.objects.create(
+                    business=APITestData.make_business(), name='Launch', description='Party',
+                    start_time='2030-01-01T10:00:00Z', end_time='2030-01-01T12:00:00Z', status='published',
+                )
+        self.assertQueryCountConstant('/api/events/', add)
+
+    def test_inventory_list(self):
+        def add(n):
+            for _ in range(n):
+                Inventory.objects.create(
+                    business=APITestData.make_business(), product_name='Milk', description='1L',
+                    quantity=3, price='1.99', image='products/milk.jpg',
+                )
+        self.assertQueryCountConstant('/api/inventory/', add)
+
+    def test_business_images_list(self):
+        def add(n):
+            for _ in range(n):
+                BusinessImages.objects.create(business=APITestData.make_business())
+        self.assertQueryCountConstant('/api/business-images/', add)
+
+    def test_business_list(self):
+        def add(n):
+            for _ in range(n):
+                business = APITestData.make_business()
+                Review.objects.create(business=business, user=business.owner, title='Ok', content='Ok', rating=3)
+        self.assertQueryCountConstant('/api/businesses/', add)
+
+    def test_users_list(self):
+        self.assertQueryCountConstant('/api/users/', lambda n: [APITestData.make_user() for _ in range(n)])
+
+    def test_paginated_review_list(self):
+        def add(n):
+            for _ in range(n):
+                Review.objects.create(
+                    business=APITestData.make_business(), user=APITestData.make_user(),
+                    title='Nice', content='Good food', rating=4,
+                )
+        self.assertQueryCountConstant('/api/reviews/?page_size=50', add)
+
+    def test_detail_views(self):
+        review = Review.objects.create(
+            business=APITestData.make_business(), user=APITestData.make_user(),
+            title='Nice', content='Good food', rating=4,
+        )
+        message = Messages.objects.create(business=review.business, user=review.user, content='Hi')
+        self.assertMaxQueries('/api/reviews/%d/' % review.pk, 1)
+        self.assertMaxQueries('/api/messages/%d/' % message.pk, 1)
+
+
+@without_response_cache
+class BusinessSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        owner = APITestData.make_user(is_business_owner=True)
+        self.bakery = APITestData.make_business(
+            owner, b_name='Sunrise Bakery', address='12 Elm Road', description='Fresh bread daily', zipcode='10001',
+        )
+        self.cafe = APITestData.make_business(
+            owner, b_name='Corner Cafe', address='4 Bakery Lane', description='Coffee and cake',
+            category='BOOKSTORE', zipcode='10002',
+        )
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()]
+
+    def test_query_is_ranked_by_relevance(self):
+        self.assertEqual(self.ids('/api/businesses/?q=bakery'), [self.bakery.id, self.cafe.id])
+
+    def test_substring_and_combined_filters(self):
+        self.assertEqual(self.ids('/api/businesses/?q=akery&category=BOOKSTORE'), [self.cafe.id])
+        self.assertEqual(self.ids('/api/businesses/?b_name=rise&zipcode=10001'), [self.bakery.id])
+        self.assertEqual(self.ids('/api/businesses/?address=bakery'), [self.cafe.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.cafe.b_name = 'Corner Books'
+        self.cafe.save()
+        self.assertEqual(self.ids('/api/businesses/?b_name=books'), [self.cafe.id])
+        self.assertEqual(self.ids('/api/businesses/?b_name=cafe'), [])
+        self.bakery.delete()
+        self.assertEqual(self.ids('/api/businesses/?q=bread'), [])
+
+    def test_short_terms_fall_back_to_scan(self):
+        self.assertEqual(self.ids('/api/businesses/?b_name=co'), [self.cafe.id])
+
+    def test_short_words_in_longer_queries_still_match(self):
+        pizza = APITestData.make_business(b_name='NY Pizza', address='1 Main St', description='Slices')
+        APITestData.make_business(b_name='Pizza Place', address='2 Main St', description='Pies')
+        self.assertEqual(self.ids('/api/businesses/?q=ny pizza'), [pizza.id])
+        self.assertEqual(self.ids('/api/businesses/?b_name=ny pizza'), [pizza.id])
+        self.assertEqual(self.ids('/api/businesses/?address=1 main st'), [pizza.id])
+
+    def test_query_words_match_anywhere_but_name_and_address_match_as_typed(self):
+        joes = APITestData.make_business(b_name='Joe Pizza', address='5 Oak Avenue', description='Slices')
+        by_joe = APITestData.make_business(b_name='Pizza by Joe', address='Avenue 5, Oak', description='Pies')
+        self.assertEqual(sorted(self.ids('/api/businesses/?q=joe pizza')), [joes.id, by_joe.id])
+        self.assertEqual(self.ids('/api/businesses/?b_name=joe pizza'), [joes.id])
+        self.assertEqual(self.ids('/api/businesses/?address=oak ave'), [joes.id])
+
+    def test_ranked_results_page_in_relevance_order(self):
+        best = APITestData.make_business(b_name='Bakery Bakery', description='The bakery bakery')
+        ranked = self.ids('/api/businesses/?q=bakery')
+        self.assertEqual(ranked[0], best.id)
+        for url in ['/api/businesses/?q=bakery&page_size=1', '/api/businesses/?q=bakery&compact=true&page_size=1']:
+            ids = []
+            while url:
+                page = self.client.get(url).json()
+                ids += [row['id'] for row in page['results']]
+                url = page['next']
+            self.assertEqual(ids, ranked)
+
+
+@without_response_cache
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        owner = APITestData.make_user(is_business_owner=True)
+        self.ids = [APITestData.make_business(owner).pk for _ in range(5)]
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        body = response.json()
+        return [row['id'] for row in body['results']], body['next'], body['previous']
+
+    def test_cursor_round_trip(self):
+        self.assertIsInstance(self.client.get('/api/businesses/').json(), list)
+        ids, next_url, previous_url = self.page('/api/businesses/?page_size=2')
+        self.assertEqual((ids, previous_url), (self.ids[:2], None))
+        ids, next_url, previous_url = self.page(next_url)
+        self.assertEqual(ids, self.ids[2:4])
+        ids, last_url, _ = self.page(next_url)
+        self.assertEqual((ids, last_url), (self.ids[4:], None))
+
+        # previous walks back from the page it came from
+        self.assertEqual(self.page(previous_url)[0], self.ids[:2])
+        ids, _, first_previous = self.page(previous_url)
+        self.assertIsNone(first_previous)
+
+    def test_invalid_cursors_are_404(self):
+        position = b64encode(json.dumps({'p': [self.ids[0], 1]}).encode(), altchars=b'-_').decode()
+        for cursor in ['not base64!', b64encode(b'{"x": 1}').decode(), position]:
+            self.assertEqual(self.client.get('/api/businesses/', {'cursor': cursor}).status_code, 404, cursor)
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(KeysetPagination, 'max_page_size', 3):
+            ids, next_url, _ = self.page('/api/businesses/?page_size=1000')
+        self.assertEqual(ids, self.ids[:3])
+        self.assertIsNotNone(next_url)
+        self.assertEqual(self.page('/api/businesses/?page_size=0')[0], self.ids)
+
+
+@without_response_cache
+class ProximitySearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        ZipcodeCentroid.objects.bulk_create([
+            ZipcodeCentroid(zipcode='10001', latitude=40.7506, longitude=-73.9972),
+            ZipcodeCentroid(zipcode='10002', latitude=40.7157, longitude=-73.9863),
+            ZipcodeCentroid(zipcode='07030', latitude=40.7449, longitude=-74.0324),
+            ZipcodeCentroid(zipcode='02108', latitude=42.3576, longitude=-71.0636),
+        ])
+        owner = APITestData.make_user(is_business_owner=True, zipcode='10001')
+        self.chelsea = APITestData.make_business(owner, zipcode='10001')
+        self.hoboken = APITestData.make_business(owner, zipcode='07030')
+        self.les = APITestData.make_business(owner, zipcode='10002')
+        self.boston = APITestData.make_business(owner, zipcode='02108')
+        self.owner = owner
+
+    def test_coordinates_are_denormalized_on_save(self):
+        self.assertEqual((self.boston.latitude, self.boston.longitude), (42.3576, -71.0636))
+
+    def test_results_within_radius_sorted_by_distance(self):
+        rows = self.client.get('/api/businesses/?near=10001&radius_km=10').json()
+        self.assertEqual([r['id'] for r in rows], [self.chelsea.id, self.hoboken.id, self.les.id])
+        self.assertAlmostEqual(rows[2]['distance_km'], geo.haversine_km(40.7506, -73.9972, 40.7157, -73.9863), 3)
+        rows = self.client.get('/api/businesses/?near=10001&radius_km=500').json()
+        self.assertEqual(rows[-1]['id'], self.boston.id)
+
+    def test_near_me_and_pagination(self):
+        self.client.force_authenticate(self.owner)
+        page = self.client.get('/api/businesses/?near=me&radius_km=10&page_size=2').json()
+        self.assertEqual([r['id'] for r in page['results']], [self.chelsea.id, self.hoboken.id])
+        page = self.client.get(page['next']).json()
+        self.assertEqual([r['id'] for r in page['results']], [self.les.id])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/businesses/?near=99999').status_code, 400)
+        self.assertEqual(self.client.get('/api/businesses/?near=10001&radius_km=abc').status_code, 400)
+
+
+@without_response_cache
+class BusinessRatingTests(TestCase):
+    def setUp(self):
+        self.business = APITestData.make_business()
+        self.other = APITestData.make_business()
+        self.user = APITestData.make_user()
+
+    def review(self, rating, business=None):
+        return Review.objects.create(
+            business=business or self.business, user=self.user, title='t', content='c', rating=rating,
+        )
+
+    def rating(self, business=None):
+        return BusinessRating.objects.get(business=business or self.business)
+
+    def test_create_update_delete(self):
+        first = self.review(5)
+        second = self.review(2)
+        aggregate = self.rating()
+        self.assertEqual((aggregate.review_count, aggregate.rating_sum, aggregate.average), (2, 7, 3.5))
+        self.assertEqual(aggregate.histogram, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1})
+        self.assertEqual(aggregate.last_review_at, second.created_at)
+
+        second.rating = 4
+        second.save()
+        self.assertEqual(self.rating().histogram, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1})
+
+        second.delete()
+        aggregate = self.rating()
+        self.assertEqual((aggregate.review_count, aggregate.average), (1, 5.0))
+        self.assertEqual(aggregate.last_review_at, first.created_at)
+
+        Review.objects.get(pk=first.pk).delete()
+        aggregate = self.rating()
+        self.assertEqual((aggregate.review_count, aggregate.average, aggregate.last_review_at), (0, None, None))
+
+    def test_moving_review_between_businesses(self):
+        review = self.review(4)
+        review = Review.objects.get(pk=review.pk)
+        review.business = self.other
+        review.save()
+        self.assertEqual(self.rating().review_count, 0)
+        self.assertEqual(self.rating(self.other).rating_4_count, 1)
+
+    def test_reconcile_command(self):
+        self.review(1)
+        self.review(3)
+        BusinessRating.objects.all().delete()
+        call_command('reconcile_ratings', stdout=StringIO())
+        aggregate = self.rating()
+        self.assertEqual((aggregate.review_count, aggregate.average), (2, 2.0))
+        self.assertEqual(self.rating(self.other).review_count, 0)
+
+    def test_missing_or_stale_rows_are_rebuilt(self):
+        first = self.review(3)
+        second = self.review(5)
+        BusinessRating.objects.all().delete()
+        first.rating = 1
+        first.save()
+        self.assertEqual((self.rating().review_count, self.rating().rating_sum), (2, 6))
+        second.delete()
+        self.assertEqual((self.rating().review_count, self.rating().rating_sum), (1, 1))
+
+        BusinessRating.objects.filter(business=self.business).update(review_count=0, rating_sum=0, rating_1_count=0)
+        first.rating = 2
+        first.save()
+        self.assertEqual(self.rating().histogram, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0})
+        self.assertEqual(self.rating().rating_sum, 2)
+
+    def test_migrate_backfills_missing_rows(self):
+        self.review(4)
+        BusinessRating.objects.all().delete()
+        apps.reconcile_ratings(sender=None, using='default')
+        self.assertEqual((self.rating().review_count, self.rating().average), (1, 4.0))
+        self.assertFalse(BusinessRating.objects.filter(business=self.other).exists())
+
+    def test_exposed_and_sortable_on_business_list(self):
+        self.review(2)
+        self.review(5, self.other)
+        client = APIClient()
+        rows = client.get('/api/businesses/?ordering=-rating').json()
+        self.assertEqual([r['id'] for r in rows], [self.other.id, self.business.id])
+        self.assertEqual(rows[0]['rating_average'], 5.0)
+        self.assertEqual(rows[0]['rating_histogram']['5'], 1)
+        empty = APITestData.make_business()
+        row = client.get('/api/businesses/%d/' % empty.id).json()
+        self.assertEqual((row['rating_count'], row['rating_average']), (0, None))
+
+
+class ResponseCacheTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.business = APITestData.make_business(b_name='Old Name')
+
+    def test_hit_skips_database_and_invalidates_on_save(self):
+        url = '/api/businesses/%d/' % self.business.pk
+        self.assertGreater(self.count_queries(url)[0], 0)
+        self.assertEqual(self.count_queries(url)[0], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.business.b_name = 'New Name'
+            self.business.save()
+        self.assertEqual(self.client.get(url).json()['b_name'], 'New Name')
+        self.assertEqual(self.client.get('/api/businesses/').json()[0]['b_name'], 'New Name')
+
+    def test_review_invalidates_business_rating(self):
+        url = '/api/businesses/%d/' % self.business.pk
+        self.assertEqual(self.client.get(url).json()['rating_count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(business=self.business, user=self.business.owner, title='t', content='c', rating=5)
+        self.assertEqual(self.client.get(url).json()['rating_count'], 1)
+
+    def test_query_params_are_normalized(self):
+        self.count_queries('/api/events/?status=published&business=%d' % self.business.pk)
+        self.assertEqual(self.count_queries('/api/events/?business=%d&status=published' % self.business.pk)[0], 0)
+
+    def test_conditional_get(self):
+        url = '/api/businesses/'
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    @with_filesystem_storage
+    def test_generated_variants_invalidate_their_owners(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media_root, APIS_IMAGE_VARIANTS_ASYNC=False):
+            self.business.images = make_jpeg()
+            self.business.save()
+            url = '/api/businesses/%d/' % self.business.pk
+            self.assertIsNone(self.client.get(url).json()['images_variants'])
+            with self.captureOnCommitCallbacks(execute=True):
+                images.schedule([self.business.images.name])
+            self.assertIn('thumb', self.client.get(url).json()['images_variants'])
+
+
+def make_jpeg(name='photo.jpg', size=(2400, 1200)):
+    exif = Image.Exif()
+    exif[0x0110] = 'Test Camera'  # Model
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@without_response_cache
+@with_filesystem_storage
+@override_settings(APIS_IMAGE_VARIANTS_ASYNC=False)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.business = APITestData.make_business()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_variants_generated_after_commit_and_exposed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Inventory.objects.create(
+                business=self.business, product_name='Tea', description='Green',
+                quantity=1, price='2.50', image=make_jpeg(),
+            )
+        variants = ImageDerivative.objects.get(source=item.image.name).variants
+        self.assertEqual((variants['thumb']['width'], variants['thumb']['height']), (200, 100))
+        self.assertEqual(variants['full']['width'], 1600)
+        with default_storage.open(variants['card']['jpeg']) as handle:
+            card = Image.open(handle)
+            self.assertEqual(card.size, (640, 320))
+            self.assertEqual(len(card.getexif()), 0)
+
+        row = APIClient().get('/api/inventory/%d/' % item.pk).json()
+        self.assertTrue(row['image_variants']['thumb']['webp'].endswith('/thumb.webp'))
+
+    def test_saves_that_keep_the_image_do_not_look_up_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Inventory.objects.create(
+                business=self.business, product_name='Tea', description='Green',
+                quantity=1, price='2.50', image=make_jpeg(),
+            )
+        derivatives = ImageDerivative._meta.db_table
+        for item in (item, Inventory.objects.get(pk=item.pk)):
+            item.quantity += 1
+            with CaptureQueriesContext(connection) as ctx:
+                item.save()
+            self.assertFalse([q for q in ctx.captured_queries if derivatives in q['sql']])
+
+        item.image = make_jpeg('other.jpg')
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertTrue([q for q in ctx.captured_queries if derivatives in q['sql']])
+        self.assertTrue(ImageDerivative.objects.filter(source=item.image.name).exists())
+
+    def test_backfill_command(self):
+        item = Inventory.objects.create(
+            business=self.business, product_name='Tea', description='Green',
+            quantity=1, price='2.50', image=make_jpeg(),
+        )
+        self.assertFalse(ImageDerivative.objects.exists())
+        call_command('generate_image_variants', stdout=StringIO())
+        self.assertTrue(ImageDerivative.objects.filter(source=item.image.name).exists())
+
+
+@without_response_cache
+@with_filesystem_storage
+class UploadFlowTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, APIS_UPLOAD_DIR=self.media_root)
+        self.settings_override.enable()
+        self.business = APITestData.make_business()
+        self.client = APIClient()
+        self.client.force_authenticate(self.business.owner)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_business_images_written_once_to_final_path(self):
+        with CaptureQueriesContext(connection) as ctx:
+            row = BusinessImages.objects.create(business=self.business, image_1=make_jpeg('front.jpg'))
+        self.assertEqual(row.image_1.name, 'business/%d/optional/front.jpg' % self.business.pk)
+        self.assertTrue(default_storage.exists(row.image_1.name))
+        self.assertFalse(default_storage.exists('temporary/front.jpg'))
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')])
+
+    def test_new_business_main_image(self):
+        business = APITestData.make_business(images=make_jpeg('logo.jpg'))
+        business.refresh_from_db()
+        self.assertEqual(business.images.name, 'business/%d/main/logo.jpg' % business.pk)
+        self.assertTrue(default_storage.exists(business.images.name))
+
+    def test_resumable_upload(self):
+        data = make_jpeg('big.jpg').read()
+        half = len(data) // 2
+        session = self.client.post('/api/uploads/', {'filename': 'big.jpg', 'size': len(data)}, format='json').json()
+        url = '/api/uploads/%s/' % session['id']
+
+        def put(start, end):
+            return self.client.put(
+                url, data[start:end + 1], content_type='application/octet-stream',
+                HTTP_CONTENT_RANGE='bytes %d-%d/%d' % (start, end, len(data)),
+            )
+
+        self.assertEqual(put(0, half - 1).json()['received'], half)
+        # Resending from the wrong offset is refused and reports where to resume
+        response = put(0, half - 1)
+        self.assertEqual((response.status_code, response.json()['received']), (409, half))
+        self.assertEqual(self.client.get(url).json()['received'], half)
+        self.assertEqual(put(half, len(data) - 1).json()['received'], len(data))
+
+        response = self.client.post(
+            '/api/business-images/', {'business': self.business.pk, 'image_2': session['id']}, format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        row = BusinessImages.objects.get(pk=response.json()['id'])
+        self.assertEqual(row.image_2.name, 'business/%d/optional/big.jpg' % self.business.pk)
+        with default_storage.open(row.image_2.name) as handle:
+            self.assertEqual(handle.read(), data)
+        self.assertFalse(os.path.exists(uploads.partial_path(UploadSession.objects.get(pk=session['id']))))
+
+    def test_losing_the_race_for_an_offset_writes_nothing(self):
+        session = self.client.post('/api/uploads/', {'filename': 'x.jpg', 'size': 10}, format='json').json()
+        receive_chunk = uploads.receive_chunk
+
+        def received_while_another_request_claims(stream, start, end):
+            chunk = receive_chunk(stream, start, end)
+            UploadSession.objects.filter(pk=session['id']).update(received=5)
+            return chunk
+
+        with mock.patch.object(uploads, 'receive_chunk', received_while_another_request_claims):
+            response = self.client.put(
+                '/api/uploads/%s/' % session['id'], b'loser', content_type='application/octet-stream',
+                HTTP_CONTENT_RANGE='bytes 0-4/10',
+            )
+        self.assertEqual((response.status_code, response.json()['received']), (409, 5))
+        self.assertFalse(os.path.exists(uploads.partial_path(UploadSession.objects.get(pk=session['id']))))
+
+    def test_complete_only_once_the_last_chunk_is_written(self):
+        session = self.client.post('/api/uploads/', {'filename': 'x.jpg', 'size': 10}, format='json').json()
+        write_chunk = uploads.write_chunk
+        seen = []
+
+        def write_while_checking(upload, chunk, start):
+            seen.append(UploadSession.objects.get(pk=upload.pk).is_complete)
+            write_chunk(upload, chunk, start)
+
+        with mock.patch.object(uploads, 'write_chunk', write_while_checking):
+            response = self.client.put(
+                '/api/uploads/%s/' % session['id'], b'0123456789', content_type='application/octet-stream',
+                HTTP_CONTENT_RANGE='bytes 0-9/10',
+            )
+        self.assertEqual(seen, [False])
+        self.assertEqual((response.json()['received'], response.json()['completed']), (10, True))
+        self.assertTrue(UploadSession.objects.get(pk=session['id']).is_complete)
+
+    def test_incomplete_upload_rejected(self):
+        session = self.client.post('/api/uploads/', {'filename': 'x.jpg', 'size': 10}, format='json').json()
+        response = self.client.post(
+            '/api/business-images/', {'business': self.business.pk, 'image_1': session['id']}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@without_response_cache
+class ContentAddressedMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            STORAGES={
+                'default': {'BACKEND': 'apis.storage.ContentAddressedStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+        )
+        self.settings_override.enable()
+        self.business = APITestData.make_business()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_identical_uploads_share_one_file(self):
+        data = make_jpeg().read()
+        first = BusinessImages.objects.create(
+            business=self.business, image_1=SimpleUploadedFile('a.jpg', data, content_type='image/jpeg'),
+        )
+        second = BusinessImages.objects.create(
+            business=self.business, image_1=SimpleUploadedFile('b.JPG', data, content_type='image/jpeg'),
+        )
+        self.assertEqual(first.image_1.name, second.image_1.name)
+        self.assertRegex(first.image_1.name, r'^cas/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+
+    def test_serving_with_cache_headers_and_ranges(self):
+        row = BusinessImages.objects.create(business=self.business, image_1=make_jpeg())
+        url = '/media/' + row.image_1.name
+        with default_storage.open(row.image_1.name) as handle:
+            data = handle.read()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), data)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % len(data))
+        self.assertEqual(b''.join(response.streaming_content), data[10:20])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), data[-5:])
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=%d-' % len(data)).status_code, 416)
+        self.assertEqual(self.client.get('/media/../backend/settings.py').status_code, 404)
+
+    def test_only_content_addressed_files_and_variants_are_served(self):
+        for name in ['uploads/partial.bin', 'cas/00/00/readme.txt', 'variants/a/thumb.jpeg']:
+            os.makedirs(os.path.dirname(os.path.join(self.media_root, name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as handle:
+                handle.write(b'data')
+        self.assertEqual(self.client.get('/media/cas/00/00/readme.txt').status_code, 200)
+        self.assertEqual(self.client.get('/media/variants/a/thumb.jpeg').status_code, 200)
+        self.assertEqual(self.client.get('/media/uploads/partial.bin').status_code, 404)
+        self.assertEqual(self.client.get('/media/cas/../uploads/partial.bin').status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/media/uploads/partial.bin').status_code, 200)
+
+    @override_settings(APIS_MEDIA_SENDFILE='x-accel-redirect')
+    def test_sendfile_handoff(self):
+        row = BusinessImages.objects.create(business=self.business, image_1=make_jpeg())
+        response = self.client.get('/media/' + row.image_1.name)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + row.image_1.name)
+        self.assertEqual(response.content, b'')
+
+    def test_garbage_collection_keeps_referenced_files(self):
+        row = BusinessImages.objects.create(business=self.business, image_1=make_jpeg())
+        orphan = default_storage.save('x.jpg', make_jpeg(size=(10, 10)))
+        call_command('collect_media_garbage', min_age_hours=0, stdout=StringIO())
+        self.assertTrue(default_storage.exists(row.image_1.name))
+        self.assertFalse(default_storage.exists(orphan))
+
+
+class InventoryImportTests(TestCase):
+    def setUp(self):
+        self.business = APITestData.make_business()
+        self.client = APIClient()
+        self.client.force_authenticate(self.business.owner)
+        self.url = '/api/inventory/import/?business=%d' % self.business.pk
+
+    def test_csv_upsert_with_error_report(self):
+        Inventory.objects.create(
+            business=self.business, product_name='Milk', description='1L', quantity=1, price='1.00',
+            image='products/milk.jpg',
+        )
+        body = (
+            'product_name,description,quantity,price\n'
+            'Milk,Fresh 1L,40,1.25\n'
+            'Bread,"Sourdough, sliced",10,3.50\n'
+            'Eggs,Dozen,lots,2.00\n'
+        )
+        report = self.client.post(self.url, body, content_type='text/csv').json()
+        self.assertEqual((report['created'], report['updated'], report['failed']), (1, 1, 1))
+        self.assertEqual(report['errors'][0]['line'], 4)
+        self.assertIn('quantity', report['errors'][0]['errors'])
+        milk = Inventory.objects.get(product_name='Milk')
+        self.assertEqual((milk.quantity, str(milk.price), milk.image.name), (40, '1.25', 'products/milk.jpg'))
+        self.assertEqual(Inventory.objects.get(product_name='Bread').description, 'Sourdough, sliced')
+
+    def test_ndjson_in_batches(self):
+        lines = ['{"product_name": "Item %d", "description": "d", "quantity": %d, "price": 1.5}' % (i, i)
+                 for i in range(25)]
+        lines.insert(3, 'not json')
+        importer_batch = imports.InventoryImporter.batch_size
+        imports.InventoryImporter.batch_size = 10
+        try:
+            response = self.client.post(self.url, '\n'.join(lines), content_type='application/x-ndjson')
+        finally:
+            imports.InventoryImporter.batch_size = importer_batch
+        report = response.json()
+        self.assertEqual((report['created'], report['failed']), (25, 1))
+        self.assertEqual(report['errors'][0]['line'], 4)
+        self.assertEqual(Inventory.objects.filter(business=self.business).count(), 25)
+
+    def test_invalid_utf8_is_a_row_error(self):
+        body = b'product_name,description,quantity,price\nMilk,1L,1,1.00\nCr\xe8me,Fresh,2,2.00\n'
+        report = self.client.post(self.url, body, content_type='text/csv').json()
+        self.assertEqual((report['created'], report['failed']), (1, 1))
+        self.assertEqual(report['errors'][0]['line'], 3)
+        self.assertIn('UTF-8', report['errors'][0]['errors']['non_field_errors'][0])
+
+        body = b'{"product_name": "Tea", "description": "d", "quantity": 1, "price": 1}\n{"product_name": "\xff"}\n'
+        report = self.client.post(self.url, body, content_type='application/x-ndjson').json()
+        self.assertEqual((report['created'], report['failed'], report['errors'][0]['line']), (1, 1, 2))
+
+    def test_only_the_owner_may_import(self):
+        self.client.force_authenticate(APITestData.make_user())
+        response = self.client.post(self.url, 'product_name\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.post(self.url, '{}', content_type='application/json').status_code, 403)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.business = APITestData.make_business(b_name='Export Cafe')
+        self.other = APITestData.make_business()
+        self.users = [APITestData.make_user() for _ in range(3)]
+        for i in range(7):
+            Review.objects.create(
+                business=self.business, user=self.users[i % 3], title='T%d' % i, content='c', rating=i % 5 + 1,
+            )
+        Review.objects.create(business=self.other, user=self.users[0], title='x', content='c', rating=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.business.owner)
+
+    def test_ndjson_export_streams_rows_of_one_business(self):
+        response = self.client.get('/api/businesses/%d/export/reviews.ndjson' % self.business.pk)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([r['title'] for r in rows], ['T%d' % i for i in range(7)])
+        self.assertEqual(rows[0]['business_name'], 'Export Cafe')
+        self.assertEqual(rows[1]['user_name'], self.users[1].username)
+
+    def test_names_are_resolved_per_chunk(self):
+        rows = exports.EXPORTS['reviews'].rows(self.business, chunk_size=3)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(len(list(rows)), 7)
+        # Chunked cursor reads plus a business lookup and a user lookup per chunk of 3
+        self.assertLessEqual(len(ctx.captured_queries), 1 + 3 * 2)
+
+    def test_csv_export_and_permissions(self):
+        response = self.client.get('/api/businesses/%d/export/inventory.csv' % self.business.pk)
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines()[0].split(',')[:3],
+                         ['id', 'business', 'business_name'])
+        self.client.force_authenticate(self.other.owner)
+        self.assertEqual(self.client.get('/api/businesses/%d/export/messages.csv' % self.business.pk).status_code, 403)
+
+    def test_management_command(self):
+        out = StringIO()
+        call_command('export_data', 'reviews', format='csv', business=self.other.pk, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+@without_response_cache
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN QUERY PLAN for the main query of each list endpoint must use an
+    index: no plain table scans and no temporary B-tree for ORDER BY.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        ZipcodeCentroid.objects.create(zipcode='10001', latitude=40.7506, longitude=-73.9972)
+        cls.user = APITestData.make_user()
+        cls.business = APITestData.make_business(category='SALON', zipcode='10001')
+        for i in range(6):
+            Review.objects.create(business=cls.business, user=cls.user, title='t', content='c', rating=i % 5 + 1)
+            Messages.objects.create(business=cls.business, user=cls.user, content='hi', is_read=i % 2 == 0)
+            Event.objects.create(
+                business=cls.business, name='e', description='d', status='published',
+                start_time='2030-01-0%dT10:00:00Z' % (i + 1), end_time='2030-01-0%dT12:00:00Z' % (i + 1),
+            )
+            Inventory.objects.create(
+                business=cls.business, product_name='p%d' % i, description='d', quantity=1, price='1.00',
+                image='products/p.jpg',
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def plan(self, url, table):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        main = re.compile(r'^SELECT .*? FROM "%s"' % table)
+        queries = [q['sql'] for q in ctx.captured_queries if main.match(q['sql'])]
+        self.assertTrue(queries, 'no query on %s for %s' % (table, url))
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries[0])
+            details = [row[-1] for row in cursor.fetchall()]
+        return response, details
+
+    def assertIndexed(self, url, table, seek=False, sorted_in_memory=False):
+        response, details = self.plan(url, table)
+        report = '%s:\n  %s' % (url, '\n  '.join(details))
+        for detail in details:
+            if not sorted_in_memory:
+                self.assertNotIn('TEMP B-TREE', detail, report)
+            if detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail:
+                self.assertIn('INDEX', detail, report)
+        if seek:
+            # A cursor page must start from the cursor, not scan up to it
+            self.assertTrue(any(d.startswith('SEARCH %s ' % table) for d in details), report)
+        return response
+
+    def assertPagesIndexed(self, url, table):
+        page = self.assertIndexed(url, table).json()
+        self.assertIsNotNone(page['next'], url)
+        self.assertIndexed(page['next'], table, seek=True)
+
+    def test_reviews(self):
+        b, u = self.business.pk, self.user.pk
+        for url in ['/api/reviews/?business=%d' % b, '/api/reviews/?user=%d' % u, '/api/reviews/?rating=5']:
+            self.assertIndexed(url, 'apis_review')
+        self.assertPagesIndexed('/api/reviews/?page_size=2', 'apis_review')
+        self.assertPagesIndexed('/api/reviews/?business=%d&page_size=2' % b, 'apis_review')
+
+    def test_events(self):
+        b = self.business.pk
+        for url in ['/api/events/?business=%d&status=published' % b, '/api/events/?business=%d' % b,
+                    '/api/events/?status=published']:
+            self.assertIndexed(url, 'apis_event')
+        self.assertPagesIndexed('/api/events/?page_size=2', 'apis_event')
+        self.assertPagesIndexed('/api/events/?business=%d&status=published&page_size=2' % b, 'apis_event')
+
+    def test_messages(self):
+        b, u = self.business.pk, self.user.pk
+        for url in ['/api/messages/?business=%d&is_read=false' % b, '/api/messages/?business=%d' % b,
+                    '/api/messages/?user=%d' % u]:
+            self.assertIndexed(url, 'apis_messages')
+        self.assertPagesIndexed('/api/messages/?page_size=2', 'apis_messages')
+        self.assertPagesIndexed('/api/messages/?business=%d&is_read=true&page_size=2' % b, 'apis_messages')
+
+    def test_inventory(self):
+        self.assertIndexed('/api/inventory/?business=%d' % self.business.pk, 'apis_inventory')
+        self.assertPagesIndexed('/api/inventory/?business=%d&page_size=2' % self.business.pk, 'apis_inventory')
+
+    def test_conversations(self):
+        Messages.objects.create(business=self.business, user=APITestData.make_user(), content='hi')
+        self.client.force_authenticate(self.business.owner)
+        self.assertPagesIndexed('/api/conversations/?business=%d&page_size=1' % self.business.pk, 'apis_conversation')
+        self.client.force_authenticate(self.user)
+        self.assertIndexed('/api/conversations/?user=%d' % self.user.pk, 'apis_conversation')
+
+    def test_businesses(self):
+        for url in ['/api/businesses/?category=SALON', '/api/businesses/?zipcode=10001',
+                    '/api/businesses/?category=SALON&open_at=2030-01-07T10:00']:
+            self.assertIndexed(url, 'apis_business')
+        # Distance is computed per row, so only the bounding box can use an index
+        self.assertIndexed('/api/businesses/?near=10001&radius_km=5', 'apis_business', sorted_in_memory=True)
+
+
+@override_settings(APIS_READ_DATABASE='replica')
+class ReadWriteRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReadWriteRouter()
+
+    def test_reads_use_the_read_alias_and_writes_the_default(self):
+        self.assertEqual(self.router.db_for_read(Business), 'replica')
+        self.assertEqual(self.router.db_for_write(Business), 'default')
+
+    def test_reads_inside_a_transaction_see_its_writes(self):
+        with mock.patch.object(connection, 'in_atomic_block', True):
+            self.assertEqual(self.router.db_for_read(Business), 'default')
+
+    def test_related_reads_follow_the_instance(self):
+        business = Business(b_name='b')
+        business._state.db = 'default'
+        self.assertEqual(self.router.db_for_read(Users, instance=business), 'default')
+
+    def test_only_the_default_database_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'apis'))
+        self.assertFalse(self.router.allow_migrate('replica', 'apis'))
+
+    @override_settings(APIS_READ_DATABASE=None)
+    def test_without_a_read_alias_everything_uses_the_default(self):
+        self.assertEqual(self.router.db_for_read(Business), 'default')
+
+
+class RealtimeMessageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = APITestData.make_user()
+        cls.other = APITestData.make_user(username='other')
+        cls.business = APITestData.make_business()
+
+    def setUp(self):
+        broker = realtime.LocalBroker()
+        patcher = mock.patch.object(realtime, '_broker', broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.broker = broker
+
+    def create_message(self, user=None, content='hi'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Messages.objects.create(business=self.business, user=user or self.user, content=content)
+
+    @staticmethod
+    def auth(user, **headers):
+        return dict(headers, Authorization='Bearer %s' % AccessToken.for_user(user))
+
+    async def read(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), 2)
+        return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+    async def test_new_messages_are_pushed_to_matching_streams(self):
+        response = await AsyncClient().get(
+            '/api/messages/stream/?business=%d&user=%d' % (self.business.pk, self.user.pk), headers=self.auth(self.user),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await self.read(stream)).startswith('retry:'))
+
+        # Only messages from this user reach the stream
+        await sync_to_async(self.create_message)(user=self.other, content='not yours')
+        mine = await sync_to_async(self.create_message)(content='hello')
+        chunk = await self.read(stream)
+        self.assertIn('id: %d\nevent: message\n' % mine.pk, chunk)
+        data = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual((data['content'], data['user_name']), ('hello', self.user.username))
+
+        # A client disconnect cancels the pending read, which unsubscribes the stream
+        pending = asyncio.ensure_future(self.read(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(self.broker._subscriptions, {})
+
+    async def test_reconnect_replays_missed_messages(self):
+        first = await sync_to_async(self.create_message)(content='seen')
+        missed = await sync_to_async(self.create_message)(content='missed')
+        response = await AsyncClient().get(
+            '/api/messages/stream/?business=%d' % self.business.pk,
+            headers=self.auth(self.business.owner, **{'Last-Event-ID': str(first.pk)}),
+        )
+        stream = aiter(response.streaming_content)
+        await self.read(stream)
+        self.assertIn('id: %d\n' % missed.pk, await self.read(stream))
+        await stream.aclose()
+
+    @override_settings(APIS_REALTIME_HEARTBEAT=0.01)
+    async def test_idle_streams_send_keep_alives(self):
+        token = AccessToken.for_user(self.user)
+        response = await AsyncClient().get('/api/messages/stream/?user=%d&token=%s' % (self.user.pk, token))
+        stream = aiter(response.streaming_content)
+        await self.read(stream)
+        self.assertEqual(await self.read(stream), ': keep-alive\n\n')
+        await stream.aclose()
+
+    async def test_slow_consumers_are_disconnected(self):
+        with override_settings(APIS_REALTIME_QUEUE_SIZE=1):
+            subscription = self.broker.subscribe(['business:1'])
+        for pk in (1, 2):
+            self.broker.publish(['business:1'], {'id': pk})
+        await asyncio.sleep(0)
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(await subscription.get(1), {'id': 1})
+        self.assertTrue(subscription.finished)
+
+    def test_messages_are_published_only_after_commit(self):
+        with mock.patch.object(self.broker, 'publish') as publish:
+            with self.captureOnCommitCallbacks() as callbacks:
+                message = Messages.objects.create(business=self.business, user=self.user, content='hi')
+            publish.assert_not_called()
+            callbacks[0]()
+        channels, event = publish.call_args.args
+        self.assertEqual(channels, ['business:%d' % self.business.pk, 'user:%d' % self.user.pk])
+        self.assertEqual(event['id'], message.pk)
+
+    def test_stream_requires_a_filter(self):
+        self.assertEqual(self.client.get('/api/messages/stream/').status_code, 400)
+        self.assertEqual(self.client.get('/api/messages/stream/?business=x').status_code, 400)
+
+    async def test_streams_are_private(self):
+        business_url = '/api/messages/stream/?business=%d' % self.business.pk
+        self.assertEqual((await AsyncClient().get(business_url)).status_code, 401)
+        self.assertEqual((await AsyncClient().get(business_url + '&token=nonsense')).status_code, 401)
+        headers = self.auth(self.other)
+        self.assertEqual((await AsyncClient().get(business_url, headers=headers)).status_code, 403)
+        response = await AsyncClient().get('/api/messages/stream/?user=%d' % self.user.pk, headers=headers)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.broker._subscriptions, {})
+
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.business = APITestData.make_business()
+        self.user = APITestData.make_user()
+        self.other = APITestData.make_user()
+
+    def message(self, content='hi', user=None, is_read=False):
+        return Messages.objects.create(business=self.business, user=user or self.user, content=content, is_read=is_read)
+
+    def conversation(self, user=None):
+        return Conversation.objects.get(business=self.business, user=user or self.user)
+
+    def test_maintained_on_create_update_delete(self):
+        first = self.message('first')
+        second = self.message('second ' + 'x' * 200)
+        conversation = self.conversation()
+        self.assertEqual((conversation.message_count, conversation.unread_count), (2, 2))
+        self.assertEqual((conversation.last_message_id, conversation.last_date), (second.pk, second.date))
+        self.assertEqual(len(conversation.last_preview), Conversation.PREVIEW_LENGTH)
+
+        second = Messages.objects.get(pk=second.pk)
+        second.is_read = True
+        second.content = 'edited'
+        second.save()
+        conversation = self.conversation()
+        self.assertEqual((conversation.unread_count, conversation.last_preview), (1, 'edited'))
+
+        second.delete()
+        conversation = self.conversation()
+        self.assertEqual((conversation.message_count, conversation.unread_count), (1, 1))
+        self.assertEqual((conversation.last_message_id, conversation.last_preview), (first.pk, 'first'))
+
+    def test_moving_a_message_to_another_conversation(self):
+        message = Messages.objects.get(pk=self.message().pk)
+        message.user = self.other
+        message.save()
+        self.assertEqual((self.conversation().message_count, self.conversation().unread_count), (0, 0))
+        self.assertEqual(self.conversation(self.other).unread_count, 1)
+
+    def test_inbox_lists_newest_first_and_paginates(self):
+        self.message(user=self.other)
+        self.message('latest')
+        self.message(user=APITestData.make_user(), is_read=True)
+        self.client.force_authenticate(self.business.owner)
+        page = self.client.get('/api/conversations/?business=%d&unread=true&page_size=1' % self.business.pk).json()
+        self.assertEqual([row['last_preview'] for row in page['results']], ['latest'])
+        self.assertEqual(page['results'][0]['user_name'], self.user.username)
+        page = self.client.get(page['next']).json()
+        self.assertEqual([row['user'] for row in page['results']], [self.other.pk])
+        self.assertIsNone(page['next'])
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 400)
+
+    def test_mark_read_is_one_update(self):
+        messages = [self.message() for _ in range(3)]
+        conversation = self.conversation()
+        url = '/api/conversations/%d/read/' % conversation.pk
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, {'up_to': messages[1].pk}, format='json')
+        self.assertEqual(response.json(), {'marked_read': 2, 'unread_count': 1})
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "apis_messages"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Messages.objects.filter(is_read=False).get().pk, messages[2].pk)
+
+        response = self.client.post(url, {}, format='json')
+        self.assertEqual(response.json(), {'marked_read': 1, 'unread_count': 0})
+
+    def test_inbox_is_private(self):
+        self.message('mine')
+        self.message('theirs', user=self.other)
+        url = '/api/conversations/?business=%d' % self.business.pk
+        read_url = '/api/conversations/%d/read/' % self.conversation().pk
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.post(read_url, {}, format='json').status_code, 401)
+
+        self.client.force_authenticate(self.other)
+        page = self.client.get(url).json()
+        self.assertEqual([row['last_preview'] for row in page['results']], ['theirs'])
+        self.assertEqual(self.client.get('/api/conversations/?user=%d' % self.user.pk).json()['results'], [])
+        self.assertEqual(self.client.post(read_url, {}, format='json').status_code, 404)
+        self.assertEqual(self.conversation().unread_count, 1)
+
+    def test_reconcile_command(self):
+        self.message('a')
+        self.message('b', is_read=True)
+        Conversation.objects.update(message_count=9, unread_count=9, last_preview='stale')
+        empty = Conversation.objects.create(business=self.business, user=self.other, message_count=3)
+        call_command('reconcile_conversations', stdout=StringIO())
+        conversation = self.conversation()
+        self.assertEqual((conversation.message_count, conversation.unread_count, conversation.last_preview), (2, 1, 'b'))
+        self.assertEqual(Conversation.objects.get(pk=empty.pk).message_count, 0)
+
+
+class SharedThrottleTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def assertBucket(self, store):
+        # 3 per hour: a burst of three, then one every 20 minutes
+        allowed = [store.acquire('k', 1200, 3, 1000.0) is None for _ in range(4)]
+        self.assertEqual(allowed, [True, True, True, False])
+        self.assertAlmostEqual(store.acquire('k', 1200, 3, 1000.0), 1200)
+        self.assertIsNone(store.acquire('k', 1200, 3, 2200.0))
+        self.assertIsNotNone(store.acquire('k', 1200, 3, 2200.0))
+        self.assertIsNone(store.acquire('other', 1200, 3, 2200.0))
+
+    def test_memory_store(self):
+        self.assertBucket(throttling.MemoryThrottleStore())
+
+    def test_sqlite_store(self):
+        self.assertBucket(throttling.SQLiteThrottleStore(os.path.join(self.tmp, 'throttle.sqlite3')))
+
+    def test_sqlite_store_defaults_to_base_dir(self):
+        with override_settings(BASE_DIR=self.tmp):
+            self.assertEqual(throttling.SQLiteThrottleStore().path, os.path.join(self.tmp, 'apis-throttle.sqlite3'))
+        with override_settings(BASE_DIR=None), self.assertRaises(ImproperlyConfigured):
+            throttling.SQLiteThrottleStore()
+
+    def test_sqlite_store_is_shared_and_atomic(self):
+        path = os.path.join(self.tmp, 'throttle.sqlite3')
+        # Separate store objects stand in for worker processes
+        stores = [throttling.SQLiteThrottleStore(path) for _ in range(4)]
+        results = []
+
+        def hammer(store):
+            for _ in range(25):
+                results.append(store.acquire('shared', 3600 / 10, 10, 5000.0) is None)
+
+        threads = [threading.Thread(target=hammer, args=(store,)) for store in stores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 10)
+
+    @override_settings(APIS_THROTTLE_STORE='apis.throttling.MemoryThrottleStore')
+    def test_login_is_limited(self):
+        throttling.get_store().reset()
+        self.addCleanup(throttling.get_store().reset)
+        client = APIClient()
+        statuses = [
+            client.post('/api/login/', {'username': 'nobody', 'password': 'x'}, format='json').status_code
+            for _ in range(4)
+        ]
+        self.assertEqual(statuses, [401, 401, 401, 429])
+        response = client.post('/api/login/', {'username': 'nobody', 'password': 'x'}, format='json')
+        self.assertIn('allowed requests per hour', response.json()['detail'])
+        self.assertGreater(int(response['Retry-After']), 0)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        # Views read DEFAULT_AUTHENTICATION_CLASSES when APIView is defined
+        patcher = mock.patch.object(APIView, 'authentication_classes', [CachedJWTAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        self.owner = APITestData.make_user(is_business_owner=True)
+        self.business = APITestData.make_business(owner=self.owner)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % AccessToken.for_user(self.owner))
+
+    def test_repeat_requests_skip_the_user_query(self):
+        self.assertEqual(len(self.client.get('/api/businesses/owner/').json()), 1)
+        with self.assertNumQueries(1):
+            rows = self.client.get('/api/businesses/owner/').json()
+        self.assertEqual([row['id'] for row in rows], [self.business.pk])
+
+    def test_saving_a_user_evicts_it(self):
+        self.client.get('/api/businesses/owner/')
+        self.owner.is_active = False
+        self.owner.save()
+        self.assertEqual(self.client.get('/api/businesses/owner/').status_code, 401)
+
+    def test_cached_users_are_still_checked(self):
+        self.client.get('/api/businesses/owner/')
+        # A bulk update skips signals; the cached copy is reused but checked
+        Users.objects.filter(pk=self.owner.pk).update(is_active=False)
+        user_cache.set(self.owner.pk, Users.objects.get(pk=self.owner.pk))
+        self.assertEqual(self.client.get('/api/businesses/owner/').status_code, 401)
+
+    def test_cache_is_bounded_and_expires(self):
+        users = [APITestData.make_user() for _ in range(3)]
+        with override_settings(APIS_AUTH_USER_CACHE_SIZE=2):
+            for user in users:
+                user_cache.set(user.pk, user)
+            self.assertIsNone(user_cache.get(Users, users[0].pk))
+            self.assertEqual(user_cache.get(Users, users[2].pk).username, users[2].username)
+        with override_settings(APIS_AUTH_USER_CACHE_TTL=0):
+            user_cache.set(users[0].pk, users[0])
+            self.assertIsNone(user_cache.get(Users, users[0].pk))
+
+
+FAST_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+
+@override_settings(
+    PASSWORD_HASHERS=FAST_HASHERS,
+    APIS_THROTTLE_STORE='apis.throttling.MemoryThrottleStore',
+)
+class AsyncAuthTests(TestCase):
+    def setUp(self):
+        throttling.get_store().reset()
+        self.addCleanup(throttling.get_store().reset)
+        self.client = AsyncClient()
+
+    async def post(self, url, data):
+        return await self.client.post(url, data, content_type='application/json')
+
+    async def test_signup_then_login(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        with override_settings(MEDIA_ROOT=media_root):
+            response = await self.client.post('/api/async/signup/', {
+                'username': 'alice', 'password': 's3cret', 'location': 'Town', 'profile_picture': make_jpeg(),
+            })
+        self.assertEqual((response.status_code, response.json()), (201, {'message': 'User created successfully!'}))
+        user = await Users.objects.aget(username='alice')
+        self.assertTrue(user.password.startswith('md5$'))
+
+        response = await self.post('/api/async/login/', {'username': 'alice', 'password': 's3cret'})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['userId'], body['username']), (user.pk, 'alice'))
+        self.assertIn('access', body)
+
+        response = await self.post('/api/async/login/', {'username': 'alice', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_signup_validation_errors(self):
+        await sync_to_async(APITestData.make_user)(username='taken')
+        response = await self.post('/api/async/signup/', {'username': 'taken', 'password': 'x', 'location': 'Town'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('username', response.json())
+
+    async def test_login_upgrades_outdated_hashes(self):
+        from django.contrib.auth.hashers import PBKDF2SHA1PasswordHasher
+
+        old = PBKDF2SHA1PasswordHasher().encode('s3cret', 'saltsalt', iterations=1)
+        user = await sync_to_async(APITestData.make_user)(password='unused')
+        await Users.objects.filter(pk=user.pk).aupdate(password=old)
+
+        response = await self.post('/api/async/login/', {'username': user.username, 'password': 's3cret'})
+        self.assertEqual(response.status_code, 200)
+        user = await Users.objects.aget(pk=user.pk)
+        self.assertTrue(user.password.startswith('md5$'))
+        self.assertTrue(await sync_to_async(user.check_password)('s3cret'))
+
+    @override_settings(APIS_PASSWORD_QUEUE=0)
+    async def test_full_hashing_pool_sheds_load(self):
+        response = await self.post('/api/async/login/', {'username': 'anyone', 'password': 'x'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    async def test_shares_the_hourly_limit(self):
+        statuses = [
+            (await self.post('/api/async/login/', {'username': 'nobody', 'password': 'x'})).status_code
+            for _ in range(4)
+        ]
+        self.assertEqual(statuses, [401, 401, 401, 429])
+
+    def test_pool_runs_hashing_off_the_calling_thread(self):
+        async def hash_in_pool():
+            return await passwords.run(lambda: threading.current_thread().name)
+
+        self.assertTrue(asyncio.run(hash_in_pool()).startswith('password-hashing'))
+
+
+@without_response_cache
+class OpeningHoursTests(TestCase):
+    def test_intervals(self):
+        monday = 0
+        friday, sunday = 4 * hours.DAY_MINUTES, 6 * hours.DAY_MINUTES
+        default = hours.intervals(default_work_time())
+        self.assertEqual(len(default), 6)
+        self.assertEqual(default[0], (monday + 9 * 60, monday + 17 * 60))
+
+        self.assertEqual(hours.intervals({
+            'Fri': {'open': '10 PM', 'close': '2:00'},
+            'Sunday': {'open': '20:00', 'close': '01:30'},
+            'Wednesday': {'open': '00:00', 'close': '00:00'},
+            'Tuesday': {'open': 'Closed', 'close': 'Closed'},
+            'Someday': {'open': '09:00', 'close': '10:00'},
+            'Thursday': 'Closed',
+        }), [
+            (0, 90),
+            (2 * hours.DAY_MINUTES, 3 * hours.DAY_MINUTES),
+            (friday + 22 * 60, friday + hours.DAY_MINUTES + 2 * 60),
+            (sunday + 20 * 60, hours.WEEK_MINUTES),
+        ])
+        self.assertEqual(hours.intervals(None), [])
+
+    def test_open_filters(self):
+        nine_to_five = APITestData.make_business()
+        night = APITestData.make_business(work_time={'Sunday': {'open': '22:00', 'close': '03:00'}})
+        client = APIClient()
+
+        def open_at(moment):
+            return [row['id'] for row in client.get('/api/businesses/', {'open_at': moment}).json()]
+
+        # 2030-01-07 is a Monday
+        self.assertEqual(open_at('2030-01-07T10:00'), [nine_to_five.pk])
+        self.assertEqual(open_at('2030-01-07T02:30'), [night.pk])
+        self.assertEqual(open_at('2030-01-07T17:00'), [])
+        self.assertEqual(open_at('2030-01-06T23:00+00:00'), [night.pk])
+        self.assertEqual(client.get('/api/businesses/', {'open_at': 'soon'}).status_code, 400)
+
+        with mock.patch('apis.views.timezone.now', return_value=datetime.datetime(2030, 1, 5, 12, tzinfo=datetime.timezone.utc)):
+            rows = client.get('/api/businesses/', {'open_now': 'true'}).json()
+        self.assertEqual([row['id'] for row in rows], [nine_to_five.pk])
+
+        nine_to_five.work_time = {'Monday': {'open': 'Closed', 'close': 'Closed'}}
+        nine_to_five.save()
+        self.assertEqual(open_at('2030-01-07T10:00'), [])
+
+    def test_rebuild_command(self):
+        business = APITestData.make_business()
+        OpeningHours.objects.all().delete()
+        call_command('rebuild_opening_hours', stdout=StringIO())
+        self.assertEqual(OpeningHours.objects.filter(business=business).count(), 6)
+
+
+@without_response_cache
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        ZipcodeCentroid.objects.create(zipcode='10001', latitude=40.7506, longitude=-73.9972)
+        owner = APITestData.make_user(is_business_owner=True)
+        self.first = APITestData.make_business(owner, zipcode='10001')
+        self.second = APITestData.make_business(owner, zipcode='10001')
+        Review.objects.create(business=self.first, user=owner, title='Good', content='Good', rating=4)
+
+    def test_fields_and_exclude(self):
+        rows = self.client.get('/api/businesses/?fields=id,b_name').json()
+        self.assertEqual([set(row) for row in rows], [{'id', 'b_name'}] * 2)
+        row = self.client.get('/api/businesses/%d/?exclude=description,work_time' % self.first.pk).json()
+        self.assertNotIn('description', row)
+        self.assertIn('rating_histogram', row)
+        response = self.client.get('/api/businesses/?fields=id,nope')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('nope', response.json()['fields'])
+
+    def test_writes_ignore_fieldsets(self):
+        self.client.force_authenticate(self.first.owner)
+        response = self.client.patch('/api/businesses/%d/?fields=id' % self.first.pk, {'b_name': 'Renamed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['b_name'], 'Renamed')
+
+    def test_compact_matches_full_serializer(self):
+        fields = ','.join(BusinessListCreateView.compact_fields)
+        full = self.client.get('/api/businesses/?fields=' + fields).json()
+        with CaptureQueriesContext(connection) as ctx:
+            compact = self.client.get('/api/businesses/?compact=true').json()
+        self.assertEqual(compact, full)
+        self.assertEqual(compact[0]['rating_average'], 4.0)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('description', ctx.captured_queries[0]['sql'])
+
+    def test_compact_pagination_and_annotations(self):
+        page = self.client.get('/api/businesses/?compact=true&fields=b_name&page_size=1').json()
+        self.assertEqual(page['results'], [{'b_name': self.first.b_name}])
+        page = self.client.get(page['next']).json()
+        self.assertEqual(page['results'], [{'b_name': self.second.b_name}])
+        rows = self.client.get('/api/businesses/?compact=true&near=10001').json()
+        self.assertEqual(rows[0]['distance_km'], 0.0)
+
+    def test_compact_falls_back_for_computed_fields(self):
+        rows = self.client.get('/api/businesses/?compact=true&fields=id,rating_count').json()
+        self.assertEqual(rows, [
+            {'id': self.first.pk, 'rating_count': 1},
+            {'id': self.second.pk, 'rating_count': 0},
+        ])
+
+
+@without_response_cache
+class JSONRenderingTests(TestCase):
+    def test_output_matches_json_renderer(self):
+        business = APITestData.make_business()
+        Review.objects.create(business=business, user=business.owner, title='Good', content='Good', rating=4)
+        data = {
+            'reviews': ReviewSerializer(Review.objects.all(), many=True).data,
+            'price': decimal.Decimal('9.50'),
+            'at': datetime.datetime(2030, 1, 7, 10, 30, 15, tzinfo=datetime.timezone.utc),
+            'day': datetime.date(2030, 1, 7),
+            'id': uuid.UUID(int=1),
+            'label': gettext_lazy('Invalid credentials'),
+        }
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        self.assertIn(b'\n  ', ORJSONRenderer().render({'a': 1}, 'application/json; indent=4'))
+
+    @override_settings(APIS_THROTTLE_STORE='apis.throttling.MemoryThrottleStore')
+    @mock.patch.object(APIView, 'parser_classes', [ORJSONParser])
+    @mock.patch.object(APIView, 'renderer_classes', [ORJSONRenderer])
+    def test_views_render_and_parse(self):
+        throttling.get_store().reset()
+        self.addCleanup(throttling.get_store().reset)
+        client = APIClient()
+        response = client.post('/api/login/', '{"username": "nobody", "password": "x"}', content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Invalid credentials'})
+        response = client.post('/api/login/', '{"username":', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    def test_negotiation(self):
+        self.assertEqual(middleware.choose_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(middleware.choose_encoding('gzip;q=0, identity'), None)
+        self.assertEqual(middleware.choose_encoding('*'), 'gzip')
+        self.assertEqual(middleware.choose_encoding(''), None)
+        with mock.patch.object(middleware, 'brotli', object()):
+            self.assertEqual(middleware.choose_encoding('gzip, br'), 'br')
+            self.assertEqual(middleware.choose_encoding('br;q=0.5, gzip'), 'gzip')
+
+    def process(self, response, accept='gzip'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return middleware.CompressionMiddleware(lambda request: response)(request)
+
+    @override_settings(APIS_COMPRESSION_MIN_SIZE=1024)
+    def test_compresses_large_bodies_only(self):
+        body = json.dumps([{'id': n, 'name': 'Business %d' % n} for n in range(100)]).encode()
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = '"abc"'
+        response = self.process(response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), body)
+
+        self.assertFalse(self.process(HttpResponse(b'{"id": 1}')).has_header('Content-Encoding'))
+        self.assertFalse(self.process(HttpResponse(body), accept='identity').has_header('Content-Encoding'))
+
+    def test_streams(self):
+        chunks = [b'id,name\n'] + [b'%d,Business %d\n' % (n, n) for n in range(200)]
+        response = self.process(StreamingHttpResponse(iter(chunks), content_type='text/csv'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(chunks))
+
+        events = StreamingHttpResponse(iter([b'data: 1\n\n']), content_type='text/event-stream')
+        self.assertFalse(self.process(events).has_header('Content-Encoding'))
+
+    @override_settings(APIS_COMPRESSION_MIN_SIZE=10)
+    def test_leaves_files_ranges_and_binary_alone(self):
+        body = b'x' * 5000
+        partial = StreamingHttpResponse(iter([body[:1000]]), status=206, content_type='text/plain')
+        partial['Content-Range'] = 'bytes 0-999/5000'
+        partial['ETag'] = '"abc"'
+        partial = self.process(partial)
+        self.assertFalse(partial.has_header('Content-Encoding'))
+        self.assertEqual(partial['ETag'], '"abc"')
+
+        self.assertFalse(self.process(HttpResponse(body, content_type='image/jpeg')).has_header('Content-Encoding'))
+        file_response = FileResponse(BytesIO(body), content_type='text/plain')
+        self.assertFalse(self.process(file_response).has_header('Content-Encoding'))
+        self.assertEqual(self.process(HttpResponse(body, content_type='application/problem+json'))['Content-Encoding'], 'gzip')
+
+
+@without_response_cache
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, APIS_THROTTLE_STORE='apis.throttling.MemoryThrottleStore')
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command(
+            'seed_data', users=20, businesses=10, reviews=200, messages=40, inventory=20, events=10, images=3,
+            stdout=StringIO(), stderr=StringIO(),
+        )
+
+    def test_seeded_rows_and_derived_tables(self):
+        self.assertEqual(Business.objects.count(), 10)
+        self.assertEqual(Review.objects.count(), 200)
+        self.assertEqual(sum(BusinessRating.objects.values_list('review_count', flat=True)), 200)
+        self.assertEqual(sum(Conversation.objects.values_list('message_count', flat=True)), 40)
+        self.assertEqual(OpeningHours.objects.count(), 60)
+        image = BusinessImages.objects.first().image_1
+        self.assertEqual(BusinessImages.objects.count(), 3)
+        self.assertTrue(default_storage.exists(image.name))
+        self.assertTrue(self.client.login(username=Users.objects.first().username, password=benchmarks.SEED_PASSWORD))
+
+    def test_every_url_is_benchmarked(self):
+        cases, skipped = benchmarks.build_cases(benchmarks.Samples())
+        self.assertEqual({case.name for case in cases} | set(skipped), set(benchmarks.url_names()))
+        self.assertEqual(skipped, {})
+
+    def test_baseline_and_compare(self):
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('benchmark', repeat=2, warmup=0, output=path, stdout=StringIO(), stderr=StringIO())
+        with open(path) as f:
+            baseline = json.load(f)
+        self.assertEqual(baseline['rows']['review'], 200)
+        for key, result in baseline['results'].items():
+            self.assertTrue(all(status < 400 for status in result['status']), (key, result))
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        # The writes were rolled back
+        self.assertEqual(Business.objects.count(), 10)
+        self.assertFalse(Users.objects.filter(username__startswith='benchmark').exists())
+
+        slower = json.loads(json.dumps(baseline))
+        slower['results']['business-detail']['p99_ms'] += 50
+        slower['results']['business-detail']['queries'] += 1
+        self.assertEqual(benchmarks.compare(baseline, baseline), [])
+        self.assertEqual(
+            [(key, metric) for key, metric, _, _ in benchmarks.compare(baseline, slower)],
+            [('business-detail', 'p99_ms'), ('business-detail', 'queries')],
+        )
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmarks.percentile(values, 50), 50)
+        self.assertEqual(benchmarks.percentile(values, 99), 99)
+        self.assertEqual(benchmarks.percentile([7], 99), 7)
+
+
+@without_response_cache
+class ProfilingTests(TestCase):
+    middleware = middleware_first('apis.profiling.ProfilingMiddleware')
+
+    def setUp(self):
+        self.business = APITestData.make_business()
+        Review.objects.create(business=self.business, user=self.business.owner, title='Good', content='Good', rating=4)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def get(self, url):
+        with override_settings(MIDDLEWARE=self.middleware, APIS_PROFILE_DIR=self.tmp, APIS_PROFILING_HEADER=True):
+            return APIClient().get(url)
+
+    def test_server_timing_and_log_line(self):
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('apis.profiling', 'INFO') as logs:
+            response = self.get('/api/reviews/?business=%d' % self.business.pk)
+        timing = dict(
+            (metric.split(';')[0], metric) for metric in response['Server-Timing'].split(', ')
+        )
+        self.assertEqual(set(timing), {'db', 'serialize', 'render', 'total'})
+        self.assertIn('desc="%d queries"' % len(queries.captured_queries), timing['db'])
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['route'], 'review-list-create')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['db_queries'], len(queries.captured_queries))
+        self.assertGreater(record['serialize_ms'], 0)
+        self.assertGreaterEqual(record['duration_ms'], record['db_ms'])
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_server_timing_only_with_debug_by_default(self):
+        for debug in [False, True]:
+            with override_settings(MIDDLEWARE=self.middleware, DEBUG=debug):
+                response = APIClient().get('/api/businesses/')
+            self.assertEqual('Server-Timing' in response, debug)
+
+    def test_timers_are_idle_outside_requests(self):
+        self.assertIsNone(profiling.current.get())
+        with profiling.span('serialize'):
+            ReviewSerializer(Review.objects.all(), many=True).data
+
+    def test_sampled_cprofile(self):
+        with override_settings(APIS_PROFILE_SAMPLE_RATE=1), self.assertLogs('apis.profiling', 'INFO') as logs:
+            self.get('/api/businesses/%d/' % self.business.pk)
+        self.assertIn('cumulative', logs.output[0])
+        [name] = os.listdir(self.tmp)
+        self.assertIn('-GET-business-detail-', name)
+        self.assertTrue(name.endswith('.prof'))
+
+    def test_slow_request_stack_samples(self):
+        with override_settings(APIS_PROFILE_SLOW_MS=0, APIS_PROFILE_INTERVAL=0.001):
+            with self.assertLogs('apis.profiling', 'WARNING') as logs:
+                self.get('/api/businesses/')
+        self.assertIn('Slow request GET /api/businesses/', logs.output[0])
+
+        token = profiling.sampler.track()
+        deadline = time.monotonic() + 0.05
+        while time.monotonic() < deadline:
+            pass
+        samples = profiling.sampler.untrack(token)
+        self.assertTrue(samples)
+        self.assertTrue(all('test_slow_request_stack_samples' in stack for stack in samples))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'metrics-tests'}},
+    APIS_THROTTLE_STORE='apis.throttling.MemoryThrottleStore',
+    MIDDLEWARE=middleware_first('apis.metrics.MetricsMiddleware'),
+)
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+        throttling.get_store().reset()
+        self.addCleanup(throttling.get_store().reset)
+        self.client = APIClient()
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_requests_by_route_and_status(self):
+        business = APITestData.make_business()
+        self.client.get('/api/businesses/')
+        self.client.get('/api/businesses/%d/' % business.pk)
+        self.client.get('/api/businesses/%d/' % business.pk)
+        self.client.get('/api/nowhere/')
+        samples = self.scrape()
+
+        self.assertEqual(samples['apis_requests_total{method="GET",route="business-detail",status="2xx"}'], 2)
+        self.assertEqual(samples['apis_requests_total{method="GET",route="business-list-create",status="2xx"}'], 1)
+        self.assertEqual(samples['apis_requests_total{method="GET",route="unresolved",status="4xx"}'], 1)
+        self.assertEqual(samples['apis_request_duration_seconds_count{method="GET",route="business-detail"}'], 2)
+        self.assertEqual(samples['apis_request_duration_seconds_bucket{method="GET",route="business-detail",le="+Inf"}'], 2)
+        self.assertGreater(samples['apis_response_size_bytes_sum{route="business-detail"}'], 0)
+        self.assertEqual(samples['apis_db_queries_bucket{route="business-detail",le="0.0"}'], 1)
+        self.assertEqual(samples['apis_db_queries_count{route="business-detail"}'], 2)
+        self.assertEqual(samples['apis_cache_requests_total{cache="response",result="hit"}'], 1)
+        self.assertEqual(samples['apis_cache_requests_total{cache="response",result="miss"}'], 2)
+
+    def test_throttle_rejections(self):
+        for _ in range(4):
+            self.client.post('/api/login/', {'username': 'nobody', 'password': 'x'})
+        self.assertEqual(self.scrape()['apis_throttle_rejections_total{throttle="HourlyRateThrottle"}'], 1)
+
+    def test_totals_across_threads_and_processes(self):
+        thread = threading.Thread(target=metrics.inc, args=('apis_throttle_rejections_total',), kwargs={'throttle': 'T'})
+        thread.start()
+        thread.join()
+        metrics.inc('apis_throttle_rejections_total', throttle='T')
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        other = {(name, pairs, part): value for (name, pairs, part), value in metrics.registry.snapshot().items()}
+        with open(os.path.join(tmp, 'metrics-1-other.json'), 'w') as f:
+            json.dump(metrics.encode(other), f)
+        with override_settings(APIS_METRICS_DIR=tmp):
+            metrics.flush()
+            self.assertIn(metrics.PROCESS_FILE, os.listdir(tmp))
+            totals = metrics.collect()
+        self.assertEqual(totals[('apis_throttle_rejections_total', (('throttle', 'T'),), '')], 4)
+
+    @override_settings(APIS_METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code, 200)
+
+
+class BusinessPageTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.businesses = [self.make_page_business() for _ in range(3)]
+        self.business = self.businesses[0]
+
+    @staticmethod
+    def make_page_business():
+        business = APITestData.make_business()
+        user = APITestData.make_user()
+        now = timezone.now()
+        BusinessImages.objects.create(business=business, image_1='business/front.jpg')
+        for days, status in [(-1, 'published'), (1, 'draft'), (3, 'published'), (2, 'published'), (4, 'published')]:
+            start = now + datetime.timedelta(days=days)
+            Event.objects.create(
+                business=business, name='in %d days' % days, description='d', status=status,
+                start_time=start, end_time=start + datetime.timedelta(hours=2),
+            )
+        for rating in [2, 5, 3, 4]:
+            Review.objects.create(business=business, user=user, title='t', content='c', rating=rating)
+        for n in range(3):
+            Inventory.objects.create(
+                business=business, product_name='p%d' % n, description='d', quantity=1, price='1.00',
+                image='products/p%d.jpg' % n,
+            )
+        return business
+
+    def test_page_contents(self):
+        ImageDerivative.objects.create(
+            source='products/p0.jpg', variants={'thumb': {'width': 1, 'height': 1, 'webp': 't.webp', 'jpeg': 't.jpg'}},
+        )
+        page = self.client.get('/api/businesses/%d/page/?events=2&reviews=2&inventory=2' % self.business.pk).json()
+        self.assertEqual(page['business']['b_name'], self.business.b_name)
+        self.assertEqual(page['business']['rating_count'], 4)
+        self.assertEqual(len(page['images']), 1)
+        self.assertEqual([event['name'] for event in page['events']], ['in 2 days', 'in 3 days'])
+        self.assertEqual([review['rating'] for review in page['reviews']], [5, 4])
+        self.assertTrue(page['reviews'][0]['user_name'])
+        inventory = page['inventory']
+        self.assertEqual([item['product_name'] for item in inventory['results']], ['p0', 'p1'])
+        self.assertIn('thumb', inventory['results'][0]['image_variants'])
+        rest = self.client.get(inventory['next']).json()
+        self.assertEqual([item['product_name'] for item in rest['results']], ['p2'])
+
+    def test_batch_costs_the_same_as_one(self):
+        ids = [business.pk for business in reversed(self.businesses)]
+        one, _ = self.count_queries('/api/businesses/%d/page/' % self.business.pk)
+        url = '/api/businesses/pages/?ids=%s,999999' % ','.join(map(str, ids))
+        self.assertEqual(self.count_queries(url)[0], one)
+        self.assertLessEqual(one, 6)
+        body = self.client.get(url).json()
+        self.assertEqual([page['business']['id'] for page in body['results']], ids)
+        self.assertEqual(body['missing'], [999999])
+        self.assertTrue(all(len(page['events']) == 3 for page in body['results']))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get('/api/businesses/999999/page/').status_code, 404)
+        for query in ['', 'ids=', 'ids=1,x', 'ids=' + ','.join(map(str, range(1, 30)))]:
+            response = self.client.get('/api/businesses/pages/?' + query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('ids', response.json())
+        response = self.client.get('/api/businesses/%d/page/?reviews=500' % self.business.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('reviews', response.json())
+
+    def test_cached_until_related_rows_change(self):
+        url = '/api/businesses/pages/?ids=%d&inventory=5' % self.business.pk
+        self.count_queries(url)
+        self.assertEqual(self.count_queries(url)[0], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Inventory.objects.create(
+                business=self.business, product_name='new', description='d', quantity=1, price='1.00', image='',
+            )
+        page = self.client.get(url).json()['results'][0]
+        self.assertEqual(page['inventory']['results'][-1]['product_name'], 'new')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            imports.InventoryImporter(self.business).run([(2, {
+                'product_name': 'new', 'description': 'd', 'quantity': 7, 'price': '1.00',
+            })])
+        page = self.client.get(url).json()['results'][0]
+        self.assertEqual(page['inventory']['results'][-1]['quantity'], 7)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(business=self.business, user=self.business.owner, title='t', content='c', rating=1)
+        self.assertEqual(self.client.get(url).json()['results'][0]['business']['rating_count'], 5)
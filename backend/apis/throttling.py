@@ -0,0 +1,158 @@
+"""
+Rate limiting with constant-size state shared by every worker process.
+
+DRF's SimpleRateThrottle keeps a list of request timestamps per client in
+the default cache. That list grows with the rate and is pickled on every
+check. With the per-process LocMemCache, each of N workers also counts on
+its own, which multiplies the limit by N.
+
+SharedRateThrottle uses GCRA (the generic cell rate algorithm, a token
+bucket that needs one number per client): requests are admitted at one per
+`duration / num_requests` seconds, with bursts of up to num_requests. The
+only state is the "theoretical arrival time" of the next request, updated
+atomically by the configured store:
+
+    SQLiteThrottleStore  a small SQLite file that every process on the host
+                         shares; a check is one UPSERT statement (default)
+    MemoryThrottleStore  a dict in this process, for single-process setups
+                         and tests
+
+Settings:
+    APIS_THROTTLE_STORE  store class (default:
+                         'apis.throttling.SQLiteThrottleStore')
+    APIS_THROTTLE_DB     file for SQLiteThrottleStore (default:
+                         'apis-throttle.sqlite3' in BASE_DIR). Keep it
+                         somewhere only the server's user can write: its
+                         rows decide who is let in.
+"""
+import os
+import random
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework.throttling import UserRateThrottle
+
+from . import metrics
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class MemoryThrottleStore:
+    purge_every = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrivals = {}
+        self._checks = 0
+
+    def acquire(self, key, interval, burst, now):
+        """
+        Admit one request for `key` at time `now`. Returns None when it is
+        allowed, otherwise the seconds until it would be.
+        """
+        tolerance = interval * (burst - 1)
+        with self._lock:
+            self._checks += 1
+            if self._checks % self.purge_every == 0:
+                self._arrivals = {k: tat for k, tat in self._arrivals.items() if tat > now}
+            tat = max(self._arrivals.get(key, now), now)
+            if tat - now > tolerance:
+                return tat - now - tolerance
+            self._arrivals[key] = tat + interval
+            return None
+
+    def reset(self):
+        with self._lock:
+            self._arrivals.clear()
+
+
+class SQLiteThrottleStore:
+    # Chance that a check also deletes expired rows
+    purge_probability = 0.001
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'APIS_THROTTLE_DB', None) or self.default_path()
+        self._local = threading.local()
+
+    @staticmethod
+    def default_path():
+        # Not the shared temp directory, where other users could read or plant the file
+        base_dir = getattr(settings, 'BASE_DIR', None)
+        if base_dir is None:
+            raise ImproperlyConfigured('Set APIS_THROTTLE_DB (or BASE_DIR) to use SQLiteThrottleStore.')
+        return os.path.join(base_dir, 'apis-throttle.sqlite3')
+
+    def connection(self):
+        # One connection per thread, reopened after a fork
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # The state is disposable: losing the last writes in a crash
+            # only forgives a few requests, so skip fsync.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS throttle (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID'
+            )
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def acquire(self, key, interval, burst, now):
+        tolerance = interval * (burst - 1)
+        connection = self.connection()
+        # Insert or advance the arrival time in one atomic statement; when
+        # the WHERE clause rejects the update no row is returned.
+        row = connection.execute(
+            'INSERT INTO throttle (key, tat) VALUES (:key, :now + :interval) '
+            'ON CONFLICT (key) DO UPDATE SET tat = max(tat, :now) + :interval '
+            'WHERE max(tat, :now) - :now <= :tolerance '
+            'RETURNING tat',
+            {'key': key, 'now': now, 'interval': interval, 'tolerance': tolerance},
+        ).fetchone()
+        if random.random() < self.purge_probability:
+            connection.execute('DELETE FROM throttle WHERE tat < ?', (now,))
+        if row is not None:
+            return None
+        (tat,) = connection.execute('SELECT tat FROM throttle WHERE key = ?', (key,)).fetchone()
+        return max(tat - now - tolerance, 0.0)
+
+    def reset(self):
+        self.connection().execute('DELETE FROM throttle')
+
+
+def get_store():
+    path = getattr(settings, 'APIS_THROTTLE_STORE', 'apis.throttling.SQLiteThrottleStore')
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = import_string(path)()
+        return _stores[path]
+
+
+class SharedRateThrottle(UserRateThrottle):
+    """UserRateThrottle with GCRA state kept in the shared throttle store."""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        return self.acquire(self.key)
+
+    def acquire(self, key):
+        self.wait_seconds = get_store().acquire(key, self.duration / self.num_requests, self.num_requests, self.timer())
+        if self.wait_seconds is not None:
+            metrics.inc('apis_throttle_rejections_total', throttle=type(self).__name__)
+        return self.wait_seconds is None
+
+    def client_key(self, request):
+        """The key UserRateThrottle uses for an anonymous client, for plain Django views."""
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
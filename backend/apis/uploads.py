@@ -0,0 +1,121 @@
+"""
+Resumable chunked uploads.
+
+Clients open an UploadSession with the file name and total size, then PUT
+the bytes in order with a `Content-Range: bytes <start>-<end>/<total>`
+header. Each chunk is streamed from the request straight into a partial
+file, so no worker holds the whole image in memory or for the whole
+transfer; after an interruption, GET the session to find the offset to
+resume from. Once complete, the session id can be sent in place of a file
+for any image field, and the partial file is moved (not copied) into its
+final location when the model is saved.
+
+Settings:
+    APIS_UPLOAD_DIR        where partial files are kept (default: FILE_UPLOAD_TEMP_DIR or the system temp dir)
+    APIS_UPLOAD_MAX_SIZE   largest accepted upload in bytes (default: 50 MB)
+    APIS_UPLOAD_CHUNK_SIZE largest accepted chunk in bytes (default: 8 MB)
+"""
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+
+READ_SIZE = 64 * 1024
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    pass
+
+
+def upload_dir():
+    path = (
+        getattr(settings, 'APIS_UPLOAD_DIR', None)
+        or settings.FILE_UPLOAD_TEMP_DIR
+        or os.path.join(tempfile.gettempdir(), 'apis-uploads')
+    )
+    os.makedirs(path, exist_ok=True)
+    return str(path)
+
+
+def max_size():
+    return getattr(settings, 'APIS_UPLOAD_MAX_SIZE', 50 * 1024 * 1024)
+
+
+def max_chunk_size():
+    return getattr(settings, 'APIS_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def partial_path(session):
+    return os.path.join(upload_dir(), '%s.part' % session.pk)
+
+
+def parse_content_range(header, size):
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError('A "Content-Range: bytes <start>-<end>/<total>" header is required.')
+    start, end, total = (int(value) for value in match.groups())
+    if total != size or start > end or end >= size:
+        raise UploadError('Content-Range does not fit this upload.')
+    if end - start + 1 > max_chunk_size():
+        raise UploadError('Chunks may be at most %d bytes.' % max_chunk_size())
+    return start, end
+
+
+def receive_chunk(stream, start, end):
+    """
+    Spool bytes start..end from `stream` into a temporary file of their own
+    (removed when closed), so a chunk only reaches the partial file once
+    its offset has been claimed.
+    """
+    expected = end - start + 1
+    written = 0
+    chunk = tempfile.NamedTemporaryFile(dir=upload_dir(), suffix='.chunk')
+    while written < expected:
+        data = stream.read(min(READ_SIZE, expected - written))
+        if not data:
+            break
+        chunk.write(data)
+        written += len(data)
+    if written != expected:
+        chunk.close()
+        raise UploadError('Expected %d bytes but received %d.' % (expected, written))
+    chunk.seek(0)
+    return chunk
+
+
+def write_chunk(session, chunk, start):
+    """Copy a received chunk into the partial file at `start`, and close it."""
+    # Never truncate: a later chunk may already have been written
+    descriptor = os.open(partial_path(session), os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(descriptor, 'r+b') as target, chunk:
+        target.seek(start)
+        shutil.copyfileobj(chunk, target, READ_SIZE)
+
+
+def discard(session):
+    try:
+        os.remove(partial_path(session))
+    except FileNotFoundError:
+        pass
+
+
+class AssembledUpload(File):
+    """
+    A finished upload. Exposing temporary_file_path() makes
+    FileSystemStorage move the file into place instead of copying it.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        super().__init__(open(partial_path(session), 'rb'), name=session.filename)
+
+    @property
+    def size(self):
+        return self.session.size
+
+    def temporary_file_path(self):
+        return partial_path(self.session)
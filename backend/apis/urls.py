@@ -1,22 +1,32 @@
-from django.urls import path
+from django.urls import path, re_path
 from .views import (
-    BusinessListCreateView, BusinessDetailView,
+    BusinessListCreateView, BusinessDetailView, BusinessExportView, BusinessPageView, BusinessPagesView,
     UsersListCreateView, UsersDetailView,
     EventListCreateView, EventDetailView,
     ReviewListCreateView, ReviewDetailView,
-    InventoryListCreateView, InventoryDetailView,
+    InventoryListCreateView, InventoryDetailView, InventoryImportView,
     MessagesListCreateView, MessagesDetailView,
+    ConversationListView, ConversationReadView,
     BusinessImagesListCreateView, BusinessImagesDetailView,
     UserSignUpView,
     LoginView,
-    BusinessOwnerView
+    BusinessOwnerView,
+    UploadSessionCreateView, UploadSessionDetailView,
 )
+from . import async_views
+from .realtime import message_stream
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
     path('businesses/', BusinessListCreateView.as_view(), name='business-list-create'),
     path('businesses/<int:pk>/', BusinessDetailView.as_view(), name='business-detail'),
     path('businesses/owner/', BusinessOwnerView.as_view(), name='business-owner-list'),
+    path('businesses/<int:pk>/page/', BusinessPageView.as_view(), name='business-page'),
+    path('businesses/pages/', BusinessPagesView.as_view(), name='business-pages'),
+    re_path(
+        r'^businesses/(?P<pk>\d+)/export/(?P<kind>reviews|inventory|messages)\.(?P<fmt>ndjson|csv)$',
+        BusinessExportView.as_view(), name='business-export',
+    ),
 
     path('users/', UsersListCreateView.as_view(), name='users-list-create'),
     path('users/<int:pk>/', UsersDetailView.as_view(), name='users-detail'),
@@ -29,17 +39,28 @@ urlpatterns = [
 
     path('inventory/', InventoryListCreateView.as_view(), name='inventory-list-create'),
     path('inventory/<int:pk>/', InventoryDetailView.as_view(), name='inventory-detail'),
+    path('inventory/import/', InventoryImportView.as_view(), name='inventory-import'),
 
     path('messages/', MessagesListCreateView.as_view(), name='messages-list-create'),
+    path('messages/stream/', message_stream, name='messages-stream'),
     path('messages/<int:pk>/', MessagesDetailView.as_view(), name='messages-detail'),
 
+    path('conversations/', ConversationListView.as_view(), name='conversation-list'),
+    path('conversations/<int:pk>/read/', ConversationReadView.as_view(), name='conversation-read'),
+
     path('business-images/', BusinessImagesListCreateView.as_view(), name='business-images-list-create'),
     path('business-images/<int:pk>/', BusinessImagesDetailView.as_view(), name='business-images-detail'),
+
+    path('uploads/', UploadSessionCreateView.as_view(), name='upload-create'),
+    path('uploads/<uuid:pk>/', UploadSessionDetailView.as_view(), name='upload-detail'),
     
     # path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     # path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     path('signup/', UserSignUpView.as_view(), name='user_signup'),
     path('login/', LoginView.as_view(), name='user_login'),
+    # Async equivalents for the ASGI deployment
+    path('async/signup/', async_views.signup, name='user_signup_async'),
+    path('async/login/', async_views.login, name='user_login_async'),
 
 ]
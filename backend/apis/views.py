@@ -2,16 +2,29 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework import generics, status, permissions
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import NotFound, PermissionDenied, Throttled, ValidationError
 from django.contrib.auth import authenticate
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Business, Users, Event, Review, Inventory, Messages, BusinessImages
-from rest_framework.throttling import UserRateThrottle
+from .models import (
+    Business, Users, Event, Review, Inventory, Messages, BusinessImages, ZipcodeCentroid, UploadSession,
+    Conversation,
+)
+from .throttling import SharedRateThrottle
+from .caching import CachedResponseMixin
+from .fieldsets import CompactListMixin
+from .pagination import InboxPagination, KeysetPagination
+from . import exports, geo, hours, imports, pages, search, uploads
 from .serializers import (
     BusinessSerializer, UsersSerializer, EventSerializer, 
     ReviewSerializer, InventorySerializer, MessagesSerializer, 
-    BusinessImagesSerializer,
-    UserSignUpSerializer
+    BusinessImagesSerializer, BusinessPageSerializer,
+    UserSignUpSerializer,
+    UploadSessionSerializer,
+    ConversationSerializer, MarkConversationReadSerializer,
 )
 
 class IsAuthenticatedOrReadOnly(permissions.BasePermission):
@@ -26,9 +39,12 @@ class IsBusinessOwnerPermission(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and request.user.is_business_owner
 
-class BusinessDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Business.objects.all()
+class BusinessDetailView(CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Business.objects.select_related('rating')
     serializer_class = BusinessSerializer
+
+    def get_cache_scopes(self):
+        return ['business:%s' % self.kwargs['pk'], 'businesses:bulk']
     
     
     permission_classes = [AllowAny]
@@ -39,14 +55,32 @@ class BusinessDetailView(generics.RetrieveUpdateDestroyAPIView):
         return super().get_permissions()  
 
 
-class BusinessListCreateView(generics.ListCreateAPIView):
+class BusinessListCreateView(CachedResponseMixin, CompactListMixin, generics.ListCreateAPIView):
     serializer_class = BusinessSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('id',)
+    # ?compact=true: what a map or result list shows
+    compact_fields = ['id', 'b_name', 'category', 'zipcode', 'latitude', 'longitude', 'images', 'rating_average']
+    cache_scopes = ['businesses']
+    # Set by get_queryset when ?q= results are ordered by relevance
+    search_ranked = False
+    default_radius_km = 10
+    max_radius_km = 500
+    # ?ordering= values sorted from the BusinessRating aggregates
+    rating_orderings = {
+        'rating': ('average_rating', 'id'),
+        '-rating': ('-average_rating', 'id'),
+        'reviews': ('review_count', 'id'),
+        '-reviews': ('-review_count', 'id'),
+    }
 
     def get_queryset(self):
-        queryset = Business.objects.all()
+        queryset = Business.objects.select_related('rating')
         
-        # Get category, address, zipcode, and b_name from query parameters
+        # Get q, near, category, address, zipcode, and b_name from query parameters
+        q = self.request.query_params.get('q', None)
+        near = self.request.query_params.get('near', None)
         category = self.request.query_params.get('category', None)
         address = self.request.query_params.get('address', None)
         zipcode = self.request.query_params.get('zipcode', None)
@@ -55,15 +89,109 @@ class BusinessListCreateView(generics.ListCreateAPIView):
         # Apply filters based on query parameters
         if category:
             queryset = queryset.filter(category=category)
-        if address:
-            queryset = queryset.filter(address__icontains=address)  # Case-insensitive search
         if zipcode:
             queryset = queryset.filter(zipcode=zipcode)
+
+        # Text filters go through the full-text index; terms too short for it
+        # (or databases without FTS5) fall back to case-insensitive scans.
+        matches = []
+        use_index = search.is_available()
+        if q:
+            match = search.build_match(q) if use_index else None
+            if match:
+                matches.append(match)
+                queryset = queryset.filter(search.short_term_filter(q))
+            else:
+                queryset = queryset.filter(
+                    Q(b_name__icontains=q) | Q(address__icontains=q) | Q(description__icontains=q)
+                )
+        if address:
+            match = search.build_match(address, column='address', phrase=True) if use_index else None
+            if match:
+                matches.append(match)
+            else:
+                queryset = queryset.filter(address__icontains=address)
         if b_name:
-            queryset = queryset.filter(b_name__icontains=b_name)  # Case-insensitive search
+            match = search.build_match(b_name, column='b_name', phrase=True) if use_index else None
+            if match:
+                matches.append(match)
+            else:
+                queryset = queryset.filter(b_name__icontains=b_name)
+        # Relevance ordering; pages then seek on (search_rank, id)
+        self.search_ranked = bool(matches) and bool(q)
+        if matches:
+            queryset = search.filter_queryset(queryset, ' AND '.join('(%s)' % m for m in matches), rank=self.search_ranked)
+
+        # Opening hours resolve in SQL against the OpeningHours intervals
+        moment = self.get_open_moment()
+        if moment is not None:
+            queryset = hours.filter_open(queryset, moment)
+
+        # Proximity search sorts by distance, overriding relevance ordering
+        if near:
+            latitude, longitude = self.get_near_point(near)
+            queryset = geo.filter_near(queryset, latitude, longitude, self.get_radius_km())
+
+        ordering = self.rating_orderings.get(self.request.query_params.get('ordering'))
+        if ordering:
+            queryset = queryset.annotate(
+                average_rating=Coalesce('rating__average', 0.0),
+                review_count=Coalesce('rating__review_count', 0),
+            ).order_by(*ordering)
         
         return queryset
 
+    def get_near_point(self, near):
+        # ?near=me uses the signed-in user's own zipcode
+        if near == 'me':
+            if not self.request.user.is_authenticated:
+                raise ValidationError({'near': 'You must be logged in to search near your location.'})
+            near = self.request.user.zipcode
+        latitude, longitude = ZipcodeCentroid.coordinates_for(near)
+        if latitude is None:
+            raise ValidationError({'near': 'Unknown zipcode.'})
+        return latitude, longitude
+
+    def get_open_moment(self):
+        open_at = self.request.query_params.get('open_at', None)
+        if open_at:
+            moment = hours.parse_moment(open_at)
+            if moment is None:
+                raise ValidationError({'open_at': 'An ISO 8601 date and time is required.'})
+            return moment
+        if self.request.query_params.get('open_now', None) == 'true':
+            return timezone.now()
+        return None
+
+    def get_radius_km(self):
+        radius = self.request.query_params.get('radius_km', self.default_radius_km)
+        try:
+            radius = float(radius)
+        except (TypeError, ValueError):
+            raise ValidationError({'radius_km': 'A number is required.'})
+        if not 0 < radius <= self.max_radius_km:
+            raise ValidationError({'radius_km': f'Must be between 0 and {self.max_radius_km}.'})
+        return radius
+
+    def get_compact_fields(self):
+        if self.request.query_params.get('near'):
+            return self.compact_fields + ['distance_km']
+        return self.compact_fields
+
+    def should_cache_response(self, request):
+        # ?near=me depends on who is asking, ?open_now=true on when
+        return request.query_params.get('near') != 'me' and request.query_params.get('open_now') != 'true'
+
+    def get_cursor_ordering(self):
+        ordering = self.rating_orderings.get(self.request.query_params.get('ordering'))
+        if ordering:
+            return ordering
+        if self.request.query_params.get('near'):
+            return ('distance_km', 'id')
+        if self.search_ranked:
+            return ('search_rank', 'id')
+        return self.cursor_ordering
+
     def perform_create(self, serializer):
         if self.request.user.is_authenticated:
             serializer.save(owner=self.request.user)
@@ -77,24 +205,81 @@ class BusinessOwnerView(generics.ListAPIView):
 
     def get_queryset(self):
         # Filter businesses based on the owner
-        return Business.objects.filter(owner=self.request.user)
+        return Business.objects.filter(owner=self.request.user).select_related('rating')
+
+
+class BusinessPageMixin:
+    serializer_class = BusinessPageSerializer
+    permission_classes = [AllowAny]
+
+    def get_page_cache_scopes(self, ids):
+        # business:<id> also covers its images and reviews
+        return [
+            *(f'business:{pk}' for pk in ids), *(f'inventory:{pk}' for pk in ids), 'businesses:bulk', 'events',
+        ]
+
+    def load_pages(self, ids):
+        businesses = pages.load(ids, pages.parse_limits(self.request.query_params), self.request)
+        # One image variant lookup for every list on every page
+        context = dict(self.get_serializer_context(), image_manifests=pages.image_manifests(businesses))
+        return businesses, context
+
+
+class BusinessPageView(CachedResponseMixin, BusinessPageMixin, generics.RetrieveAPIView):
+    """
+    Everything a business page shows in one response (see pages.py):
+    GET /api/businesses/<id>/page/. ?events=, ?reviews= and ?inventory=
+    set how many of each are included.
+    """
+
+    def get_cache_scopes(self):
+        return self.get_page_cache_scopes([self.kwargs['pk']])
+
+    def retrieve(self, request, *args, **kwargs):
+        businesses, context = self.load_pages([self.kwargs['pk']])
+        if not businesses:
+            raise NotFound()
+        return Response(BusinessPageSerializer(businesses[0], context=context).data)
+
+
+class BusinessPagesView(CachedResponseMixin, BusinessPageMixin, generics.ListAPIView):
+    """
+    The pages of several businesses at once, for the same queries as one:
+    GET /api/businesses/pages/?ids=1,2,3. Ids with no business are listed
+    under `missing`.
+    """
+
+    def get_cache_scopes(self):
+        return self.get_page_cache_scopes(pages.parse_ids(self.request.query_params.get('ids')))
+
+    def list(self, request, *args, **kwargs):
+        ids = pages.parse_ids(request.query_params.get('ids'))
+        businesses, context = self.load_pages(ids)
+        found = {business.pk for business in businesses}
+        return Response({
+            'results': BusinessPageSerializer(businesses, many=True, context=context).data,
+            'missing': [pk for pk in ids if pk not in found],
+        })
 
 
 class UsersListCreateView(generics.ListCreateAPIView):
-    queryset = Users.objects.all()
+    queryset = Users.objects.prefetch_related('groups', 'user_permissions')
     serializer_class = UsersSerializer
 
 class UsersDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Users.objects.all()
+    queryset = Users.objects.prefetch_related('groups', 'user_permissions')
     serializer_class = UsersSerializer
 
 
-class EventListCreateView(generics.ListCreateAPIView):
-    queryset = Event.objects.all()
+class EventListCreateView(CachedResponseMixin, generics.ListCreateAPIView):
+    queryset = Event.objects.select_related('business')
     serializer_class = EventSerializer
+    pagination_class = KeysetPagination
+    cursor_ordering = ('start_time', 'id')
+    cache_scopes = ['events']
 
     def get_queryset(self):
-        queryset = Event.objects.all()
+        queryset = Event.objects.select_related('business')
         business = self.request.query_params.get('business', None)
         status = self.request.query_params.get('status', None)
 
@@ -109,14 +294,16 @@ class EventListCreateView(generics.ListCreateAPIView):
 
 
 class EventDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Event.objects.all()
+    queryset = Event.objects.select_related('business')
     serializer_class = EventSerializer
 
 class ReviewListCreateView(generics.ListCreateAPIView):
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
+    cursor_ordering = ('business_id', '-rating', 'id')
 
     def get_queryset(self):
-        queryset = Review.objects.all()
+        queryset = Review.objects.select_related('business', 'user')
         
         # Get query parameters
         business = self.request.query_params.get('business', None)
@@ -137,15 +324,17 @@ class ReviewListCreateView(generics.ListCreateAPIView):
         return queryset
 
 class ReviewDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Review.objects.all()
+    queryset = Review.objects.select_related('business', 'user')
     serializer_class = ReviewSerializer
 
 class InventoryListCreateView(generics.ListCreateAPIView):
-    queryset = Inventory.objects.all()
+    queryset = Inventory.objects.select_related('business')
     serializer_class = InventorySerializer
+    pagination_class = KeysetPagination
+    cursor_ordering = ('business_id', 'id')
 
     def get_queryset(self):
-        queryset = Inventory.objects.all()
+        queryset = Inventory.objects.select_related('business')
         business_id = self.request.query_params.get('business', None)
 
         if business_id:
@@ -153,40 +342,209 @@ class InventoryListCreateView(generics.ListCreateAPIView):
 
         return queryset
 
+class InventoryImportView(APIView):
+    """
+    Upsert many products for one business from a CSV or NDJSON body:
+    POST /api/inventory/import/?business=<id>. Rows are matched on
+    product_name; the response reports created/updated counts and the
+    errors of every rejected line.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        business = Business.objects.filter(pk=request.query_params.get('business') or None).first()
+        if business is None:
+            return Response({'error': 'A valid ?business= id is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if business.owner_id != request.user.id:
+            raise PermissionDenied("You can only import inventory for your own business.")
+
+        content_type = request.content_type.split(';')[0].strip().lower()
+        if content_type in imports.CSV_TYPES:
+            parse = imports.iter_csv
+        elif content_type in imports.NDJSON_TYPES:
+            parse = imports.iter_ndjson
+        else:
+            return Response(
+                {'error': 'Send the rows as text/csv or application/x-ndjson.'},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+
+        # Read the raw stream; request.data would buffer and parse it all
+        stream = request.stream
+        if stream is None:
+            return Response({'error': 'The request body is empty.'}, status=status.HTTP_400_BAD_REQUEST)
+        report = imports.InventoryImporter(business).run(parse(stream))
+        return Response(report, status=status.HTTP_200_OK)
+
+class BusinessExportView(APIView):
+    """
+    Stream all reviews, inventory or messages of one business as NDJSON or
+    CSV: GET /api/businesses/<id>/export/<kind>.<ndjson|csv>.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk, kind, fmt):
+        business = generics.get_object_or_404(Business.objects.only('id', 'owner_id'), pk=pk)
+        if business.owner_id != request.user.id and not request.user.is_staff:
+            raise PermissionDenied("You can only export data for your own business.")
+        response = StreamingHttpResponse(exports.stream(kind, fmt, business), content_type=exports.FORMATS[fmt])
+        response['Content-Disposition'] = f'attachment; filename="business-{pk}-{kind}.{fmt}"'
+        return response
+
 class InventoryDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Inventory.objects.all()
+    queryset = Inventory.objects.select_related('business')
     serializer_class = InventorySerializer
 
 
 class MessagesListCreateView(generics.ListCreateAPIView):
-    queryset = Messages.objects.all()
+    queryset = Messages.objects.select_related('business', 'user')
     serializer_class = MessagesSerializer
+    pagination_class = KeysetPagination
+    cursor_ordering = ('date', 'id')
+
+    def get_queryset(self):
+        queryset = Messages.objects.select_related('business', 'user')
+        business = self.request.query_params.get('business', None)
+        user = self.request.query_params.get('user', None)
+        is_read = self.request.query_params.get('is_read', None)
+
+        if business:
+            queryset = queryset.filter(business_id=business)
+        if user:
+            queryset = queryset.filter(user_id=user)
+        if is_read in ('true', 'false'):
+            queryset = queryset.filter(is_read=is_read == 'true')
+
+        return queryset
 
 class MessagesDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Messages.objects.all()
+    queryset = Messages.objects.select_related('business', 'user')
     serializer_class = MessagesSerializer
 
+def visible_conversations(user):
+    """Conversations `user` takes part in, as the customer or the business owner."""
+    queryset = Conversation.objects.all()
+    if user.is_staff:
+        return queryset
+    return queryset.filter(Q(user=user) | Q(business__owner=user))
+
+class ConversationListView(generics.ListAPIView):
+    """
+    The inbox of a business (?business=) or a user (?user=), newest
+    conversation first, always paginated. ?unread=true keeps only
+    conversations with unread messages. Only the user and the business
+    owner of a conversation see it.
+    """
+    serializer_class = ConversationSerializer
+    pagination_class = InboxPagination
+    permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-last_date', '-id')
+
+    def get_queryset(self):
+        business = self.request.query_params.get('business', None)
+        user = self.request.query_params.get('user', None)
+        if not business and not user:
+            raise ValidationError({'detail': 'Pass business, user or both.'})
+
+        queryset = visible_conversations(self.request.user).select_related('business', 'user').filter(message_count__gt=0)
+        if business:
+            queryset = queryset.filter(business_id=business)
+        if user:
+            queryset = queryset.filter(user_id=user)
+        if self.request.query_params.get('unread', None) == 'true':
+            queryset = queryset.filter(unread_count__gt=0)
+
+        return queryset
+
+class ConversationReadView(APIView):
+    """Mark a whole conversation read in one UPDATE."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        serializer = MarkConversationReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Someone else's conversation is a 404, so ids do not leak
+        conversation = generics.get_object_or_404(visible_conversations(request.user), pk=pk)
+        marked = Conversation.mark_read(
+            conversation.business_id, conversation.user_id, up_to=serializer.validated_data.get('up_to'),
+        )
+        conversation.refresh_from_db(fields=['unread_count'])
+        return Response({'marked_read': marked, 'unread_count': conversation.unread_count})
+
 class BusinessImagesListCreateView(generics.ListCreateAPIView):
-    queryset = BusinessImages.objects.all()
+    queryset = BusinessImages.objects.select_related('business')
     serializer_class = BusinessImagesSerializer
 
 class BusinessImagesDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = BusinessImages.objects.all()
+    queryset = BusinessImages.objects.select_related('business')
     serializer_class = BusinessImagesSerializer
 
 
-class HourlyRateThrottle(UserRateThrottle):
+class UploadSessionCreateView(generics.CreateAPIView):
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+
+class UploadSessionDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    def put(self, request, *args, **kwargs):
+        # Append one chunk, streamed from the raw body (never request.data)
+        session = self.get_object()
+        try:
+            start, end = uploads.parse_content_range(request.META.get('HTTP_CONTENT_RANGE'), session.size)
+            if start != session.received:
+                return Response(
+                    {'error': 'Chunk does not start at the current offset.', 'received': session.received},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            chunk = uploads.receive_chunk(request.stream, start, end)
+        except uploads.UploadError as exc:
+            return Response({'error': str(exc), 'received': session.received}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Claim the offset before touching the partial file, so of two
+        # requests for the same offset only the winner's bytes are written
+        if not UploadSession.objects.filter(pk=session.pk, received=start).update(received=end + 1):
+            chunk.close()
+            session.refresh_from_db()
+            return Response(
+                {'error': 'Chunk does not start at the current offset.', 'received': session.received},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            uploads.write_chunk(session, chunk, start)
+        except OSError:
+            # Give the offset back so the client can retry the chunk
+            UploadSession.objects.filter(pk=session.pk, received=end + 1).update(received=start)
+            raise
+        session.received = end + 1
+        if session.received == session.size:
+            session.completed = True
+            UploadSession.objects.filter(pk=session.pk).update(completed=True)
+        return Response(self.get_serializer(session).data)
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+        instance.delete()
+
+
+class HourlyRateThrottle(SharedRateThrottle):
     rate = '3/h'  
+    message = "You have exceeded the number of allowed requests per hour."
 
     def allow_request(self, request, view):
         is_allowed = super().allow_request(request, view)
         
         if not is_allowed:  
-            response = Response(
-                {"message": "You have exceeded the number of allowed requests per hour."},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )  
-            return response
+            # A Response returned here would be truthy and let the request through
+            raise Throttled(wait=self.wait(), detail=self.message)
         return is_allowed
 
 
@@ -0,0 +1,122 @@
+"""
+Production database profile.
+
+Run with DJANGO_SETTINGS_MODULE=backend.settings_production. Everything
+else comes from settings.py; this changes how SQLite is opened:
+
+- WAL journaling, so a write (e.g. a message POST) no longer blocks readers.
+- synchronous=NORMAL, which is durable across application crashes in WAL
+  mode and skips an fsync per commit.
+- A memory-mapped file and a larger page cache per connection.
+- A busy timeout and BEGIN IMMEDIATE, so concurrent writers wait for the
+  lock instead of failing with "database is locked".
+- Persistent connections, so the pragmas above are paid once per worker
+  rather than once per request.
+- A read-only 'replica' alias on the same file, used for every read outside
+  a transaction by apis.routers.ReadWriteRouter.
+
+The response cache (apis.caching) lives in files under DJANGO_CACHE_DIR
+(default: BASE_DIR/cache), so a write or a management command that bumps
+a scope version is seen by every worker; the default per-process
+LocMemCache would let other workers serve stale responses.
+
+Uploads are stored content-addressed (apis.storage), so identical files
+are kept once and /media/ can mark them immutable; run
+`manage.py collect_media_garbage` now and then to drop unreferenced ones.
+
+It also renders and parses JSON with orjson, compresses large responses
+with brotli or gzip, reports per-request timings (apis.profiling) and
+serves Prometheus metrics at /metrics (apis.metrics). Set
+APIS_METRICS_DIR when running more than one worker process.
+"""
+import os
+from pathlib import Path
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES, MIDDLEWARE, REST_FRAMEWORK
+
+SQLITE_PATH = os.environ.get('DJANGO_SQLITE_PATH', str(DATABASES['default']['NAME']))
+SQLITE_BUSY_TIMEOUT = 5  # seconds
+SQLITE_PRAGMAS = [
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',  # 256 MiB
+    'PRAGMA cache_size=-65536',  # 64 MiB
+    'PRAGMA temp_store=MEMORY',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': SQLITE_PATH,
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            # journal_mode is stored in the database file; setting it on every
+            # connect is a no-op once the file is in WAL mode.
+            'init_command': ';'.join(['PRAGMA journal_mode=WAL'] + SQLITE_PRAGMAS),
+        },
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        # Django opens SQLite with uri=True
+        'NAME': Path(SQLITE_PATH).resolve().as_uri() + '?mode=ro',
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'init_command': ';'.join(SQLITE_PRAGMAS + ['PRAGMA query_only=ON']),
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+# Shared by every worker and management command on the host
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', str(BASE_DIR / 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# New uploads are stored under cas/; /media/ serves only that and the image
+# variants (APIS_MEDIA_PREFIXES), so files kept under their upload_to names
+# from before are not reachable through Django.
+STORAGES = {
+    'default': {'BACKEND': 'apis.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+DATABASE_ROUTERS = ['apis.routers.ReadWriteRouter']
+APIS_READ_DATABASE = 'replica'
+
+# Authenticated requests reuse recently loaded users instead of a query each
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_AUTHENTICATION_CLASSES': ['apis.authentication.CachedJWTAuthentication'],
+    'DEFAULT_RENDERER_CLASSES': [
+        'apis.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'apis.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Outermost, so it compresses the final body
+MIDDLEWARE = [
+    'apis.middleware.CompressionMiddleware',
+    # A timings log line per request (Server-Timing only with
+    # APIS_PROFILING_HEADER); profiles stay off until APIS_PROFILE_SAMPLE_RATE
+    # or APIS_PROFILE_SLOW_MS is set
+    'apis.profiling.ProfilingMiddleware',
+    'apis.metrics.MetricsMiddleware',
+    *MIDDLEWARE,
+]
+APIS_COMPRESSION_MIN_SIZE = 1024